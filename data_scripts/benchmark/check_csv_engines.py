@@ -0,0 +1,66 @@
+'''
+This script checks that the pandas and pyarrow CSV engines (SWAMP_CSV_ENGINE, see p_utils.read_csv) import the data files with the same column types. Each file is imported with both engines and the columns that have a different type are listed. A different type means that the file would be written back differently depending on the engine (ex. a text column of ISO dates that is imported as dates by one engine and written back in a different format)
+
+The check can be run on the support_files folder after a run of the data scripts, or on a benchmark workspace (see run_benchmark.py --keep-workspace). The script exits with an error if any column has a different type
+
+Usage:
+--- python check_csv_engines.py (checks the CSV files in the support_files folder)
+--- python check_csv_engines.py <files or folders>
+'''
+
+import argparse
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import p_utils # p_utils.py
+
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+support_files_dir = os.path.abspath(os.path.join(benchmark_dir, '..', '..', 'support_files'))
+
+
+# Function for getting the CSV files of a list of files and folders. The CSV files in each folder are included (not the subfolders)
+def get_csv_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.csv')))
+        else:
+            files.append(path)
+    return files
+
+# Function for importing a CSV file with both CSV engines and comparing the column types. Returns a list of (column, pandas type, pyarrow type) for the columns that have a different type
+def compare_engines(path):
+    pandas_df = p_utils.read_csv(path, engine='pandas', low_memory=False)
+    arrow_df = p_utils.read_csv(path, engine='pyarrow')
+    differences = []
+    for col in pandas_df.columns:
+        pandas_type = str(pandas_df[col].dtype)
+        arrow_type = str(arrow_df[col].dtype) if col in arrow_df.columns else 'missing'
+        if pandas_type != arrow_type:
+            differences.append((col, pandas_type, arrow_type))
+    return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the pandas and pyarrow CSV engines import the data files with the same column types')
+    parser.add_argument('paths', nargs='*', default=[support_files_dir], help='CSV files or folders of CSV files (default: the support_files folder)')
+    args = parser.parse_args()
+
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+    files = get_csv_files(args.paths)
+    failed = []
+    for path in files:
+        differences = compare_engines(path)
+        if differences:
+            failed.append(path)
+            print('--- %s: %s column(s) with a different type' % (path, len(differences)))
+            for col, pandas_type, arrow_type in differences:
+                print('------ %s: %s (pandas), %s (pyarrow)' % (col, pandas_type, arrow_type))
+    print('--- Checked %s file(s)' % len(files))
+    print('%s finished running' % os.path.basename(__file__))
+    if failed:
+        sys.exit('Files with different column types: %s' % ', '.join(failed))
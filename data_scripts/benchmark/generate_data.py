@@ -0,0 +1,565 @@
+'''
+This script generates synthetic CEDEN-shaped data, so that the data scripts can be run and benchmarked without access to the CEDEN data marts. The data is random, but it has the same columns as the data mart tables and similar value distributions:
+
+--- Codes (QACode, BatchVerification, ResultQualCode, SampleTypeCode, etc.) are drawn from the data quality rules file (see p_utils_dq.py), with most records having the common codes (ex. QACode None, ResultQualCode =) and a long tail of the other codes, including multi-valued codes (ex. VRIL,FDP) and codes that are not in the rules
+--- Non-detects (ND, DNQ) with missing or negative results, -88 placeholder values, field and lab replicates, QA stations (FIELDQA, LABQA), blank matrices, and invalid coordinates and sample dates
+--- Stations with a skewed number of records per station (a few stations have most of the records)
+--- Tissue individuals and composites with species-specific length distributions, and mercury results that increase with length (so that the length-adjusted average regressions are similar to the real data)
+
+The data mart tables are generated with generate_table (one chunk of rows at a time, so large tables can be generated with little memory). write_download_files applies the same filters as the SQL queries in the download scripts (see p_query.apply_conditions) and writes the files the download scripts write to the support_files folder (ceden_swamp_wq.csv, ceden_stations.csv, etc.)
+write_source_db writes the data mart tables to a local SQLite database instead, so the download scripts themselves can be run on the data (SWAMP_SOURCE=local, see p_source.py)
+
+The number of rows is the number of water quality rows. The other tables are scaled to about the same proportions as the real data. The same rows and seed always generate the same data
+
+Usage (from the benchmark folder, like the other data scripts): python generate_data.py --rows 1000000 --seed 1 --outdir <folder with support_files, assets, and export folders> [--source-db <database path>]
+'''
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import p_constants # p_constants.py
+import p_query # p_query.py
+import p_source # p_source.py
+import p_utils # p_utils.py
+import p_utils_dq # p_utils_dq.py
+
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+# Number of rows generated at a time
+chunk_rows = 500000
+
+# Number of rows of each table for each water quality row
+table_scales = {
+    'water_quality': 1,
+    'tissue': 0.05,
+    'toxicity': 0.02, # Toxicity samples. Each sample has 1 to 5 lab replicate rows
+    'habitat': 0.01
+}
+
+# Data mart table of each data type
+table_data_types = {table: data_type for data_type, table in p_constants.datamart_tables.items()}
+
+# Bounding box of the station coordinates (longitude, latitude). Also used for the synthetic RB boundaries
+station_bbox = (-124.2, 32.6, -114.3, 41.9)
+
+# Share of records that have each code. The remaining share is split over the other codes in the data quality rules file, with a long tail
+qa_code_shares = {'None': 0.82, 'NR': 0.01, 'VRIL,FDP': 0.004, 'BRK': 0.003, 'VFIRL': 0.002, 'J,VIP': 0.002}
+batch_verification_shares = {'VLC': 0.36, 'VAC': 0.3, 'VAC,VMD': 0.06, 'VMD': 0.05, 'NR': 0.05, 'VLC,VMD': 0.03, 'VQI': 0.02}
+result_qual_code_shares = {'=': 0.78, 'ND': 0.12, 'DNQ': 0.05, '<': 0.01, 'NR': 0.005}
+sample_type_shares = {'Grab': 0.78, 'Integrated': 0.05}
+matrix_shares = {'samplewater': 0.82, 'samplewater, <1.2 um': 0.04, 'sediment': 0.06, 'blankwater': 0.04, 'labwater': 0.03, 'blankmatrix': 0.01}
+compliance_shares = {'Com': 0.9, 'Qual': 0.05, 'Est': 0.02, 'NR': 0.02, 'Rej': 0.01}
+datum_shares = {'NAD83': 0.7, 'WGS84': 0.22, 'NR': 0.05, 'NAD27': 0.03}
+replicate_shares = {1: 0.94, 2: 0.05, 3: 0.01}
+
+# QA station codes, and the share of records at QA stations
+qa_stations = ['FIELDQA', 'FIELDQA_SWAMP', 'LABQA', '000NONPJ']
+qa_station_share = 0.03
+
+# Units and typical result (median) of the water quality analytes. Analytes that are not listed use mg/L and 1
+wq_analyte_units = {
+    'E. coli': ('MPN/100 mL', 50), 'pH': ('none', 7.6), 'Temperature': ('Deg C', 16), 'SpecificConductivity, Total': ('uS/cm', 450),
+    'Oxygen, Dissolved, Total': ('mg/L', 8.5), 'Oxygen, Saturation, Total': ('%', 95), 'Turbidity, Total': ('NTU', 5),
+    'Mercury, Total': ('ng/L', 3), 'Mercury, Methyl, Total': ('ng/L', 0.1), 'Chlorophyll a, Particulate': ('ug/L', 4)
+}
+
+# Tissue species: (mean length, standard deviation of length) in mm
+tissue_species = {
+    'Largemouth Bass': (360, 70), 'Spotted Bass': (330, 60), 'Smallmouth Bass': (320, 60), 'Channel Catfish': (450, 90),
+    'Common Carp': (500, 100), 'Rainbow Trout': (300, 60), 'Bluegill': (170, 30), 'Sacramento Pikeminnow': (380, 80)
+}
+tissue_species_shares = [0.35, 0.1, 0.08, 0.15, 0.12, 0.08, 0.07, 0.05]
+
+# Toxicity organisms, endpoints (analytes), and units
+tox_organisms = ['Hyalella azteca', 'Ceriodaphnia dubia', 'Pimephales promelas', 'Selenastrum capricornutum', 'Chironomus dilutus']
+tox_analytes = {'Survival': '%', 'Growth': 'mg/ind', 'Young/female': 'num/female', 'Total Cell Count': 'cells/mL'}
+
+
+# Function for getting a random number generator for a table and chunk. Each chunk has its own generator, so the same rows and seed always generate the same data
+def get_rng(seed, *keys):
+    return np.random.default_rng([seed] + [sum(ord(c) * (i + 1) for i, c in enumerate(str(key))) for key in keys])
+
+# Function for getting the values and probabilities of a code column. The given shares are used for the listed codes, and the remaining share is split over the other codes with a long tail (the share of the nth code is proportional to 1/n)
+# Codes that are imported as missing values by the data scripts (ex. 'NA', see p_constants.allowed_nans) are not used, because they would not be codes after the files are imported
+def get_code_distribution(shares, other_codes=()):
+    values = list(shares)
+    weights = list(shares.values())
+    others = [code for code in other_codes if (code not in shares) and (code not in p_constants.allowed_nans)]
+    remaining = max(1 - sum(weights), 0)
+    if (others) and (remaining > 0):
+        tail = 1 / np.arange(1, len(others) + 1)
+        values += others
+        weights += list(remaining * tail / tail.sum())
+    weights = np.array(weights, dtype='float64')
+    return np.array(values, dtype=object), weights / weights.sum()
+
+# Function for drawing n values from a code distribution (see get_code_distribution)
+def draw(rng, distribution, n):
+    values, weights = distribution
+    return values[rng.choice(len(values), size=n, p=weights)]
+
+dq_rules_df = p_utils_dq.import_dq_rules(os.path.join(repo_dir, 'assets', os.path.basename(p_constants.dq_rules_file)))
+qa_codes = get_code_distribution(qa_code_shares, p_utils_dq.get_rule_codes('QACode', dq_rules_df))
+batch_verifications = get_code_distribution(batch_verification_shares, p_utils_dq.get_rule_codes('BatchVerification', dq_rules_df))
+result_qual_codes = get_code_distribution(result_qual_code_shares, p_utils_dq.get_rule_codes('ResultQualCode', dq_rules_df))
+sample_types = get_code_distribution(sample_type_shares, p_utils_dq.get_rule_codes('SampleTypeCode', dq_rules_df))
+matrices = get_code_distribution(matrix_shares)
+compliance_codes = get_code_distribution(compliance_shares)
+datums = get_code_distribution(datum_shares)
+replicates = get_code_distribution(replicate_shares)
+
+# Function for getting the number of rows of a table
+def get_table_rows(rows, data_type):
+    return int(round(rows * table_scales[data_type]))
+
+# Function for generating the stations. The number of stations grows with the number of rows. Returns a dataframe with the station code, name, coordinates, datum, and the share of the records at the station (a few stations have most of the records)
+def generate_stations(rows, seed):
+    rng = get_rng(seed, 'stations')
+    n = max(100, rows // 300)
+    regions = rng.integers(1, 10, n)
+    codes = ['%d%02d%s%04d' % (region, number, letters, i) for i, (region, number, letters) in enumerate(zip(regions, rng.integers(0, 100, n), rng.choice(['PS', 'FC', 'RB', 'SB', 'WW', 'CR', 'LK'], n)))]
+    weights = 1 / np.arange(1, n + 1) ** 0.8
+    rng.shuffle(weights)
+    return pd.DataFrame({
+        'StationCode': codes,
+        'StationName': ['%s Creek at Site %d' % (rng.choice(['Mill', 'Deer', 'Bear', 'Salmon', 'Willow', 'Coyote', 'Pine']), i) for i in range(n)],
+        'TargetLatitude': np.round(rng.uniform(station_bbox[1], station_bbox[3], n), 6),
+        'TargetLongitude': np.round(rng.uniform(station_bbox[0], station_bbox[2], n), 6),
+        'Datum': draw(rng, datums, n),
+        'Share': weights / weights.sum()
+    })
+
+# Function for drawing the stations of n records, including records at the QA stations (qa_share of the records). Returns the index of the station in the stations dataframe (-1 for QA stations) and the station code
+def draw_stations(rng, stations_df, n, qa_share=qa_station_share):
+    index = rng.choice(len(stations_df), size=n, p=stations_df['Share'].to_numpy())
+    is_qa = rng.random(n) < qa_share
+    codes = stations_df['StationCode'].to_numpy(dtype=object)[index]
+    codes[is_qa] = rng.choice(qa_stations, is_qa.sum())
+    index[is_qa] = -1
+    return index, codes
+
+# Function for getting the station columns (name and coordinates) of the records, with some invalid coordinates (-88, missing, and positive longitudes)
+def get_station_columns(rng, stations_df, index):
+    n = len(index)
+    valid = index >= 0
+    names = np.where(valid, stations_df['StationName'].to_numpy(dtype=object)[index], 'QA Sample')
+    lat = np.where(valid, stations_df['TargetLatitude'].to_numpy()[index], np.nan)
+    lon = np.where(valid, stations_df['TargetLongitude'].to_numpy()[index], np.nan)
+    lat[rng.random(n) < 0.002] = -88
+    lon[rng.random(n) < 0.003] *= -1
+    missing = rng.random(n) < 0.003
+    lat[missing] = np.nan
+    lon[missing] = np.nan
+    return names, lat, lon
+
+# Function for drawing sample dates between 2000 and 2024, with some placeholder (1950-01-01) and missing dates
+def draw_sample_dates(rng, n):
+    dates = pd.Series(pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.integers(0, 9131, n), unit='D'))
+    dates[rng.random(n) < 0.001] = pd.Timestamp('1950-01-01')
+    dates[rng.random(n) < 0.0005] = pd.NaT
+    return dates
+
+# Function for drawing results with a lognormal distribution around the typical value of each record. Non-detects have missing (70%) or negative results, and some results are -88 (placeholder)
+def draw_results(rng, typical, result_qual_code):
+    n = len(typical)
+    results = np.round(typical * np.exp(rng.normal(0, 0.8, n)), 4)
+    mdl = np.round(typical * rng.uniform(0.01, 0.1, n), 4)
+    is_nd = result_qual_code == 'ND'
+    results[is_nd & (rng.random(n) < 0.7)] = np.nan
+    negative = is_nd & ~np.isnan(results)
+    results[negative] = -mdl[negative]
+    results[rng.random(n) < 0.003] = -88
+    mdl[rng.random(n) < 0.01] = -88
+    mdl[rng.random(n) < 0.03] = np.nan
+    return results, mdl, np.round(mdl * 2, 4)
+
+# Function for drawing free text comments. Most are empty, some have commas, quotes, and tabs (characters that need to be quoted or removed)
+def draw_comments(rng, n):
+    comments = np.array(['', 'Sample collected at bridge', 'Field duplicate, see notes', 'Holding time exceeded "estimated"', 'Low flow\tno access', 'Lab reanalyzed'], dtype=object)
+    return comments[rng.choice(len(comments), size=n, p=[0.8, 0.06, 0.05, 0.03, 0.02, 0.04])]
+
+# Function for generating a chunk of the water quality table (WQDMart_MV). Most of the records are SWAMP records for the analytes in p_constants.ceden_wq_analytes, some are SPoT records (all analytes), and some are from other programs
+def generate_wq(rng, stations_df, n, analytes):
+    index, station_codes = draw_stations(rng, stations_df, n)
+    names, lat, lon = get_station_columns(rng, stations_df, index)
+    sample_dates = draw_sample_dates(rng, n)
+    kind = rng.choice(['swamp', 'spot', 'other'], size=n, p=[0.7, 0.2, 0.1])
+    analyte = np.where(kind == 'spot', rng.choice(analytes, n), rng.choice(p_constants.ceden_wq_analytes, n))
+    units = np.array([wq_analyte_units.get(a, ('mg/L', 1))[0] for a in analyte], dtype=object)
+    typical = np.array([wq_analyte_units.get(a, ('mg/L', 1))[1] for a in analyte], dtype='float64')
+    result_qual_code = draw(rng, result_qual_codes, n)
+    results, mdl, rl = draw_results(rng, typical, result_qual_code)
+    parent_projects = np.array(['SWAMP Perennial Stream Surveys', 'SWAMP Bioaccumulation Monitoring Program', 'SWAMP Statewide Mercury Program', 'SWAMP Regional Monitoring'], dtype=object)
+    parent_project = np.where(kind == 'spot', p_constants.spot_parent_projects[0], rng.choice(parent_projects, n))
+    return pd.DataFrame({
+        'Program': np.where(kind == 'other', 'Irrigated Lands Regulatory Program', 'Surface Water Ambient Monitoring Program'),
+        'ParentProject': parent_project,
+        'Project': np.char.add('Project ', rng.integers(1, 200, n).astype(str)).astype(object),
+        'StationName': names,
+        'StationCode': station_codes,
+        'SampleDate': sample_dates,
+        'CollectionTime': '1900-01-01 10:30:00',
+        'LocationCode': rng.choice(['Midchannel', 'Bank', 'OpenWater', 'Not Recorded'], n),
+        'CollectionDepth': np.where(rng.random(n) < 0.6, 0.1, np.nan),
+        'UnitCollectionDepth': 'm',
+        'SampleTypeCode': draw(rng, sample_types, n),
+        'CollectionReplicate': draw(rng, replicates, n).astype('int64'),
+        'ResultsReplicate': draw(rng, replicates, n).astype('int64'),
+        'LabBatch': np.char.add('LB', rng.integers(0, n // 20 + 1, n).astype(str)).astype(object),
+        'LabSampleID': np.char.add('LS', rng.integers(0, 10 ** 8, n).astype(str)).astype(object),
+        'MatrixName': np.where(station_codes == 'LABQA', 'labwater', np.where(kind == 'spot', 'sediment', draw(rng, matrices, n))), # Lab QA samples are lab water
+        'MethodName': rng.choice(['EPA 200.8', 'EPA 1631E', 'SM 9223 B', 'Field', 'EPA 300.0'], n),
+        'Analyte': analyte,
+        'Fraction': rng.choice(['Total', 'Dissolved', 'None', 'Particulate'], size=n, p=[0.6, 0.25, 0.1, 0.05]),
+        'Unit': units,
+        'Result': results,
+        'Observation': '',
+        'MDL': mdl,
+        'RL': rl,
+        'ResultQualCode': result_qual_code,
+        'QACode': draw(rng, qa_codes, n),
+        'BatchVerification': draw(rng, batch_verifications, n),
+        'ComplianceCode': draw(rng, compliance_codes, n),
+        'SampleComments': draw_comments(rng, n),
+        'CollectionComments': draw_comments(rng, n),
+        'ResultsComments': draw_comments(rng, n),
+        'BatchComments': draw_comments(rng, n),
+        'EventCode': 'WQ',
+        'ProtocolCode': rng.choice(['SWAMP_2016_WS', 'SWAMP_2008_WS', 'Not Recorded'], n),
+        'SampleAgency': rng.choice(['Moss Landing Marine Laboratories', 'Regional Water Quality Control Board 5', 'USGS'], n),
+        'GroupSamples': '',
+        'CollectionMethodName': rng.choice(['Water_Grab', 'Sed_Grab', 'Field'], n),
+        'TargetLatitude': lat,
+        'TargetLongitude': lon,
+        'CollectionDeviceDescr': rng.choice(['Grab', 'Van Dorn', 'Sonde'], n),
+        'CalibrationDate': pd.NaT,
+        'PrepPreservationName': rng.choice(['None', 'Acidified', 'Filtered'], n),
+        'PrepPreservationDate': sample_dates,
+        'DigestExtractMethod': 'None',
+        'DigestExtractDate': sample_dates + pd.to_timedelta(rng.integers(0, 5, n), unit='D'),
+        'AnalysisDate': sample_dates + pd.to_timedelta(rng.integers(1, 30, n), unit='D'),
+        'DilutionFactor': 1,
+        'ExpectedValue': np.nan,
+        'LabAgency': rng.choice(['Moss Landing Marine Laboratories', 'Caltest Analytical Laboratory', 'Weck Laboratories'], n),
+        'SubmittingAgency': rng.choice(['Moss Landing Marine Laboratories', 'State Water Resources Control Board'], n),
+        'SubmissionCode': rng.choice(['A', 'R'], size=n, p=[0.95, 0.05])
+    })
+
+# Function for generating a chunk of the habitat table (HabitatDMart_MV). About half of the records are the CSCI and IPI scores, the rest are other habitat measurements. Habitat records are not collected at QA stations
+def generate_habitat(rng, stations_df, n):
+    index, station_codes = draw_stations(rng, stations_df, n, qa_share=0)
+    names, lat, lon = get_station_columns(rng, stations_df, index)
+    analyte = rng.choice(p_constants.ceden_phab_analytes + ['Wetted Width', 'Substrate Size Class', 'Canopy Cover'], size=n, p=[0.3, 0.2, 0.2, 0.15, 0.15])
+    result_qual_code = np.where(rng.random(n) < 0.97, '=', 'NR')
+    results = np.where(analyte == 'CSCI', np.round(rng.normal(0.85, 0.25, n), 3), np.round(rng.gamma(3, 10, n), 2))
+    results[(result_qual_code == 'NR') & (rng.random(n) < 0.8)] = np.nan
+    return pd.DataFrame({
+        'Program': rng.choice(p_constants.habitat_programs + ['Irrigated Lands Regulatory Program'], size=n, p=[0.1, 0.1, 0.6, 0.05, 0.1, 0.05]),
+        'ParentProject': rng.choice(p_constants.bioassessment_parent_projects, n),
+        'Project': np.char.add('Project ', rng.integers(1, 100, n).astype(str)).astype(object),
+        'StationName': names,
+        'StationCode': station_codes,
+        'SampleDate': draw_sample_dates(rng, n),
+        'CollectionTime': '1900-01-01 09:00:00',
+        'SampleTypeCode': rng.choice(['Integrated', 'Grab', 'FieldBLDup'], size=n, p=[0.9, 0.08, 0.02]),
+        'CollectionReplicate': draw(rng, replicates, n).astype('int64'),
+        'ResultsReplicate': draw(rng, replicates, n).astype('int64'),
+        'MatrixName': 'habitat',
+        'MethodName': 'Field',
+        'Analyte': analyte,
+        'Unit': 'none',
+        'VariableResult': '',
+        'Result': results,
+        'ResultQualCode': result_qual_code,
+        'QACode': draw(rng, qa_codes, n),
+        'BatchVerification': draw(rng, batch_verifications, n),
+        'ComplianceCode': draw(rng, compliance_codes, n),
+        'ResultComments': draw_comments(rng, n),
+        'TargetLatitude': lat,
+        'TargetLongitude': lon,
+        'SampleAgency': rng.choice(['Moss Landing Marine Laboratories', 'Regional Water Quality Control Board 9'], n)
+    })
+
+# Function for generating a chunk of the toxicity table (ToxDMart_MV). Each sample has 1 to 5 lab replicate rows with the replicate result, and the sample mean on every row
+def generate_toxicity(rng, stations_df, n_samples):
+    index, station_codes = draw_stations(rng, stations_df, n_samples)
+    names, lat, lon = get_station_columns(rng, stations_df, index)
+    n_reps = rng.choice([1, 4, 5], size=n_samples, p=[0.3, 0.3, 0.4])
+    analyte = rng.choice(list(tox_analytes), n_samples)
+    mean = np.round(np.where(analyte == 'Survival', np.clip(rng.normal(85, 15, n_samples), 0, 100), rng.gamma(2, 5, n_samples)), 2)
+    mean[rng.random(n_samples) < 0.02] = np.nan
+    mean[rng.random(n_samples) < 0.003] = -88
+    samples_df = pd.DataFrame({
+        'Program': np.where(rng.random(n_samples) < 0.95, 'Surface Water Ambient Monitoring Program', 'Irrigated Lands Regulatory Program'),
+        'ParentProject': rng.choice(['SWAMP Stream Pollution Trends', 'SWAMP Perennial Stream Surveys', 'SWAMP Regional Monitoring'], n_samples),
+        'Project': np.char.add('Project ', rng.integers(1, 100, n_samples).astype(str)).astype(object),
+        'StationName': names,
+        'StationCode': station_codes,
+        'SampleDate': draw_sample_dates(rng, n_samples),
+        'CollectionTime': '1900-01-01 11:00:00',
+        'LocationCode': 'Midchannel',
+        'CollectionDepth': np.where(rng.random(n_samples) < 0.5, 0.1, np.nan),
+        'SampleTypeCode': rng.choice(['Grab', 'Integrated', 'FieldBLDup'], size=n_samples, p=[0.85, 0.1, 0.05]),
+        'CollectionReplicate': draw(rng, replicates, n_samples).astype('int64'),
+        'MatrixName': rng.choice(['samplewater', 'sediment', 'labwater'], size=n_samples, p=[0.6, 0.35, 0.05]),
+        'Analyte': analyte,
+        'Unit': [tox_analytes[a] for a in analyte],
+        'ResultQualCode': '=',
+        'TargetLatitude': lat,
+        'TargetLongitude': lon,
+        'OrganismName': rng.choice(tox_organisms, n_samples),
+        'ToxBatch': np.char.add('TB', rng.integers(0, n_samples // 10 + 1, n_samples).astype(str)).astype(object),
+        'Treatment': rng.choice(['None', 'Temperature', 'Conductivity'], size=n_samples, p=[0.8, 0.15, 0.05]),
+        'UnitTreatment': rng.choice(['none', 'Deg C', 'uS/cm'], n_samples),
+        'TreatmentConcentration': rng.choice([np.nan, 15, 23], n_samples),
+        'ToxTestDurCode': rng.choice(['96 Hours', '7 Days', '10 Days'], n_samples),
+        'Mean': mean,
+        'StdDev': np.round(rng.gamma(2, 2, n_samples), 2),
+        'PctControl': np.round(rng.normal(95, 10, n_samples), 1),
+        'SigEffectCode': rng.choice(['NSG', 'SL', 'SG'], size=n_samples, p=[0.8, 0.1, 0.1]),
+        'ToxBatchStartDate': pd.NaT,
+        'ToxResultQACode': draw(rng, qa_codes, n_samples),
+        'QACode': draw(rng, qa_codes, n_samples),
+        'BatchVerification': draw(rng, batch_verifications, n_samples)
+    })
+    samples_df['ToxBatchStartDate'] = samples_df['SampleDate'] + pd.to_timedelta(rng.integers(1, 5, n_samples), unit='D')
+
+    # One row per lab replicate
+    tox_df = samples_df.loc[samples_df.index.repeat(n_reps)].reset_index(drop=True)
+    n = len(tox_df)
+    tox_df['LabReplicate'] = tox_df.groupby(np.repeat(np.arange(n_samples), n_reps)).cumcount().to_numpy() + 1
+    tox_df['OrganismPerRep'] = 10
+    tox_df['Result'] = np.round(tox_df['Mean'] + rng.normal(0, 3, n), 2)
+    tox_df['ResQualCode'] = '='
+    tox_df['ToxResultComments'] = draw_comments(rng, n)
+    tox_df['ToxID'] = rng.integers(0, 10 ** 9, n)
+    return tox_df
+
+# Function for generating a chunk of the tissue table (TissueDMart_MV). Each row is a result for a fish (individual) or a composite of 3 to 5 fish, for mercury (all samples) and selenium (some samples). Lengths follow the species length distribution, and mercury increases with length
+def generate_tissue(rng, stations_df, n):
+    # About 1.3 results per fish or composite (mercury for every sample, selenium for some)
+    n_samples = max(int(n / 1.3), 1)
+    index, station_codes = draw_stations(rng, stations_df, n_samples, qa_share=0) # Tissue samples are not collected at QA stations
+    names, lat, lon = get_station_columns(rng, stations_df, index)
+    species_names = np.array(list(tissue_species), dtype=object)
+    species = species_names[rng.choice(len(species_names), size=n_samples, p=tissue_species_shares)]
+    length_mean = np.array([tissue_species[s][0] for s in species])
+    length_sd = np.array([tissue_species[s][1] for s in species])
+    n_fish = np.where(rng.random(n_samples) < 0.55, 1, rng.integers(3, 6, n_samples))
+    # Composites are an average of n_fish fish, so their lengths vary less
+    lengths = np.round(rng.normal(length_mean, length_sd / np.sqrt(n_fish)), 0)
+    lengths[rng.random(n_samples) < 0.01] = np.nan
+    years = rng.integers(2005, 2024, n_samples)
+    samples_df = pd.DataFrame({
+        'ProgramName': 'Surface Water Ambient Monitoring Program',
+        'ParentProjectName': rng.choice(p_constants.bioaccumulation_parent_projects, n_samples),
+        'ProjectCode': np.char.add('SWAMP_BOG_', rng.integers(1, 30, n_samples).astype(str)).astype(object),
+        'ProjectName': np.char.add('Bioaccumulation Project ', rng.integers(1, 30, n_samples).astype(str)).astype(object),
+        'StationCode': station_codes,
+        'StationName': names,
+        'SampleDate': pd.to_datetime(pd.Series(years.astype(str))) + pd.to_timedelta(rng.integers(120, 300, n_samples), unit='D'),
+        'CommonName': species,
+        'FinalID': species,
+        'TissueName': rng.choice(['Fillet', 'Whole Body', 'Whole Organism'], size=n_samples, p=[0.8, 0.15, 0.05]),
+        'TissuePrep': rng.choice(['Skin off', 'Skin on', None], size=n_samples, p=[0.6, 0.2, 0.2]),
+        'NumberFishperComp': n_fish,
+        'TLAvgLength(mm)': lengths,
+        'CompositeCompositeID': ['%s_%d_L%dBOG_%d' % (code, year, loc, i) if keep else '%s_%d_%d' % (code, year, i) for i, (code, year, loc, keep) in enumerate(zip(station_codes, years, rng.integers(1, 4, n_samples), rng.random(n_samples) < 0.7))],
+        'TargetLatitude': lat,
+        'TargetLongitude': lon
+    })
+
+    # One row per result: mercury for every sample, selenium for about 30% of the samples
+    has_selenium = rng.random(n_samples) < 0.3
+    sample_index = np.concatenate([np.arange(n_samples), np.flatnonzero(has_selenium)])
+    tissue_df = samples_df.iloc[sample_index].reset_index(drop=True)
+    n = len(tissue_df)
+    is_mercury = np.arange(n) < n_samples
+    tissue_df['Analyte'] = np.where(is_mercury, 'Mercury', 'Selenium')
+    tissue_df['DWC_AnalyteWFraction'] = np.where(is_mercury, 'Mercury, Total', 'Selenium, Total')
+    tissue_df['Unit'] = rng.choice(['ug/g ww', 'ug/g dw'], size=n, p=[0.95, 0.05])
+    length = tissue_df['TLAvgLength(mm)'].fillna(350).to_numpy()
+    mercury = 10 ** (-0.8 + 0.0025 * (length - 350) + rng.normal(0, 0.15, n))
+    selenium = np.exp(rng.normal(-0.5, 0.4, n))
+    tissue_df['Result'] = np.round(np.where(is_mercury, mercury, selenium), 4)
+    tissue_df['ResQualCode'] = np.where(rng.random(n) < 0.02, 'ND', '=')
+    tissue_df.loc[tissue_df['ResQualCode'] == 'ND', 'Result'] = np.nan
+    tissue_df['MDL'] = 0.004
+    tissue_df['RL'] = 0.012
+    tissue_df['CollectionReplicate'] = 1
+    tissue_df['CompositeReplicate'] = 1
+    tissue_df['ResultReplicate'] = draw(rng, replicates, n).astype('int64')
+    tissue_df['Matrix'] = 'tissue'
+    tissue_df['TissueResultRowID'] = rng.integers(0, 10 ** 9, n)
+    tissue_df['QACode'] = draw(rng, qa_codes, n)
+    tissue_df['BatchVerification'] = draw(rng, batch_verifications, n)
+    tissue_df['SampleTypeCode'] = 'Grab'
+    for col in p_constants.tissue_date_cols:
+        if col not in tissue_df.columns:
+            tissue_df[col] = pd.NaT
+    tissue_df['LatestDateSampled'] = tissue_df['SampleDate']
+    tissue_df['CompositeSampleDate'] = tissue_df['SampleDate']
+    return tissue_df
+
+# Function for generating the CEDEN stations table (DM_WQX_Stations_MV), including the QA stations
+def generate_station_table(stations_df):
+    qa_df = pd.DataFrame({'StationCode': qa_stations, 'StationName': 'QA Sample', 'Datum': 'NR'})
+    return pd.concat([stations_df[['StationCode', 'StationName', 'TargetLatitude', 'TargetLongitude', 'Datum']], qa_df], ignore_index=True)
+
+# Function for generating a data mart table (ex. 'WQDMart_MV') in chunks of rows. Yields one dataframe per chunk
+def generate_table(table, rows, seed=1):
+    data_type = table_data_types[table]
+    stations_df = generate_stations(rows, seed)
+    if data_type == 'stations':
+        yield generate_station_table(stations_df)
+        return
+    analytes = pd.read_csv(os.path.join(repo_dir, 'assets', os.path.basename(p_constants.analyte_list_file)), usecols=['CedenAnalyteName'])['CedenAnalyteName'].dropna().unique()
+    n_rows = get_table_rows(rows, data_type)
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        rng = get_rng(seed, table, i)
+        n = min(chunk_rows, n_rows - start)
+        if data_type == 'water_quality':
+            yield generate_wq(rng, stations_df, n, analytes)
+        elif data_type == 'habitat':
+            yield generate_habitat(rng, stations_df, n)
+        elif data_type == 'toxicity':
+            yield generate_toxicity(rng, stations_df, n)
+        elif data_type == 'tissue':
+            yield generate_tissue(rng, stations_df, n)
+
+# Function for generating the input of the tissue length-adjusted average step (tissue_laa.get_individual_averages): the individual (not composite) tissue records, with the fields that are added by the tissue processing step (SampleYear, ResultAdjusted, NonDetectCount, LocationCodeBOG, and Datum)
+def generate_laa_input(rows, seed=1):
+    stations_df = generate_stations(rows, seed)
+    laa_dfs = []
+    for tissue_df in generate_table(p_constants.datamart_tables['tissue'], rows, seed):
+        tissue_df = tissue_df[tissue_df['NumberFishperComp'] == 1].copy()
+        tissue_df['SampleYear'] = tissue_df['SampleDate'].dt.year
+        tissue_df['NonDetectCount'] = (tissue_df['ResQualCode'] == 'ND').astype(int)
+        tissue_df['ResultAdjusted'] = tissue_df['Result'].where(tissue_df['NonDetectCount'] == 0, tissue_df['MDL'] / 2)
+        tissue_df['LocationCodeBOG'] = tissue_df['CompositeCompositeID'].str.extract('(L[1-3])BOG', expand=False).fillna('NA')
+        tissue_df = p_utils.join_datum(tissue_df, stations_df[['StationCode', 'Datum']])
+        laa_dfs.append(tissue_df[tissue_laa_cols])
+    return pd.concat(laa_dfs, ignore_index=True)
+
+# Fields of the tissue length-adjusted average input (the grouping fields in tissue_laa.group_cols plus the fields used in the averages)
+tissue_laa_cols = [
+    'StationCode', 'StationName', 'LocationCodeBOG', 'CommonName', 'DWC_AnalyteWFraction', 'Unit', 'SampleYear', 'FinalID', 'ProgramName', 'TargetLatitude', 'TargetLongitude', 'Datum',
+    'ParentProjectName', 'ProjectName', 'ProjectCode', 'TissueName', 'TissuePrep', 'TLAvgLength(mm)', 'ResultAdjusted', 'SampleDate', 'NonDetectCount'
+]
+
+# Download queries of each data type (see p_constants.download_filters). The water quality data is downloaded with two queries, and the results are combined in this order
+download_queries = {
+    'water_quality': ['water_quality_swamp', 'water_quality_spot'],
+    'habitat': ['habitat'],
+    'toxicity': ['toxicity'],
+    'tissue': ['tissue']
+}
+
+# Function for selecting the same records as the SQL queries in the download scripts, including the pushdown rules if they are on (see p_query.py)
+def apply_download_filters(df, data_type):
+    return pd.concat([df[p_query.apply_conditions(df, p_query.get_download_conditions(query_name, data_type))] for query_name in download_queries[data_type]], ignore_index=True)
+
+# Output file of each data type (the file written by the download script)
+download_files = {
+    'stations': 'ceden_stations',
+    'water_quality': 'ceden_swamp_wq',
+    'habitat': 'ceden_swamp_phab',
+    'toxicity': 'ceden_swamp_tox',
+    'tissue': 'ceden_swamp_tissue'
+}
+
+# Function for writing a synthetic RB boundaries file (9 regions, each a band of the station bounding box) if the real file is not in the assets folder
+def write_region_boundaries(path):
+    min_lon, min_lat, max_lon, max_lat = station_bbox
+    step = (max_lat - min_lat) / 9
+    features = []
+    for rb in range(1, 10):
+        south = min_lat + (9 - rb) * step - (0.5 if rb == 9 else 0)
+        north = min_lat + (10 - rb) * step + (0.5 if rb == 1 else 0)
+        ring = [[min_lon - 0.5, south], [max_lon + 0.5, south], [max_lon + 0.5, north], [min_lon - 0.5, north], [min_lon - 0.5, south]]
+        features.append({'type': 'Feature', 'properties': {'rb': rb}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+
+# Function for writing the files that the data scripts need from the data marts and from previous runs, to the support_files and assets folders of outdir:
+# --- The files written by the download scripts (ceden_swamp_wq.csv, ceden_stations.csv, etc.), with the same filters as the SQL queries
+# --- The toxicity data quality and station index files (written by the toxicity download script)
+# --- swamp_stations.csv (written by the sites step of the previous run, used by the tissue processing step)
+# --- The reference sites and RB boundaries files, if they are not in the assets folder
+# --- The input of the tissue length-adjusted average step (benchmark_laa_input.csv in outdir), used by run_laa.py
+def write_download_files(outdir, rows, seed=1):
+    support_dir = os.path.join(outdir, 'support_files')
+    assets_dir = os.path.join(outdir, 'assets')
+    for folder in [support_dir, assets_dir, os.path.join(outdir, 'export')]:
+        os.makedirs(folder, exist_ok=True)
+
+    stations_df = None
+    index_dfs = []
+    for data_type, file_name in download_files.items():
+        print('--- Generating %s' % file_name)
+        table = p_constants.datamart_tables[data_type]
+        for i, chunk_df in enumerate(generate_table(table, rows, seed)):
+            if data_type == 'stations':
+                stations_df = chunk_df
+                p_utils.write_csv(chunk_df[['StationCode', 'Datum']], file_name, support_dir)
+                continue
+            chunk_df = p_utils.apply_schema(apply_download_filters(chunk_df, data_type), data_type)
+            if data_type == 'toxicity':
+                # Join datum, and write the data quality fields and the station index (see 1_tox_download_data.py)
+                chunk_df = p_utils.join_datum(chunk_df, stations_df[['StationCode', 'Datum']])
+                p_utils.write_csv(chunk_df, file_name, support_dir, append=(i > 0))
+                chunk_df = p_utils_dq.add_data_quality(chunk_df, 'toxicity')
+                p_utils.write_csv(chunk_df, 'swamp_tox_data_quality', support_dir, append=(i > 0))
+                index_dfs.append(p_utils.get_station_index(chunk_df))
+            else:
+                p_utils.write_csv(chunk_df, file_name, support_dir, append=(i > 0))
+    p_utils.write_csv(p_utils.combine_station_indexes(index_dfs), 'swamp_tox_station_index', support_dir)
+
+    # Stations from the previous run
+    previous_df = stations_df[stations_df['StationCode'].isin(generate_stations(rows, seed)['StationCode'])].copy()
+    previous_df['Region'] = ((station_bbox[3] - previous_df['TargetLatitude']) // ((station_bbox[3] - station_bbox[1]) / 9) + 1).clip(1, 9).astype(int) # Same bands as the synthetic RB boundaries
+    previous_df['LastSampleDate'] = '2024-01-01T00:00:00'
+    p_utils.write_csv(previous_df[['StationCode', 'StationName', 'TargetLatitude', 'TargetLongitude', 'Region', 'LastSampleDate']], 'swamp_stations', support_dir)
+
+    print('--- Generating benchmark_laa_input')
+    p_utils.write_csv(generate_laa_input(rows, seed), 'benchmark_laa_input', outdir)
+
+    reference_path = os.path.join(assets_dir, os.path.basename(p_constants.reference_sites_file))
+    if not os.path.exists(reference_path):
+        reference_df = stations_df.iloc[::20][['StationCode']]
+        reference_df = pd.DataFrame({'cedenid': reference_df['StationCode'].str.lower(), 'StationCategory': 'Reference'})
+        reference_df.to_csv(reference_path, index=False)
+    boundaries_path = os.path.join(assets_dir, os.path.basename(p_constants.rb_boundaries_file))
+    if not os.path.exists(boundaries_path):
+        write_region_boundaries(boundaries_path)
+
+# Function for writing the data mart tables (before the filters of the download scripts) to a local source database, so the download scripts can be run with SWAMP_SOURCE=local (see p_source.py)
+def write_source_db(db_path, rows, seed=1):
+    for table in p_constants.datamart_tables.values():
+        print('--- Loading %s into %s' % (table, db_path))
+        p_source.write_local_table(table, generate_table(table, rows, seed), db_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic CEDEN-shaped data for the data scripts')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of water quality rows. The other data types are scaled to the same proportions as the real data')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. The same rows and seed always generate the same data')
+    parser.add_argument('--outdir', help='Folder to write the data in (support_files, assets, and export folders are created in this folder)')
+    parser.add_argument('--source-db', help='Local source database to write the data mart tables to, for running the download scripts with SWAMP_SOURCE=local (see p_source.py)')
+    args = parser.parse_args()
+    if not (args.outdir or args.source_db):
+        parser.error('--outdir or --source-db is required')
+
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+    if args.outdir:
+        write_download_files(args.outdir, args.rows, args.seed)
+    if args.source_db:
+        write_source_db(args.source_db, args.rows, args.seed)
+    print('%s finished running' % os.path.basename(__file__))
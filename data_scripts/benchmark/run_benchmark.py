@@ -0,0 +1,251 @@
+'''
+This script runs the data scripts end to end on synthetic CEDEN-shaped data (see generate_data.py) and records the run time and peak memory of each step, so that the performance of the data scripts can be compared across commits.
+
+Each benchmark run:
+--- Copies the data_scripts and assets folders to a temporary workspace, so the benchmark does not touch the real support_files and export folders
+--- Generates the synthetic data for the number of rows and seed (or reuses the data generated by a previous run with the same version of generate_data.py, saved in the cache folder)
+--- Runs each step as a separate process, the same way the steps are run by the batch file, and measures the wall time, CPU time, and peak memory (resident set size) of the process
+--- Appends one JSON record per step to the results file (benchmark_results.jsonl by default), with the git commit, number of rows, and environment of the run
+
+The steps that upload data to the open data portal are not run, because they need access to the portal. The synthetic data replaces the files written by the download steps (1_*_download_data.py, 0_get_datum_data.py), so the download steps are not run by default. To include them, add the download steps to --stages. The data mart tables are then also generated into a local SQLite database, and the download steps query that database instead of the data marts (SWAMP_SOURCE=local, see p_source.py)
+
+Environment variables for the data scripts (ex. SWAMP_WORKERS, SWAMP_CSV_ENGINE, SWAMP_MEMORY_BUDGET_MB) can be set for the run with --env, and are saved with the results
+
+Usage:
+--- python run_benchmark.py --rows 100000 1000000 --repeat 3
+--- python run_benchmark.py --rows 1000000 --stages wq_dq wq_process --env SWAMP_CSV_ENGINE=pyarrow
+--- python run_benchmark.py --rows 100000 --stages datum_download wq_download wq_dq wq_process
+--- python run_benchmark.py --summary (median time and peak memory of each step for each commit in the results file)
+'''
+
+import argparse
+from datetime import datetime
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+import p_constants # p_constants.py
+import p_utils # p_utils.py
+
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.abspath(os.path.join(benchmark_dir, '..', '..'))
+
+# Steps of the benchmark, in the order they are run: (step name, script path relative to the data_scripts folder). The steps are run in the same order as the batch file, so each step has the files written by the steps before it
+stages = [
+    ('datum_download', 'sites/0_get_datum_data.py'),
+    ('tissue_download', 'tissue/1_tissue_download_data.py'),
+    ('wq_download', 'water_quality/1_wq_download_data.py'),
+    ('phab_download', 'habitat/1_phab_download_data.py'),
+    ('tox_download', 'toxicity/1_tox_download_data.py'),
+    ('tissue_dq', 'tissue/2_tissue_data_quality.py'),
+    ('tissue_process', 'tissue/3_tissue_process_data.py'),
+    ('wq_dq', 'water_quality/2_wq_data_quality.py'),
+    ('phab_dq', 'habitat/2_phab_data_quality.py'),
+    ('sites_get_data', 'sites/1_sites_get_data.py'),
+    ('sites_add_region', 'sites/2_sites_add_region.py'),
+    ('wq_process', 'water_quality/3_wq_process_data.py'),
+    ('phab_process', 'habitat/3_phab_process_data.py'),
+    ('tox_process', 'toxicity/2_tox_process_data.py'),
+    ('tissue_laa', 'benchmark/run_laa.py')
+]
+
+# Steps that download data (from the local source database). Not run by default
+download_stages = ['datum_download', 'tissue_download', 'wq_download', 'phab_download', 'tox_download']
+
+# Default location of the results file and of the cache of generated data
+results_file = os.path.join(benchmark_dir, 'benchmark_results.jsonl')
+cache_dir = os.path.join(tempfile.gettempdir(), 'swamp_benchmark_data')
+
+
+# Function for getting the git commit of the repository, and whether there are uncommitted changes to the data scripts. Returns None values if git is not available
+def get_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--', 'data_scripts', 'assets'], cwd=repo_dir, capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+# Function for getting the version of the generated data: a hash of the generator script and of the data quality rules file that the codes are drawn from. Data generated by a different version of the generator is not reused
+def get_generator_version():
+    generator_hash = hashlib.sha256()
+    for path in [os.path.join(benchmark_dir, 'generate_data.py'), os.path.join(repo_dir, 'assets', os.path.basename(p_constants.dq_rules_file))]:
+        generator_hash.update(p_utils.get_file_hash(path).encode('utf-8'))
+    return generator_hash.hexdigest()[:12]
+
+# Function for getting the generated data for a number of rows and seed. The data is generated once and saved in the cache folder, and copied to the workspace for each run. If source_db is set, the local source database of the download steps is also generated (it is not copied to the workspace)
+# The files written by the download steps depend on the pushdown setting of the download queries (SWAMP_DOWNLOAD_PUSHDOWN, see p_constants.download_pushdown_rules), so the data is generated with the environment of the run and saved separately for each setting. The data is also saved separately for each version of the generator (see get_generator_version)
+# The generator is run from the benchmark folder, because the data quality functions it uses find the rules file with a path relative to the script folder (see p_constants.dq_rules_file)
+def get_data(rows, seed, regenerate=False, source_db=False, env=None):
+    env = env or dict(os.environ)
+    pushdown = env.get('SWAMP_DOWNLOAD_PUSHDOWN', '1') != '0'
+    data_dir = os.path.join(cache_dir, 'rows_%s_seed_%s%s_%s' % (rows, seed, '' if pushdown else '_no_pushdown', get_generator_version()))
+    if regenerate and os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+    if not os.path.exists(os.path.join(data_dir, 'complete')):
+        print('--- Generating %s rows (seed %s)' % (rows, seed))
+        subprocess.run([sys.executable, os.path.join(benchmark_dir, 'generate_data.py'), '--rows', str(rows), '--seed', str(seed), '--outdir', data_dir], cwd=benchmark_dir, env=env, check=True)
+        open(os.path.join(data_dir, 'complete'), 'w').close()
+    if source_db and not os.path.exists(os.path.join(data_dir, 'source_complete')):
+        print('--- Generating the source database for %s rows (seed %s)' % (rows, seed))
+        subprocess.run([sys.executable, os.path.join(benchmark_dir, 'generate_data.py'), '--rows', str(rows), '--seed', str(seed), '--source-db', get_source_db(data_dir)], cwd=benchmark_dir, env=env, check=True)
+        open(os.path.join(data_dir, 'source_complete'), 'w').close()
+    return data_dir
+
+# Function for getting the path of the local source database in the generated data folder
+def get_source_db(data_dir):
+    return os.path.join(data_dir, 'ceden_datamart.sqlite')
+
+# Function for setting up a workspace with a copy of the data scripts, assets, and generated data. The data scripts use relative paths (ex. ../../support_files), so each step is run from its folder in the workspace
+def make_workspace(data_dir):
+    workspace = tempfile.mkdtemp(prefix='swamp_benchmark_')
+    shutil.copytree(os.path.join(repo_dir, 'data_scripts'), os.path.join(workspace, 'data_scripts'), ignore=shutil.ignore_patterns('__pycache__', '*.jsonl'))
+    shutil.copytree(os.path.join(repo_dir, 'assets'), os.path.join(workspace, 'assets'))
+    for folder in ['support_files', 'export', 'assets']:
+        shutil.copytree(os.path.join(data_dir, folder), os.path.join(workspace, folder), dirs_exist_ok=True)
+    shutil.copy(os.path.join(data_dir, 'benchmark_laa_input.csv'), workspace)
+    os.makedirs(os.path.join(workspace, 'ceden_files'), exist_ok=True)
+    return workspace
+
+# Function for running one step as a separate process and measuring it. Returns the wall time, CPU time (user and system, including any worker processes), peak memory (MB) of the process, and the return code
+# On Linux and macOS, os.wait4 gives the CPU time and peak memory of the process. On Windows, the peak memory is read with psutil (if installed) while the process is running, and the CPU time is not measured
+def run_stage(script, cwd, env, log_path, args=()):
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script] + list(args), cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            wall_s = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak_rss_mb = usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+            return wall_s, usage.ru_utime, usage.ru_stime, peak_rss_mb, process.returncode
+        peak_rss_mb = None
+        try:
+            import psutil
+            ps_process = psutil.Process(process.pid)
+            while process.poll() is None:
+                try:
+                    peak_rss_mb = ps_process.memory_info().peak_wset / 1024 ** 2
+                except (psutil.Error, AttributeError):
+                    pass
+                time.sleep(0.05)
+        except ImportError:
+            pass
+        process.wait()
+        return time.perf_counter() - start, None, None, peak_rss_mb, process.returncode
+
+# Function for getting the details of the environment that are saved with each result
+def get_environment():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+# Function for running the benchmark for a number of rows: set up the workspace, run the steps, and append the results to the results file. Returns the list of result records
+def run_benchmark(rows, seed, stage_names, repeat=1, env_overrides=None, output=results_file, keep_workspace=False, regenerate=False):
+    env_overrides = env_overrides or {}
+    run_downloads = any(stage in download_stages for stage in stage_names)
+    data_dir = get_data(rows, seed, regenerate, source_db=run_downloads, env=dict(os.environ, **env_overrides))
+    commit, dirty = get_commit()
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S') + '_%s' % os.getpid()
+    environment = get_environment()
+    records = []
+    for i in range(repeat):
+        workspace = make_workspace(data_dir)
+        env = dict(os.environ, PYTHONPATH=os.path.join(workspace, 'data_scripts', 'utils'))
+        if run_downloads:
+            env.update(SWAMP_SOURCE='local', SWAMP_SOURCE_DB=get_source_db(data_dir))
+        env.update(env_overrides)
+        print('--- Run %s of %s (%s rows, workspace: %s)' % (i + 1, repeat, rows, workspace))
+        for stage, script in stages:
+            if stage not in stage_names:
+                continue
+            script_path = os.path.join(workspace, 'data_scripts', script)
+            args = ['--input', os.path.join(workspace, 'benchmark_laa_input.csv')] if stage == 'tissue_laa' else []
+            log_path = os.path.join(workspace, 'log_%s.txt' % stage)
+            wall_s, user_s, sys_s, peak_rss_mb, returncode = run_stage(script_path, os.path.dirname(script_path), env, log_path, args)
+            record = {
+                'run_id': run_id,
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': commit,
+                'dirty': dirty,
+                'rows': rows,
+                'seed': seed,
+                'stage': stage,
+                'script': script,
+                'repeat': i + 1,
+                'wall_s': round(wall_s, 3),
+                'user_s': None if user_s is None else round(user_s, 3),
+                'sys_s': None if sys_s is None else round(sys_s, 3),
+                'peak_rss_mb': None if peak_rss_mb is None else round(peak_rss_mb, 1),
+                'returncode': returncode,
+                'env': env_overrides,
+                **environment
+            }
+            records.append(record)
+            with open(output, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            print('--- %s: %.2f s, %s MB peak%s' % (stage, wall_s, record['peak_rss_mb'], '' if returncode == 0 else ' (FAILED, see %s)' % log_path))
+        # The workspace is kept if a step failed, so the log of the step can be checked
+        if (not keep_workspace) and all(record['returncode'] == 0 for record in records):
+            shutil.rmtree(workspace, ignore_errors=True)
+    return records
+
+# Function for summarizing the results file: the median wall time and peak memory of each step, for each commit and number of rows. Failed runs are not included
+def summarize(output=results_file, commits=None):
+    results_df = pd.read_json(output, lines=True)
+    results_df = results_df[results_df['returncode'] == 0]
+    if commits:
+        results_df = results_df[results_df['commit'].isin(commits)]
+    results_df['commit'] = results_df['commit'] + np.where(results_df['dirty'], '+', '')
+    summary_df = results_df.groupby(['rows', 'stage', 'commit'], sort=False).agg(wall_s=('wall_s', 'median'), peak_rss_mb=('peak_rss_mb', 'median'), runs=('wall_s', 'size'))
+    summary_df = summary_df.unstack('commit')
+    # Sort the steps in the order they are run
+    stage_order = {stage: i for i, (stage, _) in enumerate(stages)}
+    return summary_df.sort_index(level='stage', key=lambda index: index.map(stage_order)).sort_index(level='rows', sort_remaining=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data scripts on synthetic CEDEN-shaped data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000], help='Number of water quality rows (ex. 100000 1000000 10000000). The other data types are scaled to the same proportions as the real data')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the generated data')
+    parser.add_argument('--stages', nargs='+', default=[stage for stage, _ in stages if stage not in download_stages], choices=[stage for stage, _ in stages], help='Steps to run (default: all except the download steps). A step needs the files written by the steps before it (ex. sites_get_data needs the station indexes written by the data quality steps, and tox_download needs the stations written by datum_download), so include those steps too')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to run each step')
+    parser.add_argument('--env', nargs='*', default=[], help='Environment variables for the data scripts, as NAME=VALUE (ex. SWAMP_WORKERS=4)')
+    parser.add_argument('--output', default=results_file, help='Results file (JSON lines). Results are appended to the file')
+    parser.add_argument('--keep-workspace', action='store_true', help='Do not delete the workspace after the run (to check the output files and logs)')
+    parser.add_argument('--regenerate', action='store_true', help='Generate the data again instead of using the cached data')
+    parser.add_argument('--summary', action='store_true', help='Print the median wall time and peak memory of each step for each commit in the results file, instead of running the benchmark')
+    parser.add_argument('--commits', nargs='*', help='Commits to include in the summary (default: all)')
+    args = parser.parse_args()
+
+    if args.summary:
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+            print(summarize(args.output, args.commits))
+        sys.exit()
+
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+    env_overrides = dict(value.split('=', 1) for value in args.env)
+    failed = []
+    for rows in args.rows:
+        records = run_benchmark(rows, args.seed, args.stages, args.repeat, env_overrides, args.output, args.keep_workspace, args.regenerate)
+        failed += [record['stage'] for record in records if record['returncode'] != 0]
+    print('--- Results written to %s' % args.output)
+    print('%s finished running' % os.path.basename(__file__))
+    if failed:
+        sys.exit('Failed steps: %s' % ', '.join(sorted(set(failed))))
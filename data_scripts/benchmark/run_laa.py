@@ -0,0 +1,33 @@
+'''
+This script runs the tissue length-adjusted average step (tissue_laa.get_individual_averages) on its own, so that it can be benchmarked separately from the rest of the tissue processing step. The input is the benchmark_laa_input.csv file written by generate_data.py. The models are fit on p_constants.workers processes (set with the SWAMP_WORKERS environment variable), the same as in 3_tissue_process_data.py
+
+Usage: python run_laa.py --input <path to benchmark_laa_input.csv>
+'''
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tissue'))
+import p_constants # p_constants.py
+import p_utils # p_utils.py
+import tissue_laa # tissue_laa.py
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the tissue length-adjusted average step on the benchmark input')
+    parser.add_argument('--input', required=True, help='Path to the benchmark_laa_input.csv file written by generate_data.py')
+    args = parser.parse_args()
+
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+
+    print('--- Importing data')
+    individual_records = p_utils.import_csv(args.input, date_cols=['SampleDate'], data_type='tissue')
+
+    print('--- Calculating the averages of %s individual records (workers: %s)' % (len(individual_records), p_constants.workers))
+    laa_output, model_avgs_output = tissue_laa.get_individual_averages(individual_records, workers=p_constants.workers)
+    print('--- %s averages' % len(model_avgs_output))
+
+    print('%s finished running' % os.path.basename(__file__))
@@ -14,7 +14,10 @@ import os
 import sys
 
 sys.path.insert(0, '..\\utils\\') # Must include this line to import modules from another folder
+import p_archive # p_archive.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_query # p_query.py
 import p_utils # p_utils.py
 
 
@@ -24,16 +27,19 @@ if __name__ == '__main__':
 
     # Download data from the internal CEDEN data mart, limited to the defined analytes in ceden_phab_analytes
     print('--- Downloading data from %s' % p_constants.datamart_tables['habitat'])
-    sql_phab = "SELECT * FROM " + p_constants.datamart_tables['habitat'] + " WHERE Program in (" + ', '.join(["'{}'".format(value) for value in p_constants.habitat_programs]) + ") AND Analyte in (" + ', '.join(["'{}'".format(value) for value in p_constants.ceden_phab_analytes]) + ")"
-    phab_df = p_utils.download_data(sql_phab, p_constants.phab_date_cols)
+    with p_metrics.stage('download') as m:
+        sql_phab, params_phab = p_query.get_download_query('habitat', 'habitat') # See p_constants.download_filters and p_constants.download_pushdown_rules
+        phab_df = p_utils.download_data(sql_phab, p_constants.phab_date_cols, data_type='habitat', params=params_phab)
+        m['rows_out'] = len(phab_df)
 
     # Write data file in support files folder
-    outdir = '../../support_files/'
-    p_utils.write_csv(phab_df, 'ceden_swamp_phab', outdir)
+    with p_metrics.stage('write', rows_in=len(phab_df)):
+        outdir = '../../support_files/'
+        p_utils.write_csv(phab_df, 'ceden_swamp_phab', outdir)
 
-    # Write unprocessed data to the archive folder for reference
-    outdir_archive = '../../ceden_files/'
-    p_utils.write_csv(phab_df, 'ceden_swamp_phab' + '_' + p_constants.today, outdir_archive + '/' + p_constants.today)
+    # Save a snapshot of the data in the CEDEN archive. Only the blocks of rows that changed since a previous run are saved (see p_archive.py)
+    with p_metrics.stage('archive', rows_in=len(phab_df)):
+        p_archive.archive_snapshot(phab_df, 'ceden_swamp_phab')
 
     print('%s finished running' % os.path.basename(__file__))
 
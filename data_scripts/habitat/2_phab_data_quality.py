@@ -11,11 +11,11 @@ Updated: 03/14/2024
 '''
 
 import os
-import pandas as pd
 import sys
 
 sys.path.insert(0, '..\\utils\\') 
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 import p_utils_dq # p_utils_dq.py
 
@@ -26,27 +26,47 @@ if __name__ == '__main__':
 
     print('--- Importing data')
     #####  Import data from previous script
-    phab_df = pd.read_csv('../../support_files/ceden_swamp_phab.csv', parse_dates=p_constants.phab_date_cols, na_values=p_constants.allowed_nans, keep_default_na=False)
+    with p_metrics.stage('import') as m:
+        p_utils.check_file_columns('../../support_files/ceden_swamp_phab.csv', 'phab_data_quality') # Stop here if a column used by the data quality functions is missing (see p_constants.column_manifests)
+        phab_df = p_utils.read_csv('../../support_files/ceden_swamp_phab.csv', parse_dates=p_constants.phab_date_cols, dtype=p_utils.get_schema_dtypes('habitat'), na_values=p_constants.allowed_nans, keep_default_na=False)
 
-    # 10/15/23 - Dates are not being converted to datetime in the read_csv function, for some reason, so force the conversion here
-    phab_df[p_constants.phab_date_cols] = phab_df[p_constants.phab_date_cols].apply(pd.to_datetime, errors='coerce')
+        # 10/15/23 - Dates are not being converted to datetime in the read_csv function, for some reason, so force the conversion here. The date fields are converted with the rest of the schema
+        phab_df = p_utils.apply_schema(phab_df, 'habitat')
+        m['rows_out'] = len(phab_df)
 
     #####  Process data
     # Import station data with a subset of the fields
-    station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) 
-    # Join datum field to the df
-    phab_df = p_utils.join_datum(phab_df, station_df) 
+    with p_metrics.stage('join_datum', rows_in=len(phab_df)) as m:
+        station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) 
+        # Join datum field to the df
+        phab_df = p_utils.join_datum(phab_df, station_df) 
+        m['rows_out'] = len(phab_df)
 
     print('--- Cleaning data')
-    phab_df = p_utils_dq.clean_data(phab_df)
+    with p_metrics.stage('clean', rows_in=len(phab_df)) as m:
+        phab_df = p_utils_dq.clean_data(phab_df)
+        m['rows_out'] = len(phab_df)
 
     print('--- Adding data quality fields')
-    # Add the DataQuality and DataQualityIndicator fields
-    phab_dq_df = p_utils_dq.add_data_quality(phab_df)
+    with p_metrics.stage('data_quality', rows_in=len(phab_df)) as m:
+        # Add the DataQuality and DataQualityIndicator fields
+        # In incremental mode, only the records whose data quality fields are not in the cache from the previous run are assessed (see p_constants.dq_incremental)
+        dq_cache = p_utils_dq.import_dq_cache('habitat') if p_constants.dq_incremental else None
+        phab_dq_df = p_utils_dq.add_data_quality(phab_df, 'habitat', dq_cache)
+        if dq_cache is not None:
+            p_utils_dq.export_dq_cache(dq_cache, 'habitat')
+        m['rows_out'] = len(phab_dq_df)
+
+    # List the codes that are not in the data quality rules (see p_constants.dq_diagnostics_file)
+    p_utils_dq.report_dq_diagnostics('habitat')
     
     #####  Export data
     print('--- Exporting data')
-    outdir = '../../support_files'
-    p_utils.write_csv(phab_dq_df, 'swamp_phab_data_quality', outdir)
+    with p_metrics.stage('write', rows_in=len(phab_dq_df)):
+        outdir = '../../support_files'
+        p_utils.write_csv(phab_dq_df, 'swamp_phab_data_quality', outdir, nan_text_cols=p_constants.nan_text_cols)
+
+        # Write the station index (most recent sample date and record counts for each station). Used by the sites step
+        p_utils.write_csv(p_utils.get_station_index(phab_dq_df), 'swamp_phab_station_index', outdir)
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
@@ -13,6 +13,7 @@ import sys
 
 sys.path.insert(0, '../utils/') 
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 
 
@@ -22,10 +23,15 @@ if __name__ == '__main__':
 
     print('--- Importing data')
     #####  Import data from previous script
-    phab_df = p_utils.import_csv('../../support_files/swamp_phab_data_quality.csv', date_cols=p_constants.phab_date_cols)
+    m = p_metrics.start_stage('import')
+    p_utils.check_file_columns('../../support_files/swamp_phab_data_quality.csv', 'phab_process') # Stop here if a column used below is missing (see p_constants.column_manifests)
+    phab_df = p_utils.import_csv('../../support_files/swamp_phab_data_quality.csv', date_cols=p_constants.phab_date_cols, data_type='habitat')
+    m['rows_out'] = len(phab_df)
+    p_metrics.end_stage(m)
 
 
     ##### Remove unneeded records or records with missing data elements
+    m = p_metrics.start_stage('filter', rows_in=len(phab_df))
     # Drop records with StationCode = FIELDQA_SWAMP
     phab_df = phab_df.drop(phab_df[(phab_df['StationCode'] == 'FIELDQA')].index)
     phab_df = phab_df.drop(phab_df[(phab_df['StationCode'] == 'FIELDQA_SWAMP')].index)
@@ -53,19 +59,16 @@ if __name__ == '__main__':
 
     # Added 2/12/24 - Drop CollectionReplicate records
     phab_df = phab_df.drop(phab_df[phab_df['CollectionReplicate'] != 1].index)
+    m['rows_out'] = len(phab_df)
+    p_metrics.end_stage(m)
 
 
     #####  Process data
     print('--- Processing data')
 
-    # Strip special characters
-    phab_df.replace(r'\t',' ', regex=True, inplace=True) # tab
-    phab_df.replace(r'\r',' ', regex=True, inplace=True) # carriage return
-    phab_df.replace(r'\n',' ', regex=True, inplace=True) # newline
-    phab_df.replace(r'\f',' ', regex=True, inplace=True) # formfeed
-    phab_df.replace(r'\v',' ', regex=True, inplace=True) # vertical tab
-    phab_df.replace(r'\|', ' ', regex=True, inplace=True) # pipe
-    phab_df.replace(r'\"', ' ', regex=True, inplace=True) # quotes
+    m = p_metrics.start_stage('enrich', rows_in=len(phab_df))
+    # Strip special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, quotes). Works on both text and categorical columns
+    phab_df = p_utils.strip_special_characters(phab_df)
 
     # Strip whitespace from StationName. See example station: 205PS0365
     phab_df['StationName'] = phab_df['StationName'].apply(lambda x: x.strip())
@@ -88,8 +91,9 @@ if __name__ == '__main__':
     phab_df['AnalyteDisplay'] = phab_df['AnalyteDisplay'].replace('IPI', 'Index of Physical Habitat Integrity (IPI)')
 
     # Add analyte categories
-    analytes_df = p_utils.import_csv('../../assets/joined_analyte_list_3-21-23.csv') 
+    analytes_df = p_utils.import_stage_columns('../../assets/joined_analyte_list_3-21-23.csv', 'analytes_lookup') 
     analyte_cols = analytes_df[['CedenAnalyteName', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3']] 
+    analyte_cols = p_utils.match_categories(analyte_cols, 'CedenAnalyteName', phab_df['Analyte'].dtype) # Match the categorical Analyte column for a faster join
     phab_df = pd.merge(phab_df, analyte_cols, how='left', left_on='Analyte', right_on='CedenAnalyteName') 
     phab_df.drop(['CedenAnalyteName'], axis=1, inplace=True) # Drop unneeded fields
 
@@ -102,12 +106,13 @@ if __name__ == '__main__':
 
     # Add Region field
     # Import station data
-    stations_df = p_utils.import_csv('../../support_files/swamp_stations.csv', date_cols=['LastSampleDate']) 
+    stations_df = p_utils.import_stage_columns('../../support_files/swamp_stations.csv', 'stations_lookup') 
     station_cols = stations_df[['StationCode', 'Region']] 
+    station_cols = p_utils.match_categories(station_cols, 'StationCode', phab_df['StationCode'].dtype) # Keep StationCode categorical after the join
     # Join region values
     phab_df = pd.merge(phab_df, station_cols, how='left', on='StationCode') 
     # After joining, some records will have a blank region value. Use the first character of StationCode (usually a number in reference to the region) or leave blank
-    phab_df['Region'] = phab_df.apply(
+    phab_df['Region'] = phab_df[['StationCode', 'Region']].apply(
         lambda row: row['StationCode'][0] if np.isnan(row['Region']) else row['Region'],
         axis=1
     )
@@ -129,7 +134,7 @@ if __name__ == '__main__':
     phab_df.loc[phab_df['ParentProject'].isin(p_constants.spot_parent_projects), 'Spot'] = True
 
     # Add StationCategory column for reference sites
-    ref_sites_df = p_utils.import_csv(p_constants.reference_sites_file)
+    ref_sites_df = p_utils.import_stage_columns(p_constants.reference_sites_file, 'reference_sites_lookup')
     ref_cols = ref_sites_df[['cedenid', 'StationCategory']] 
     # Left join on StationCode
     phab_df = pd.merge(phab_df, ref_cols, how='left', left_on=phab_df['StationCode'].str.lower(), right_on=ref_cols['cedenid'].str.lower())
@@ -138,16 +143,21 @@ if __name__ == '__main__':
 
     # Change units for indices
     # CEDEN value for CSCI is null
+    phab_df['Unit'] = p_utils.add_category(phab_df['Unit'], 'score') # Unit is a categorical column, so the new value must be added as a category first
     phab_df.loc[phab_df['Analyte'] == 'CSCI', 'Unit'] = 'score' 
     phab_df.loc[phab_df['Analyte'] == 'IPI', 'Unit'] = 'score'
 
     # Add DisplayText column. This field is used in the dashboard and standardized across the different data types. Populate with empty values for now until needed
     phab_df['DisplayText'] = np.nan
+    m['rows_out'] = len(phab_df)
+    p_metrics.end_stage(m)
 
 
     #####  Write data
     # Write file in a dated folder in the export folder
     phab_file_name = 'swamp_habitat_data'
+    m = p_metrics.start_stage('write', rows_in=len(phab_df))
     p_utils.write_csv(phab_df, phab_file_name + '_' + p_constants.today, '../../export' + '/' + p_constants.today) 
+    p_metrics.end_stage(m)
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
@@ -14,23 +14,24 @@ Updated: 03/14/2024
 '''
 
 import os
-import pandas as pd
-import pyodbc
 import sys
 
 sys.path.insert(0, '..\\utils\\') 
+import p_archive # p_archive.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_query # p_query.py
+import p_source # p_source.py
 import p_utils  # p_utils.py
 
 # This function is specific to this script. Use this function instead of the shared function in p_utils.py
 def get_station_data():
     try:
-        sql = "SELECT StationCode, Datum FROM %s ;" % p_constants.datamart_tables['stations']
-        cnxn = pyodbc.connect(Driver='SQL Server', Server=p_constants.SERVER1, uid=p_constants.UID, pwd=p_constants.PWD)
-        df = pd.read_sql(sql, cnxn)
+        sql, params = p_query.get_download_query('stations', 'stations', columns=['StationCode', 'Datum'])
+        df = p_source.read_sql(sql, params=params)
         return df
-    except:
-        print("Couldn't connect to %s." % p_constants.SERVER1)
+    except Exception as e:
+        print("Couldn't get data from %s: %s" % (p_source.get_source_name(), e))
 
 
 if __name__ == '__main__':
@@ -38,16 +39,16 @@ if __name__ == '__main__':
     print('Running %s' % os.path.basename(__file__))
 
     print('--- Downloading data from %s' % p_constants.datamart_tables['stations'])
-    ceden_stations_df = get_station_data()
+    with p_metrics.stage('download') as m:
+        ceden_stations_df = get_station_data()
+        m['rows_out'] = len(ceden_stations_df)
 
     print('--- Writing ceden_stations.csv')
-    # Write data in support files folder
+    # Write data in support files folder, and save a snapshot in the CEDEN archive for reference (see p_archive.py)
     file_name = 'ceden_stations'
     outdir = '../../support_files'
-    p_utils.write_csv(ceden_stations_df, file_name, outdir) 
-
-    # Write data file in archive folder for reference
-    outdir_archive = '../../ceden_files/'
-    p_utils.write_csv(ceden_stations_df, file_name + '_' + p_constants.today, outdir_archive + '/' + p_constants.today)
+    with p_metrics.stage('write', rows_in=len(ceden_stations_df)):
+        p_utils.write_csv(ceden_stations_df, file_name, outdir)
+        p_archive.archive_snapshot(ceden_stations_df, file_name)
 
     print('%s finished running' % os.path.basename(__file__))
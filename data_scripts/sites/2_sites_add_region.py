@@ -1,27 +1,53 @@
 '''
-Step 2: This script uses the SWAMP stations dataset and adds a new field: 'Region'. The values in this new field are numeric (1-9) and they refer to the Regional Water Quality Control Board that the station is located in. Geopandas GIS functions are used to find where the point is located relative to the RB boundaries.
+Step 2: This script uses the SWAMP stations dataset and adds a new field: 'Region'. The values in this new field are numeric (1-9) and they refer to the Regional Water Quality Control Board that the station is located in. The p_regions module is used to find where the point is located relative to the RB boundaries (point-in-polygon, or the nearest RB polygon for points slightly outside of the borders).
+
+The RB values are saved to a cache file (see p_constants.region_cache_file). Only the stations that are new or whose coordinates changed since the last run are compared to the RB boundaries. The cache is cleared automatically when the RB boundaries file changes.
 
 Updated: 03/14/2024 
 '''
 
-import geopandas as gpd
 import os
 import pandas as pd
 import sys
 
 sys.path.insert(0, '..\\utils\\') 
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_regions # p_regions.py
 import p_utils  # p_utils.py
 
-# Function used for finding the nearest RB polygon to a site. Used for those sites that do not fall directly within a RB polygon
-def get_nearest_region(point):
-    # Calculate the point's distance to all of the regions. Sort ascending by distance, and then pick the first object in the array (the nearest feature)
-    polygon_index = rb_gdf.distance(point).sort_values().index[0]
-    nearest = rb_gdf.loc[polygon_index]
-    return nearest['rb'] # Return the 'rb' attribute of the feature
+# Number of decimal places used when comparing station coordinates to the cached coordinates
+cache_decimals = 6
+
+# Function for finding the RB value of each station. Returns a dataframe with the StationCode and rb fields
+# The RB boundaries layer (WGS 84) and the station coordinates are both projected to EPSG:3310 (NAD 83 CA Teale Albers, https://spatialreference.org/ref/epsg/3310/) before the points are compared to the polygons. Stations located slightly outside the border of the RBs are assigned to the nearest RB polygon
+def get_regions(stations_df):
+    regions = p_regions.load_regions(p_constants.rb_boundaries_file, value_property='rb')
+    rb = p_regions.get_region_values(regions, stations_df['TargetLongitude'].values, stations_df['TargetLatitude'].values)
+    return pd.DataFrame({'StationCode': stations_df['StationCode'].values, 'rb': rb})
+
+# Function for getting the cache key fields (StationCode and rounded coordinates) of a stations dataframe
+def get_cache_keys(df):
+    return pd.DataFrame({
+        'StationCode': df['StationCode'],
+        'TargetLatitude': df['TargetLatitude'].round(cache_decimals),
+        'TargetLongitude': df['TargetLongitude'].round(cache_decimals)
+    })
+
+# Function for importing the cached RB values. Returns an empty dataframe if there is no cache file or if the RB boundaries file has changed since the cache was saved
+def import_region_cache(boundaries_hash):
+    cache_cols = ['StationCode', 'TargetLatitude', 'TargetLongitude', 'rb', 'BoundariesHash']
+    if not os.path.exists(p_constants.region_cache_file):
+        return pd.DataFrame(columns=cache_cols)
+    cache_df = p_utils.import_csv(p_constants.region_cache_file)
+    if cache_df.empty:
+        return pd.DataFrame(columns=cache_cols)
+    if (cache_df['BoundariesHash'] != boundaries_hash).any():
+        print('--- RB boundaries file has changed, clearing the region cache')
+        return pd.DataFrame(columns=cache_cols)
+    return cache_df
 
 
-# Change anaconda environment to geo_env before running
 if __name__ == '__main__':
     p_utils.print_spacer()
     print('Running %s' % os.path.basename(__file__))
@@ -30,43 +56,35 @@ if __name__ == '__main__':
     #####  Import data  #####
     print('--- Importing data')
     # Import data from the previous script
+    m = p_metrics.start_stage('import')
     stations_df = p_utils.import_csv('../../support_files/swamp_stations_without_region.csv') 
+    m['rows_out'] = len(stations_df)
+    p_metrics.end_stage(m)
 
-    # Convert station coordinates to gdf. Use standard WGS 84 for importing the data, will convert to a projected system later (https://spatialreference.org/ref/epsg/4326/)
-    stations_gdf = gpd.GeoDataFrame(stations_df, geometry=gpd.points_from_xy(stations_df.TargetLongitude, stations_df.TargetLatitude), crs='EPSG:4326')
-
-    # Define coordinate system of the gdf and convert to projected
-    # CRS 3310: NAD 83 CA Teale Albers (https://spatialreference.org/ref/epsg/3310/)
-    # 10/16/23 - For some reason, trying to convert this dataframe to a projected system (3310 or 4269) results in "inf" values in the geometry column. Not sure why.
-    # 03/06/24 - Seems to be working now
-    stations_gdf = stations_gdf.to_crs('EPSG:3310')
-    
-    # Load geojson of regional board boundaries (comes in as EPSG: 4326) and convert to same projection
-    rb_gdf = gpd.read_file(p_constants.rb_boundaries_file)
-    rb_gdf.crs = "EPSG:4326"
-
-    # 10/16/23 - Cannot convert the station layer to EPSG 3310 or 4269. Not sure why. So keep the region layer in WGS 84. Will have to perform the spatial join and nearest region function on non-projected geometries (not ideal), but this is the only option until I find out what's wrong. The results seem to be ok at least.
-    # 03/06/24 - Seems to be working now
-    rb_gdf = rb_gdf.to_crs('EPSG:3310')
+    # Import the cached RB values. The cache is only used if it was made with the current RB boundaries file
+    boundaries_hash = p_utils.get_file_hash(p_constants.rb_boundaries_file)
+    cache_df = import_region_cache(boundaries_hash)
 
 
     #####  Process data  
-    # Overlay points on rb boundaries and do a left spatial join
-    stations_with_rb = gpd.sjoin(stations_gdf, rb_gdf, how='left', predicate='within')
-
-    # After the join, a subset of points will not have a joined rb number due to these points being located slightly outside the border of the rb. Select these points
-    missing_rb = stations_with_rb[stations_with_rb['rb'].isna()].copy()
-
-    # Apply the get_nearest_region function to all points with missing RB values
-    missing_rb['rb'] = missing_rb.apply(lambda x: get_nearest_region(x.geometry), axis=1)
-
-    # Join these missing rb values back to the df from the spatial join
-    # Chose to iterate rather than do an actual merge/join because I didn't want the join to append new columns to the df. It can be done either way
-    for i, row in missing_rb.iterrows():
-        stations_with_rb.loc[stations_with_rb['StationCode'] == row['StationCode'], 'rb'] = row['rb']
-
-    # Join back to original stations df (before spatial join)
-    stations_with_rb = stations_with_rb[['StationCode', 'rb']] # select the two fields we want/need
+    m = p_metrics.start_stage('add_region', rows_in=len(stations_df))
+    # Look up the cached RB value of each station with the same StationCode and coordinates as in the cache
+    station_keys = get_cache_keys(stations_df)
+    cached_rb = pd.merge(station_keys, cache_df, how='left', on=['StationCode', 'TargetLatitude', 'TargetLongitude'])['rb']
+    is_cached = cached_rb.notna().values
+    stations_with_rb = pd.DataFrame({'StationCode': stations_df['StationCode'][is_cached], 'rb': cached_rb[is_cached].values})
+
+    # Find the RB values of the new stations and the stations with changed coordinates
+    print('--- Finding regions for %s new or moved stations (%s cached)' % ((~is_cached).sum(), is_cached.sum()))
+    if (~is_cached).any():
+        stations_with_rb = pd.concat([stations_with_rb, get_regions(stations_df[~is_cached])], ignore_index=True)
+
+    # Save the RB values of the current stations to the cache for the next run
+    cache_df = pd.merge(station_keys, stations_with_rb, how='left', on='StationCode')
+    cache_df['BoundariesHash'] = boundaries_hash
+    p_utils.write_csv(cache_df, os.path.splitext(os.path.basename(p_constants.region_cache_file))[0], os.path.dirname(p_constants.region_cache_file))
+
+    # Join back to original stations df
     stations_df = pd.merge(stations_df, stations_with_rb, how='left', on='StationCode') # left join on StationCode
     
     # Rename "rb" field to "Region"
@@ -89,16 +107,17 @@ if __name__ == '__main__':
     ref_cols = ref_sites_df[['cedenid', 'StationCategory']] # Get a subset of the columns needed for join
     stations_df = pd.merge(stations_df, ref_cols, how='left', left_on=stations_df['StationCode'].str.lower(), right_on=ref_cols['cedenid'].str.lower())
     stations_df = stations_df.drop(['key_0', 'cedenid'], axis=1)
+    m['rows_out'] = len(stations_df)
+    p_metrics.end_stage(m)
 
 
     #####  Write file
     file_name = 'swamp_stations'
     print('--- Writing %s.csv' % file_name)
 
-    # Write file in support files folder
-    p_utils.write_csv(stations_df, file_name, '../../support_files')
-
-    # Write file in a dated folder, inside the export folder
-    p_utils.write_csv(stations_df, file_name + '_' + p_constants.today, '../../export/' + p_constants.today)
+    # Write file in support files folder, and a copy in a dated folder inside the export folder
+    m = p_metrics.start_stage('write', rows_in=len(stations_df))
+    p_utils.write_csv(stations_df, file_name, '../../support_files', copies=[(file_name + '_' + p_constants.today, '../../export/' + p_constants.today)])
+    p_metrics.end_stage(m)
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
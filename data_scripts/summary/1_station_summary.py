@@ -0,0 +1,44 @@
+'''
+This script creates the station summary tables used by the SWAMP Data Dashboard. For each dataset exported by the process scripts (water quality, habitat, toxicity, and tissue), the records of each station, analyte, matrix, and unit are summarized: the number of records, the number of censored records, the min, max, and median value, the most recent value and date, and the first and last year with records. The dashboard can load the summary of a station from these small tables instead of downloading the full dataset.
+
+The summary tables are written to the same dated folder in the export folder as the datasets (ex. swamp_water_quality_station_summary_2024-03-14.csv). The file names do not match the file names the upload scripts of the datasets look for, so those scripts still upload the full datasets. The summary tables are uploaded by 2_station_summary_upload_portal.py. See p_constants.station_summaries for the columns summarized for each data type.
+
+Important: Run this script after the process scripts (3_wq_process_data.py, 3_phab_process_data.py, 2_tox_process_data.py, and 3_tissue_process_data.py). The data types that do not have an exported dataset in today's export folder are skipped.
+
+Updated: 10/19/2026
+'''
+
+import os
+import sys
+
+sys.path.insert(0, '../utils/')
+import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_utils  # p_utils.py
+
+
+if __name__ == '__main__':
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+
+    outdir = '../../export' + '/' + p_constants.today
+    for data_type, summary in p_constants.station_summaries.items():
+        import_file_path = '%s/%s_%s.csv' % (outdir, summary['file_name'], p_constants.today)
+        if not os.path.exists(import_file_path):
+            print('--- %s not found, skipping the %s summary' % (import_file_path, data_type))
+            continue
+
+        print('--- Summarizing %s data' % data_type)
+        # Only import the columns used by the summary (see p_constants.column_manifests)
+        with p_metrics.stage('import_%s' % data_type) as m:
+            df = p_utils.import_stage_columns(import_file_path, summary['stage'], parse_dates=[summary['date']], low_memory=False)
+            m['rows_out'] = len(df)
+
+        with p_metrics.stage('summarize_%s' % data_type, rows_in=len(df)) as m:
+            summary_df = p_utils.get_station_summary(df, summary['value'], summary['date'], summary['year'])
+            m['rows_out'] = len(summary_df)
+
+        with p_metrics.stage('write_%s' % data_type, rows_in=len(summary_df)):
+            p_utils.write_csv(summary_df, 'swamp_%s_station_summary_%s' % (data_type, p_constants.today), outdir)
+
+    print('%s finished running' % os.path.basename(__file__))
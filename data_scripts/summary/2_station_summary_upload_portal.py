@@ -0,0 +1,39 @@
+'''
+Step 2: This script gets the current dated station summary tables (from the export folder, see 1_station_summary.py) and uploads them to the open data portal. If there is no directory in the export folder with the current date, then the script will not be able to locate the files and the script will not run.
+
+Important: Each summary table is uploaded to its own portal resource (see p_constants.station_summary_resource_ids). The portal resources of the summary tables have to be created on the portal before the tables can be uploaded. The summary tables without a resource ID are skipped.
+
+Updated: 10/19/2026
+'''
+
+import os
+import sys
+
+sys.path.insert(0, '../utils/')
+import chunked_upload as cu # chunked_upload.py
+import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_utils  # p_utils.py
+
+
+if __name__ == '__main__':
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
+
+    directory = '../../export/%s' % p_constants.today # Locate folder inside the export folder with today's date
+    for data_type in p_constants.station_summaries:
+        file_path = '%s/swamp_%s_station_summary_%s.csv' % (directory, data_type, p_constants.today)
+        resource_id = p_constants.station_summary_resource_ids[data_type]
+        if not os.path.exists(file_path):
+            print('--- %s not found, skipping the %s summary' % (file_path, data_type))
+            continue
+        if not resource_id:
+            print('--- No portal resource ID for the %s summary, skipping the upload (see p_constants.station_summary_resource_ids)' % data_type)
+            continue
+
+        # Upload file
+        print('--- Uploading %s station summary file' % data_type)
+        with p_metrics.stage('upload_%s' % data_type):
+            cu.upload_chunked_data(resource_id, file_path, (1024 * 1024 * 64)) # 64MB chunk
+
+    print('%s finished running' % os.path.basename(__file__))
@@ -14,7 +14,10 @@ import os
 import sys
 
 sys.path.insert(0, '../utils/') # Must include this line to import modules from another folder
+import p_archive # p_archive.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_query # p_query.py
 import p_utils # p_utils.py
 
 
@@ -24,16 +27,19 @@ if __name__ == '__main__':
 
     # Download SWAMP data from the internal CEDEN data mart
     print('--- Downloading data from %s' % p_constants.datamart_tables['tissue'])
-    sql_tissue = "SELECT * FROM " + p_constants.datamart_tables['tissue'] + " WHERE (ProgramName = 'Surface Water Ambient Monitoring Program')"
-    tissue_df = p_utils.download_data(sql_tissue, p_constants.tissue_date_cols)
+    with p_metrics.stage('download') as m:
+        sql_tissue, params_tissue = p_query.get_download_query('tissue', 'tissue') # See p_constants.download_filters and p_constants.download_pushdown_rules
+        tissue_df = p_utils.download_data(sql_tissue, p_constants.tissue_date_cols, data_type='tissue', params=params_tissue)
+        m['rows_out'] = len(tissue_df)
 
     # Write data file in support files folder
-    outdir = '../../support_files/'
-    p_utils.write_csv(tissue_df, 'ceden_swamp_tissue', outdir)
+    with p_metrics.stage('write', rows_in=len(tissue_df)):
+        outdir = '../../support_files/'
+        p_utils.write_csv(tissue_df, 'ceden_swamp_tissue', outdir)
 
-    # Write data file in archive folder
-    outdir_archive = '../../ceden_files/'
-    p_utils.write_csv(tissue_df, 'ceden_swamp_tissue' + '_' + p_constants.today, outdir_archive + '/' + p_constants.today)
+    # Save a snapshot of the data in the CEDEN archive. Only the blocks of rows that changed since a previous run are saved (see p_archive.py)
+    with p_metrics.stage('archive', rows_in=len(tissue_df)):
+        p_archive.archive_snapshot(tissue_df, 'ceden_swamp_tissue')
 
     print('%s finished running' % os.path.basename(__file__))
 
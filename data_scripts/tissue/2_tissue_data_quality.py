@@ -7,11 +7,11 @@ Updated: 03/14/2024
 '''
 
 import os
-import pandas as pd
 import sys
 
 sys.path.insert(0, '../utils/') # Must include this line to import modules from another folder
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 import p_utils_dq # p_utils_dq.py
 
@@ -22,14 +22,19 @@ if __name__ == '__main__':
 
     print('--- Importing data')
     # Added "na_values" and "keep_default_na" parameters to deal with "AttributeError: 'float' object has no attribute 'split'" error in DQ functions
-    tissue_df = pd.read_csv('../../support_files/ceden_swamp_tissue.csv', parse_dates=p_constants.tissue_date_cols, na_values=p_constants.allowed_nans, keep_default_na=False)
+    with p_metrics.stage('import') as m:
+        p_utils.check_file_columns('../../support_files/ceden_swamp_tissue.csv', 'tissue_data_quality') # Stop here if a column used by the data quality functions is missing (see p_constants.column_manifests)
+        tissue_df = p_utils.read_csv('../../support_files/ceden_swamp_tissue.csv', parse_dates=p_constants.tissue_date_cols, dtype=p_utils.get_schema_dtypes('tissue'), na_values=p_constants.allowed_nans, keep_default_na=False)
 
-    # 10/24/23 - Some dates are not being converted to datetime in the read_csv function for some reason. Force the conversion here
-    tissue_df[p_constants.tissue_date_cols] = tissue_df[p_constants.tissue_date_cols].apply(pd.to_datetime, errors='coerce')
+        # 10/24/23 - Some dates are not being converted to datetime in the read_csv function for some reason. Force the conversion here. The date fields are converted with the rest of the schema
+        tissue_df = p_utils.apply_schema(tissue_df, 'tissue')
+        m['rows_out'] = len(tissue_df)
 
     # The datum field (from the CEDEN stations table in the CEDEN data mart) is needed to run the data quality estimator. Import the saved dataset and join the values to the dataset here
-    station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) 
-    tissue_df = p_utils.join_datum(tissue_df, station_df) 
+    with p_metrics.stage('join_datum', rows_in=len(tissue_df)) as m:
+        station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) 
+        tissue_df = p_utils.join_datum(tissue_df, station_df) 
+        m['rows_out'] = len(tissue_df)
 
     # Rename columns to match the column names used in the data quality functions. Some of these column names are different even compared to the column names of the other CEDEN tables
     tissue_df = tissue_df.rename(columns={
@@ -39,14 +44,29 @@ if __name__ == '__main__':
     })
 
     print('--- Cleaning data')
-    tissue_df = p_utils_dq.clean_data(tissue_df)
+    with p_metrics.stage('clean', rows_in=len(tissue_df)) as m:
+        tissue_df = p_utils_dq.clean_data(tissue_df)
+        m['rows_out'] = len(tissue_df)
 
     print('--- Adding data quality fields')
-    tissue_dq_df = p_utils_dq.add_data_quality(tissue_df)
+    with p_metrics.stage('data_quality', rows_in=len(tissue_df)) as m:
+        # In incremental mode, only the records whose data quality fields are not in the cache from the previous run are assessed (see p_constants.dq_incremental)
+        dq_cache = p_utils_dq.import_dq_cache('tissue') if p_constants.dq_incremental else None
+        tissue_dq_df = p_utils_dq.add_data_quality(tissue_df, 'tissue', dq_cache)
+        if dq_cache is not None:
+            p_utils_dq.export_dq_cache(dq_cache, 'tissue')
+        m['rows_out'] = len(tissue_dq_df)
+
+    # List the codes that are not in the data quality rules (see p_constants.dq_diagnostics_file)
+    p_utils_dq.report_dq_diagnostics('tissue')
     
     #####  Export data
     print('--- Exporting data')
-    outdir = '../../support_files'
-    p_utils.write_csv(tissue_dq_df, 'swamp_tissue_data_quality', outdir)
+    with p_metrics.stage('write', rows_in=len(tissue_dq_df)):
+        outdir = '../../support_files'
+        p_utils.write_csv(tissue_dq_df, 'swamp_tissue_data_quality', outdir, nan_text_cols=p_constants.nan_text_cols)
+
+        # Write the station index (most recent sample date and record counts for each station). Used by the sites step
+        p_utils.write_csv(p_utils.get_station_index(tissue_dq_df), 'swamp_tissue_station_index', outdir)
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
@@ -6,6 +6,7 @@ Important: Running this script requires having the "swamp_stations.csv" file sav
 Updated: 03/14/2024 
 '''
 
+import hashlib
 import os
 import pandas as pd
 import sys
@@ -14,9 +15,55 @@ import re
 
 sys.path.insert(0, '../utils/') # Must include this line to import modules from another folder
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 sys.path.insert(0, './')
 import tissue_laa # tissue_laa.py
+
+
+# Location of the cache file used by the incremental mode (see p_constants.tissue_incremental). It holds the averages and the group fingerprints from the previous run
+cache_file = '../../support_files/swamp_tissue_summary_cache.pkl'
+# Increase this number when the averaging code changes so that the averages saved by older versions of the script are not reused
+cache_version = 1
+
+# Columns that define the station/species/analyte/year groups used by the incremental mode. Every average is calculated from the records of one of these groups
+summary_key_cols = ['StationCode', 'CommonName', 'DWC_AnalyteWFraction', 'SampleYear']
+
+# Function for getting a hash of the group key columns for each row. The values are converted to text first so that categorical and text columns give the same hash
+def get_group_keys(df, key_cols):
+    return pd.util.hash_pandas_object(df[key_cols].astype(str), index=False)
+
+# Function for getting a fingerprint for each group of records. The fingerprint changes if any record in the group is added, removed, modified, or reordered
+def get_fingerprints(df, group_keys):
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return row_hashes.groupby(group_keys.values).agg(lambda x: hashlib.sha1(x.values.tobytes()).hexdigest())
+
+# Function for importing the cache file from the previous run. Returns None if the file does not exist or was saved by a different version of this script
+def import_cache():
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        cache = pd.read_pickle(cache_file)
+    except Exception as e:
+        print('--- Could not read %s, recalculating all averages: %s' % (cache_file, e))
+        return None
+    if cache.get('version') != cache_version:
+        return None
+    return cache
+
+# Function for getting the row order of a dataframe of averages that combines the averages from the cache and the recalculated averages. The rows are sorted by sort_cols the same way that the groupby functions sort them, so the output is the same as when all of the averages are recalculated. Categorical columns are sorted by their category order, so the sort columns are converted to the dtypes of the current data (dtypes) first
+def get_splice_order(df, sort_cols, dtypes):
+    sort_df = df[sort_cols].copy()
+    for col, dtype in dtypes.items():
+        sort_df[col] = sort_df[col].astype(dtype)
+    return sort_df.sort_values(sort_cols, na_position='last').index
+
+# Function for combining the cached averages of the groups that did not change (keep_keys) with the recalculated averages. Use the same order for all of the dataframes in splice_dfs (a list of (cached df, recalculated df) pairs with the same rows), sorted by sort_cols of the first dataframe
+def splice_summaries(splice_dfs, keep_keys, sort_cols, dtypes):
+    keep = get_group_keys(splice_dfs[0][0], ['StationCode', 'CommonName', 'Analyte', 'SampleYear']).isin(keep_keys).values
+    spliced_dfs = [pd.concat([cached_df[keep], new_df], ignore_index=True) for cached_df, new_df in splice_dfs]
+    order = get_splice_order(spliced_dfs[0], sort_cols, dtypes)
+    return [df.loc[order].reset_index(drop=True) for df in spliced_dfs]
     
 
 if __name__ == '__main__':
@@ -25,9 +72,16 @@ if __name__ == '__main__':
 
     print('--- Importing data')
     import_file_path = '../../support_files/swamp_tissue_data_quality.csv'
-    tissue_df = pd.read_csv(import_file_path, parse_dates=p_constants.tissue_date_cols, low_memory=False)
+    # Low-cardinality text fields (StationCode, CommonName, Analyte, etc.) are imported as categorical columns. This makes the isin, merge, and groupby calls below much faster. See p_constants.schemas
+    # Only the columns used to filter the records and calculate the averages are imported (see p_constants.column_manifests). The QA fields and most of the date fields are not needed here
+    m = p_metrics.start_stage('import')
+    tissue_df = p_utils.import_stage_columns(import_file_path, 'tissue_process', parse_dates=p_constants.tissue_date_cols, dtype=p_utils.get_schema_dtypes('tissue'), low_memory=False)
+    tissue_df = p_utils.apply_schema(tissue_df, 'tissue')
+    m['rows_out'] = len(tissue_df)
+    p_metrics.end_stage(m)
 
     ##### Remove unneeded records or records with missing data elements
+    m = p_metrics.start_stage('filter', rows_in=len(tissue_df))
     # Filter out records with DataQuality = Metadata or Reject record
     tissue_df = tissue_df.drop(tissue_df[(tissue_df['DataQuality'] == 'MetaData') | (tissue_df['DataQuality'] == 'Reject record')].index)
 
@@ -57,26 +111,23 @@ if __name__ == '__main__':
     # Added 2/5/24 - Drop dry weight records. May want to revisit this to include these records in the future
     tissue_df = tissue_df.drop(tissue_df[tissue_df['Unit'] == 'ug/g dw'].index)
     tissue_df = tissue_df.drop(tissue_df[tissue_df['Unit'] == 'NR dw'].index)
+    m['rows_out'] = len(tissue_df)
+    p_metrics.end_stage(m)
 
 
     ##### Process data
-    # Strip special characters
-    tissue_df.replace(r'\t',' ', regex=True, inplace=True) # tab
-    tissue_df.replace(r'\r',' ', regex=True, inplace=True) # carriage return
-    tissue_df.replace(r'\n',' ', regex=True, inplace=True) # newline
-    tissue_df.replace(r'\f',' ', regex=True, inplace=True) # formfeed
-    tissue_df.replace(r'\v',' ', regex=True, inplace=True) # vertical tab
-    tissue_df.replace(r'\|', ' ', regex=True, inplace=True) # pipe
-    tissue_df.replace(r'\"', ' ', regex=True, inplace=True) # quotes
+    m = p_metrics.start_stage('enrich', rows_in=len(tissue_df))
+    # Strip special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, quotes). Works on both text and categorical columns
+    tissue_df = p_utils.strip_special_characters(tissue_df)
 
     # Fill the in NA TissuePrep values as 'None'
-    tissue_df['TissuePrep'].fillna('None', inplace=True)
+    tissue_df['TissuePrep'] = p_utils.fill_missing(tissue_df['TissuePrep'], 'None')
 
     # Create a SampleYear column based on the SampleDate value
     tissue_df['SampleYear'] = tissue_df['SampleDate'].dt.year
 
     # Evaluate each record to determine if a substitute value for Result is needed
-    nd_values = tissue_df.apply(lambda row: p_utils.get_nd_values(row), axis=1)
+    nd_values = tissue_df[p_utils.get_used_columns('nd_values', tissue_df.columns)].apply(lambda row: p_utils.get_nd_values(row), axis=1)
     # Copy the output over to new fields in the dataframe
     tissue_df['ResultAdjusted'] = nd_values[0]
     tissue_df['ResultNote'] = nd_values[1]
@@ -92,13 +143,28 @@ if __name__ == '__main__':
     # Create new column designating if the record/result is for an individual sample or composite sample
     tissue_df.loc[tissue_df['NumberFishperComp'] == 1, 'CompositeIndividual'] = 'Individual'
     tissue_df.loc[tissue_df['NumberFishperComp'] > 1, 'CompositeIndividual'] = 'Composite'
+    m['rows_out'] = len(tissue_df)
+    p_metrics.end_stage(m)
 
 
     ##### ------ Calculate annual averages for the composite and individual records ----- ######
 
+    # Get a fingerprint for each station/species/analyte/year group. In incremental mode, only the groups with a different fingerprint than in the previous run are recalculated
+    group_keys = get_group_keys(tissue_df, summary_key_cols)
+    fingerprints = get_fingerprints(tissue_df, group_keys)
+
+    cache = import_cache() if p_constants.tissue_incremental else None
+    if cache is not None:
+        unchanged = fingerprints.eq(cache['fingerprints'].reindex(fingerprints.index))
+        keep_keys = fingerprints.index[unchanged]
+        summary_records = tissue_df[~group_keys.isin(keep_keys).values]
+        print('--- Incremental mode: recalculating %s of %s groups' % ((~unchanged).sum(), len(fingerprints)))
+    else:
+        summary_records = tissue_df
+
     # Separate thte individual and composite records into separate dataframes
-    composite_records = tissue_df.loc[tissue_df['CompositeIndividual'] == 'Composite']
-    individual_records = tissue_df.loc[tissue_df['CompositeIndividual'] == 'Individual']
+    composite_records = summary_records.loc[summary_records['CompositeIndividual'] == 'Composite']
+    individual_records = summary_records.loc[summary_records['CompositeIndividual'] == 'Individual']
 
     # The set of columns used for the first composite grouping
     group_composite_columns = [
@@ -157,7 +223,8 @@ if __name__ == '__main__':
     # This is done twice, each time on a different set of columns
     # To keep the composite sets, do grouping #1 but not grouping #2
     # Even though we are calculating annual averages, LastSampleDate is still needed for the dashboard when displaying the last sample date for each station
-    composite_summary_df = composite_records.groupby(group_composite_columns, as_index=False).agg({
+    # observed=True: only return the groups that are present in the data. Without it, grouping on categorical columns returns every combination of the categories
+    composite_summary_df = composite_records.groupby(group_composite_columns, as_index=False, observed=True).agg({
         'Result' : 'mean', 
         'ResultAdjusted' : 'mean', 
         'SampleDate' : 'max', 
@@ -166,7 +233,7 @@ if __name__ == '__main__':
     }).reset_index()
 
     # Second grouping includes averaging the TLAvgLength(mm)s
-    composite_summary2_df = composite_summary_df.groupby(group_composite_columns2, as_index=False).agg({
+    composite_summary2_df = composite_summary_df.groupby(group_composite_columns2, as_index=False, observed=True).agg({
         'Result' : 'mean', 
         'ResultAdjusted' : 'mean', 
         'TLAvgLength(mm)' : 'mean', 
@@ -195,11 +262,36 @@ if __name__ == '__main__':
 
     # ---- Individual records - calculate annual averages
     # Use the 'get_individual_averages' function from the tissue_laa.py file to process the individual records and calculate the averages. This function will output an array of two dataframes
-    individual_summary_df = tissue_laa.get_individual_averages(individual_records)
+    # The models are fit on p_constants.workers processes (set with the SWAMP_WORKERS environment variable)
+    m = p_metrics.start_stage('length_adjusted_averages', rows_in=len(individual_records))
+    individual_summary_df = tissue_laa.get_individual_averages(individual_records, workers=p_constants.workers)
+    m['rows_out'] = len(individual_summary_df[1])
+    p_metrics.end_stage(m)
 
     laa_output = individual_summary_df[0] # This dataframe is not really needed, but it includes some additional information and statistical output that is useful to have when reviewing the data
     model_avgs_output = individual_summary_df[1] # This is the output we will combine with the composite averages
 
+    # Incremental mode: add the cached averages of the groups that did not change
+    # Sort the averages in the same order as the groupby functions that created them: the laa columns for the individual averages (see tissue_laa.py) and the second composite grouping columns for the composite averages
+    if cache is not None:
+        analyte_names = {'LocationCodeBOG': 'LocationCode', 'DWC_AnalyteWFraction': 'Analyte'}
+        laa_sort_cols = [analyte_names.get(col, col) for col in tissue_laa.laa_cols]
+        composite_sort_cols = [analyte_names.get(col, col) for col in group_composite_columns2 if col != 'CompositeIndividual']
+        dtypes = {analyte_names.get(col, col): tissue_df[col].dtype for col in tissue_laa.group_cols + group_composite_columns2 if col in tissue_df.columns}
+
+        laa_output, model_avgs_output = splice_summaries([(cache['laa_output'], laa_output), (cache['model_avgs_output'], model_avgs_output)], keep_keys, laa_sort_cols, {col: dtype for col, dtype in dtypes.items() if col in laa_sort_cols})
+        composite_summary2_df, = splice_summaries([(cache['composite_summary'], composite_summary2_df)], keep_keys, composite_sort_cols, {col: dtype for col, dtype in dtypes.items() if col in composite_sort_cols})
+
+    # Save the averages and the group fingerprints for the next incremental run. The cache is only written in incremental mode, so the first incremental run recalculates all of the averages
+    if p_constants.tissue_incremental:
+        pd.to_pickle({
+            'version': cache_version,
+            'fingerprints': fingerprints,
+            'laa_output': laa_output,
+            'model_avgs_output': model_avgs_output,
+            'composite_summary': composite_summary2_df
+        }, cache_file)
+
     # Create a new 'ResultType' field similar to the composite df and include the result type followed by the location code (if present). Example: 'Average of Individuals L1'
     model_avgs_output['ResultType'] = model_avgs_output.apply(lambda row: '{} {}'.format(row['ResultType'], row['LocationCode']) if row['LocationCode'] != 'NA' else row['ResultType'], axis=1)         
 
@@ -241,8 +333,9 @@ if __name__ == '__main__':
     combined_summary_df['MatrixDisplay'] = 'tissue'
 
     # ----- Add Region field
-    stations_df = p_utils.import_csv('../../support_files/swamp_stations.csv', date_cols=['LastSampleDate']) # Import station data
+    stations_df = p_utils.import_stage_columns('../../support_files/swamp_stations.csv', 'stations_lookup') # Import station data (only the columns used by the join)
     station_cols = stations_df[['StationCode', 'Region']] # Get a subset of the columns
+    station_cols = p_utils.match_categories(station_cols, 'StationCode', combined_summary_df['StationCode'].dtype) # Keep StationCode categorical after the join
     combined_summary_df = pd.merge(combined_summary_df, station_cols, how='left', on='StationCode') # Join the region values
     # After joining, some records will have a blank region value. Use the first character of StationCode (usually a number in reference to the region) or leave blank
     combined_summary_df['Region'] = combined_summary_df.apply(
@@ -292,7 +385,7 @@ if __name__ == '__main__':
     combined_summary_df.loc[combined_summary_df['ParentProject'].isin(p_constants.spot_parent_projects), 'Spot'] = True
 
     # Add Reference Site column
-    ref_sites_df = p_utils.import_csv(p_constants.reference_sites_file)
+    ref_sites_df = p_utils.import_stage_columns(p_constants.reference_sites_file, 'reference_sites_lookup')
     ref_cols = ref_sites_df[['cedenid', 'StationCategory']] 
     combined_summary_df = pd.merge(combined_summary_df, ref_cols, how='left', left_on=combined_summary_df['StationCode'].str.lower(), right_on=ref_cols['cedenid'].str.lower())
     combined_summary_df = combined_summary_df.drop('cedenid', axis=1)
@@ -354,9 +447,9 @@ if __name__ == '__main__':
     # Write the summary df to the support_files folder
     export_file_name = 'swamp_tissue_summary_data'
     outdir = '../../support_files/'
-    p_utils.write_csv(combined_summary_df, 'swamp_tissue_summary_data', outdir)
-
-    # Write the summary file (dated) to a dated folder in the export folder
-    p_utils.write_csv(combined_summary_df, export_file_name + '_' + p_constants.today, '../../export' + '/' + p_constants.today) 
+    # Write the summary file (dated) to a dated folder in the export folder with the same call
+    m = p_metrics.start_stage('write', rows_in=len(combined_summary_df))
+    p_utils.write_csv(combined_summary_df, 'swamp_tissue_summary_data', outdir, copies=[(export_file_name + '_' + p_constants.today, '../../export' + '/' + p_constants.today)])
+    p_metrics.end_stage(m)
 
 
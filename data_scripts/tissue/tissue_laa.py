@@ -6,204 +6,207 @@ Updated: 02/29/2024
 
 import pandas as pd
 import numpy as np
+import heapq
 import statsmodels.api as sm
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from multiprocessing import shared_memory
 from re import sub
 from scipy.stats import sem
 
 
-def get_individual_averages(input_df):
+# Columns that define a station, location, species group for the linear model
+group_cols = [
+    'StationCode', 
+    'StationName', 
+    'LocationCodeBOG', 
+    'CommonName', 
+    'DWC_AnalyteWFraction', 
+    'Unit', 
+    'SampleYear', 
+    'FinalID', 
+    'ProgramName', 
+    'TargetLatitude', 
+    'TargetLongitude', 
+    'Datum', 
+    'ParentProjectName', 
+    'ProjectName', 
+    'ProjectCode', 
+    'TissueName', 
+    'TissuePrep'
+]
+
+# Columns of the averages dataframe (laa), in the order used to sort the output. This is the same as group_cols plus Significance (which has one value per group)
+laa_cols = [
+    'StationCode', 
+    'StationName', 
+    'CommonName', 
+    'LocationCodeBOG', 
+    'Significance', 
+    'DWC_AnalyteWFraction', 
+    'Unit', 
+    'SampleYear', 
+    'FinalID', 
+    'ProgramName', 
+    'TargetLatitude', 
+    'TargetLongitude', 
+    'Datum', 
+    'ParentProjectName', 
+    'ProjectName', 
+    'ProjectCode', 
+    'TissueName', 
+    'TissuePrep'
+]
+
+
+# Function for fitting the linear model (ResultAdjusted ~ TLAvgLength) for one group of individual records. Takes in numpy arrays of the lengths (x) and results (y) of the group. Returns the residuals, the predicted result at 350mm, and the significance (p-value of the f-statistic) of the regression
+def fit_ols(x, y):
+    X1 = sm.add_constant(x)  # Add a constant term for the intercept
+    model = sm.OLS(y, X1).fit()
+    predicted_at_350 = model.predict([1, 350])[0]  # Extract the first element of the predicted array
+    significance = model.f_pvalue
+    return model.resid, predicted_at_350, significance
+
+# Models that can be used to fit each group. To add a new model (ex. a robust or non-linear length model), add a function with the same inputs and outputs as fit_ols and add it here
+fit_functions = {
+    'ols': fit_ols
+}
+
+# Function for fitting a list of groups. Each group is a (group ID, start, stop) slice of the x and y arrays. The residuals are written to the resids array at the same positions, and the predictions and significance are returned for each group ID
+def fit_groups(fit_function, x, y, resids, groups):
+    results = []
+    for group_id, start, stop in groups:
+        resids[start:stop], predicted_at_350, significance = fit_function(x[start:stop], y[start:stop])
+        results.append((group_id, predicted_at_350, significance))
+    return results
+
+# Function for fitting one shard of groups in a worker process. The x, y, and resids arrays are stored in shared memory blocks (shared_names) created by the main process, so the records do not need to be copied to each worker
+def fit_shard(fit_method, shared_names, n, groups):
+    blocks = [shared_memory.SharedMemory(name=name) for name in shared_names]
+    try:
+        x, y, resids = [np.ndarray((n,), dtype='float64', buffer=block.buf) for block in blocks]
+        results = fit_groups(fit_functions[fit_method], x, y, resids, groups)
+        del x, y, resids # Release the views before closing the shared memory blocks
+    finally:
+        for block in blocks:
+            block.close()
+    return results
+
+# Function for splitting the groups into shards to be fit on separate worker processes. All of the groups of a station and year are kept in the same shard, and the station/years are assigned to the shard with the fewest records so far (largest first) so that each shard has about the same number of records
+def get_shards(groups, shard_keys, n_shards):
+    station_years = {}
+    for group, shard_key in zip(groups, shard_keys):
+        station_years.setdefault(shard_key, []).append(group)
+    shards = [[] for _ in range(n_shards)]
+    heap = [(0, i) for i in range(n_shards)]
+    for station_year in sorted(station_years.values(), key=lambda x: -sum(stop - start for _, start, stop in x)):
+        size, i = heapq.heappop(heap)
+        shards[i].extend(station_year)
+        heapq.heappush(heap, (size + sum(stop - start for _, start, stop in station_year), i))
+    return [sorted(shard) for shard in shards if shard]
+
+# Function for fitting the model for every group. Returns the residuals for each record (in the same order as the dataframe) and a dataframe of the predictions and significance for each group ID. With workers > 1, the groups are fit on a pool of worker processes. The output is the same either way
+def fit_models(df, fit_method='ols', workers=1):
+    # Sort the records by group ID so that each group is one slice of the x and y arrays
+    order = np.argsort(df['GroupID'].to_numpy(), kind='stable')
+    group_ids = df['GroupID'].to_numpy()[order]
+    starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]]) if len(order) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(order)].astype(int)
+    groups = [(int(group_ids[start]), int(start), int(stop)) for start, stop in zip(starts, stops)]
+    n = len(order)
+
+    if workers > 1 and len(groups) > 1:
+        # Station and year of each group, used to split the groups into shards
+        shard_keys = list(zip(df['StationCode'].to_numpy()[order][starts], df['SampleYear'].to_numpy()[order][starts]))
+        shards = get_shards(groups, shard_keys, workers * 4)
+
+        blocks = [shared_memory.SharedMemory(create=True, size=max(n, 1) * 8) for _ in range(3)]
+        try:
+            x, y, resids = [np.ndarray((n,), dtype='float64', buffer=block.buf) for block in blocks]
+            x[:] = df['TLAvgLength(mm)'].to_numpy(dtype='float64')[order]
+            y[:] = df['ResultAdjusted'].to_numpy(dtype='float64')[order]
+            shared_names = [block.name for block in blocks]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                shard_results = list(executor.map(fit_shard, [fit_method] * len(shards), [shared_names] * len(shards), [n] * len(shards), shards))
+            results = [result for shard_result in shard_results for result in shard_result]
+            resids_sorted = resids.copy()
+            del x, y, resids # Release the views before closing the shared memory blocks
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    else:
+        x = df['TLAvgLength(mm)'].to_numpy(dtype='float64')[order]
+        y = df['ResultAdjusted'].to_numpy(dtype='float64')[order]
+        resids_sorted = np.empty(n)
+        results = fit_groups(fit_functions[fit_method], x, y, resids_sorted, groups)
+
+    # Put the residuals back in the dataframe order
+    resids = np.empty(n)
+    resids[order] = resids_sorted
+
+    # Sort the predictions by group ID so that the output does not depend on which worker finished first
+    predictions = pd.DataFrame(results, columns=['GroupID', 'PredictedAt350', 'Significance']).set_index('GroupID').sort_index()
+    return resids, predictions
+
+
+def get_individual_averages(input_df, fit_method='ols', workers=1):
     # ----- 1) Import data and initial prep
     df = input_df.copy()
     df = df[df['TLAvgLength(mm)'].notna()] # Need to ensure that there are no NA values in the length column or the statsmodels package will throw some errors
 
-    # Create new dataframe for calculating residuals, group by specified columns
+    # Assign an integer ID to each group of the grouping columns. The intermediate results are joined back to the dataframe on this ID instead of on all of the grouping columns
     # 12/19/23 MT - Added dropna=False
-    grouped = df.groupby([
-        'StationCode', 
-        'StationName', 
-        'LocationCodeBOG', 
-        'CommonName', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ], dropna=False)
+    # observed=True is needed because some of the grouping columns are categorical. Without it, the groupby returns every combination of the categories (including empty groups that cannot be fit)
+    df['GroupID'] = df.groupby(group_cols, dropna=False, observed=True).ngroup()
 
 
     # ----- 2) Get residuals (within a station, location, species group for the linear model)
-    # Define a function to calculate residuals using linear regression
-    def calculate_resids(group):
-        X = group['TLAvgLength(mm)']
-        y = group['ResultAdjusted']
-        X1 = sm.add_constant(X)  # Add a constant term for the intercept
-        model = sm.OLS(y, X1).fit()
-        group['Residuals'] = model.resid # 12/19/23 Renamed 'resids' to 'Residuals' (this doesn't really matter much, just saves an extra step)
-        return group
-    
-    # Apply the function to each group within the grouped DataFrame
-    res = grouped.apply(calculate_resids).reset_index(drop=True) 
-
-    # Select the needed columns
-    # 12/19/23 MT - Added 'TissueResultRowID'. This column will be used for the merge function below
-    res = res[[
-        'StationCode', 
-        'StationName', 
-        'CommonName', 
-        'LocationCodeBOG',
-        'TissueResultRowID', 
-        'Residuals', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ]]
+    # ----- 3) Get predictions and significance of regression to calculate length adjusted results
+    # Get predictions at 350mm and significance of regression for Station, Location, Species grouping.  Calculate the p-value of f-statistic
+    # The model is fit once per group (see fit_models above). Set workers to fit the groups on multiple processes
+    resids, predictions = fit_models(df, fit_method=fit_method, workers=workers)
 
     # Add residuals to original dataframe in a new column called "Residuals"
-    # 12/19/23 MT - This way of adding the residuals back to the original df does not work as expected because both dataframes have different sizes. This results in a lot of empty values because only the first # rows get populated. Use the merge/join functiom below
-    #df['Residuals'] = res['resids']
-
-    # 12/19/23 MT - Add TissueResultRowID as one of the join columns. Without this column, this merge operation will join all grouping rows to each matching row in the original DF, resulting in a lot of duplicate rows.
-    df = pd.merge(df, res, on=[
-        'StationCode', 
-        'StationName', 
-        'CommonName', 
-        'LocationCodeBOG', 
-        'TissueResultRowID', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ], how = "left")  
-
-    # 12/19/23 MT - Convert object type to float
-    df['Residuals'] = df['Residuals'].astype('float') 
-
-
-    # ----- 3) Get predictions and significance of regression to calculate length adjusted results
-    # Get predictions at 350mm and significance of regression for Station, Location, Species grouping.  Calculate the p-value of f-statistic (run on the groupby function)
-
-    def calculate_predictions(group):
-        model = sm.OLS(group['ResultAdjusted'], sm.add_constant(group['TLAvgLength(mm)'])).fit()
-        predicted_at_350 = model.predict([1, 350])[0]  # Extract the first element of the predicted array
-        significance = model.f_pvalue
-        return pd.Series({'PredictedAt350': predicted_at_350, 'Significance': significance})
-
-    # 12/19/23 - Added dropna=False
-    predictions = df.groupby([
-        'StationCode', 
-        'StationName', 
-        'LocationCodeBOG', 
-        'CommonName', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ], dropna=False).apply(calculate_predictions).reset_index() 
+    # 12/19/23 MT - The residuals were previously merged back on the grouping columns and TissueResultRowID. They are now aligned on the dataframe order
+    df['Residuals'] = resids
 
     # 12/19/23 - Significance is object type for some reason, convert to float
     predictions['Significance'] = predictions['Significance'].astype('float') 
 
-    # Merge predictions back to the main dataframe
-    df = pd.merge(df, predictions, on=[
-        'StationCode', 
-        'StationName', 
-        'LocationCodeBOG', 
-        'CommonName', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ], how = "left")
+    # Join predictions back to the main dataframe on the group ID
+    df = df.join(predictions, on='GroupID')
 
     # Sum the residuals and predicted concentrations to get a length adjusted result
     df['LengthAdjustedResult'] = df['Residuals'] + df['PredictedAt350']
 
 
     # ----- 4) Create a new dataframe with averages of the Length Adjusted Results for each station
-    # 12/19/23 - Added dropna=False 
-    laa = df.groupby([
-        'StationCode', 
-        'StationName', 
-        'CommonName', 
-        'LocationCodeBOG', 
-        'Significance', 
-        'DWC_AnalyteWFraction', 
-        'Unit', 
-        'SampleYear', 
-        'FinalID', 
-        'ProgramName', 
-        'TargetLatitude', 
-        'TargetLongitude', 
-        'Datum', 
-        'ParentProjectName', 
-        'ProjectName', 
-        'ProjectCode', 
-        'TissueName', 
-        'TissuePrep'
-    ], dropna=False) 
+    # Results of the individuals that are at least 305mm long. The other results are set to NaN so that the grouped count, mean, and std functions below skip them
+    df['ResultAbove305mm'] = df['ResultAdjusted'].where(df['TLAvgLength(mm)'] >= 305)
+
+    # Significance has one value per group, so grouping by the group ID gives the same groups as grouping by all of the laa columns
+    laa = df.groupby('GroupID') 
 
     # Add additional calculated fields
     laa = pd.DataFrame({
         'LengthAdjustedAverage': laa['LengthAdjustedResult'].mean(),
-        'seLengthAdjusted': laa.apply(lambda x: (x['LengthAdjustedResult'].std() / (x['LengthAdjustedResult'].count() ** 0.5))),
+        'seLengthAdjusted': laa['LengthAdjustedResult'].std() / (laa['LengthAdjustedResult'].count() ** 0.5),
         'SampleDateMax': laa['SampleDate'].max(),
         'N': laa['ResultAdjusted'].count(),
-        'N_Above305mm': laa.apply(lambda x: x[x['TLAvgLength(mm)'] >= 305]['ResultAdjusted'].count()),
+        'N_Above305mm': laa['ResultAbove305mm'].count(),
         'N_NonDetects': laa['NonDetectCount'].sum(),
         'SimpleMean': laa['ResultAdjusted'].mean(),
-        'SimpleMean_Above305mm': laa.apply(lambda x: x[x['TLAvgLength(mm)'] >= 305]['ResultAdjusted'].mean()),
+        'SimpleMean_Above305mm': laa['ResultAbove305mm'].mean(),
         'TwoXse': 2 * ((laa['ResultAdjusted'].std()) / (laa['ResultAdjusted'].count() ** 0.5)),
-        'TwoXse_Above305mm': laa.apply(lambda x: 2 * (x[x['TLAvgLength(mm)'] >= 305]['ResultAdjusted'].std() / (x[x['TLAvgLength(mm)'] >= 305]['ResultAdjusted'].count() ** 0.5))),
+        'TwoXse_Above305mm': 2 * (laa['ResultAbove305mm'].std() / (laa['ResultAbove305mm'].count() ** 0.5)),
         'TLAvgLength(mm)': laa['TLAvgLength(mm)'].mean()
     })
 
-    laa = laa.reset_index() # Ungroup
+    # Reattach the descriptive columns (one row per group) and sort the groups the same way groupby would sort the laa columns
+    group_keys = df.drop_duplicates('GroupID').set_index('GroupID')[laa_cols]
+    laa = group_keys.join(laa)
+    laa = laa.sort_values(laa_cols, na_position='last').reset_index(drop=True)
 
 
     # ----- 5) Filter rows based on conditions
@@ -211,14 +214,21 @@ def get_individual_averages(input_df):
     BassLAASpecies = ["Largemouth Bass", "Smallmouth Bass", "Spotted Bass"]
     LAA_Analytes = ['Mercury, Total']
 
+    # Length-adjusted averages are used for bass species and mercury when the regression is significant and there are at least 7 individuals. NaN significance values fail the <= comparison
+    is_laa_analyte = laa['CommonName'].isin(BassLAASpecies) & laa['DWC_AnalyteWFraction'].isin(LAA_Analytes)
+    use_length_adjusted = is_laa_analyte & (laa['Significance'] <= 0.05) & (laa['N'] >= 7)
+    # Otherwise, the average of individuals >=305mm is used for bass species and mercury when there is at least one individual >=305mm
+    use_above_305mm = is_laa_analyte & (laa['N_Above305mm'] > 0)
+    conditions = [use_length_adjusted, use_above_305mm]
+
     # Conditionally populate ResultType in the output based on various criteria
-    laa['ResultType'] = laa.apply(lambda row: 'Average of 350 mm Length-Adjusted' if row['Significance'] <= 0.05 and not pd.isna(row['Significance']) and row['N'] >= 7 and row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes else ('Average of Individuals >=305 mm' if row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes and row['DWC_AnalyteWFraction'] in LAA_Analytes and row['N_Above305mm'] > 0 else 'Average of Individuals'), axis=1) 
+    laa['ResultType'] = np.select(conditions, ['Average of 350 mm Length-Adjusted', 'Average of Individuals >=305 mm'], default='Average of Individuals')
 
     # Conditionally populate Result in the output based on various criteria
-    laa['Result'] = laa.apply(lambda row: row['LengthAdjustedAverage'] if row['Significance'] <= 0.05 and not pd.isna(row['Significance']) and row['N'] >= 7 and row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes else (row['SimpleMean_Above305mm'] if row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes and row['N_Above305mm'] > 0 else row['SimpleMean']), axis=1)
+    laa['Result'] = np.select(conditions, [laa['LengthAdjustedAverage'], laa['SimpleMean_Above305mm']], default=laa['SimpleMean'])
 
     # Conditionally populate 'N in Avg' in the output based on various criteria
-    laa['N in Avg'] = laa.apply(lambda row: row['N'] if row['Significance'] <= 0.05 and not pd.isna(row['Significance']) and row['N'] >= 7 and row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes else (row['N_Above305mm'] if row['CommonName'] in BassLAASpecies and row['DWC_AnalyteWFraction'] in LAA_Analytes and row['N_Above305mm'] > 0 else row['N']), axis=1)
+    laa['N in Avg'] = np.select(conditions, [laa['N'], laa['N_Above305mm']], default=laa['N'])
 
 
     # ----- 6) Set up a dataframe that will serve as the ouput, to be combined with the composite averages (NumberInComposite now really indicates number in avg)
@@ -14,8 +14,12 @@ import os
 import sys
 
 sys.path.insert(0, '../utils/')
+import p_archive # p_archive.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_query # p_query.py
 import p_utils # p_utils.py
+import p_utils_dq # p_utils_dq.py
 
 
 if __name__ == '__main__':
@@ -24,32 +28,46 @@ if __name__ == '__main__':
 
     #####  Download data from
     print('--- Downloading data from %s' % p_constants.datamart_tables['toxicity'])
-    sql_tox = "SELECT * FROM " + p_constants.datamart_tables['toxicity'] + " WHERE (Program = 'Surface Water Ambient Monitoring Program' AND Mean IS NOT NULL AND CollectionReplicate = 1 AND LabReplicate = 1)"
-    tox_df = p_utils.download_data(sql_tox, p_constants.tox_date_cols)
+    with p_metrics.stage('download') as m:
+        sql_tox, params_tox = p_query.get_download_query('toxicity', 'toxicity') # See p_constants.download_filters and p_constants.download_pushdown_rules
+        tox_df = p_utils.download_data(sql_tox, p_constants.tox_date_cols, data_type='toxicity', params=params_tox)
+        m['rows_out'] = len(tox_df)
 
     # Join datum field from the stations dataset
-    station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) # Import station data with select fields
-    tox_data = p_utils.join_datum(tox_df, station_df)
+    with p_metrics.stage('join_datum', rows_in=len(tox_df)) as m:
+        station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum']) # Import station data with select fields
+        tox_data = p_utils.join_datum(tox_df, station_df)
+        m['rows_out'] = len(tox_data)
 
     #####  Write two sets of data, one set without the data quality columns and one set with the columns
     #####  1. Without the data quality fields
 
     # Support files folder
-    outdir = '../../support_files/'
-    p_utils.write_csv(tox_data, 'ceden_swamp_tox', outdir)
+    with p_metrics.stage('write', rows_in=len(tox_data)):
+        outdir = '../../support_files/'
+        p_utils.write_csv(tox_data, 'ceden_swamp_tox', outdir)
 
-    # Write data file in the CEDEN archive folder
-    outdir_archive = '../../ceden_files/'
-    p_utils.write_csv(tox_data, 'ceden_swamp_tox' + '_' + p_constants.today, outdir_archive + '/' + p_constants.today)
+    # Save a snapshot of the data in the CEDEN archive. Only the blocks of rows that changed since a previous run are saved (see p_archive.py)
+    with p_metrics.stage('archive', rows_in=len(tox_data)):
+        p_archive.archive_snapshot(tox_data, 'ceden_swamp_tox')
 
     #####  2. With the data quality fields
 
-    # Add DataQuality and DataQualityIndicator columns with placeholder values. Must include these columns for the dashboard. The data quality assessor does not work on tox data. Update it in the future?
-    tox_data['DataQuality'] = 'Not assessed'
-    tox_data['DataQualityIndicator'] = None
+    # Add the DataQuality and DataQualityIndicator fields. The toxicity QA codes are in ToxResultQACode and the lab replicate number in LabReplicate (see p_constants.dq_column_maps)
+    print('--- Adding data quality fields')
+    with p_metrics.stage('data_quality', rows_in=len(tox_data)) as m:
+        tox_data = p_utils_dq.add_data_quality(tox_data, 'toxicity')
+        m['rows_out'] = len(tox_data)
+
+    # List the codes that are not in the data quality rules (see p_constants.dq_diagnostics_file)
+    p_utils_dq.report_dq_diagnostics('toxicity')
 
     # Write data file in the support files folder
-    outdir = '../../support_files/'
-    p_utils.write_csv(tox_data, 'swamp_tox_data_quality', outdir)
+    with p_metrics.stage('write_data_quality', rows_in=len(tox_data)):
+        outdir = '../../support_files/'
+        p_utils.write_csv(tox_data, 'swamp_tox_data_quality', outdir)
+
+        # Write the station index (most recent sample date and record counts for each station). Used by the sites step
+        p_utils.write_csv(p_utils.get_station_index(tox_data), 'swamp_tox_station_index', outdir)
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
@@ -13,6 +13,7 @@ import sys
 
 sys.path.insert(0, '../utils/')
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 
 
@@ -22,10 +23,15 @@ if __name__ == '__main__':
 
     print('--- Importing data')
     #####  Import data from previous script
-    tox_df = p_utils.import_csv('../../support_files/swamp_tox_data_quality.csv', date_cols=p_constants.tox_date_cols)
+    m = p_metrics.start_stage('import')
+    p_utils.check_file_columns('../../support_files/swamp_tox_data_quality.csv', 'tox_process') # Stop here if a column used below is missing (see p_constants.column_manifests)
+    tox_df = p_utils.import_csv('../../support_files/swamp_tox_data_quality.csv', date_cols=p_constants.tox_date_cols, data_type='toxicity')
+    m['rows_out'] = len(tox_df)
+    p_metrics.end_stage(m)
 
     
     ##### Remove unneeded records or records with missing data elements
+    m = p_metrics.start_stage('filter', rows_in=len(tox_df))
     # Drop records with StationCode = 'FIELDQA_SWAMP'
     tox_df = tox_df.drop(tox_df[tox_df['StationCode'] == 'FIELDQA_SWAMP'].index)
 
@@ -47,19 +53,16 @@ if __name__ == '__main__':
     # Drop replicate records
     tox_df = tox_df.drop(tox_df[(tox_df['CollectionReplicate'] != 1)].index)
     tox_df = tox_df.drop(tox_df[(tox_df['LabReplicate'] != 1)].index)
+    m['rows_out'] = len(tox_df)
+    p_metrics.end_stage(m)
 
 
     #####  Process data
     print('--- Processing data')
 
-    # Strip special characters
-    tox_df.replace(r'\t',' ', regex=True, inplace=True) # tab
-    tox_df.replace(r'\r',' ', regex=True, inplace=True) # carriage return
-    tox_df.replace(r'\n',' ', regex=True, inplace=True) # newline
-    tox_df.replace(r'\f',' ', regex=True, inplace=True) # formfeed
-    tox_df.replace(r'\v',' ', regex=True, inplace=True) # vertical tab
-    tox_df.replace(r'\|', ' ', regex=True, inplace=True) # pipe
-    tox_df.replace(r'\"', ' ', regex=True, inplace=True) # quotes
+    m = p_metrics.start_stage('enrich', rows_in=len(tox_df))
+    # Strip special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, quotes). Works on both text and categorical columns
+    tox_df = p_utils.strip_special_characters(tox_df)
 
     # Strip whitespace from StationName
     tox_df['StationName'] = tox_df['StationName'].apply(lambda x: x.strip())
@@ -83,14 +86,15 @@ if __name__ == '__main__':
     tox_df.drop_duplicates(subset=use_cols, inplace=True)
 
     # Add analyte fields
-    tox_df['Analyte'] = tox_df['Analyte'].replace('\'', '', regex=True) # Strip single quote from analyte name
-    tox_df['AnalyteDisplay'] = tox_df['Analyte'] + ' (' + tox_df['OrganismName'] + ')' # Create new AnalyteDisplay field, copy values from Analyte column, and add the organism name in parentheses
+    tox_df['Analyte'] = p_utils.replace_pattern(tox_df['Analyte'], '\'', '') # Strip single quote from analyte name
+    tox_df['AnalyteDisplay'] = tox_df['Analyte'].astype(object) + ' (' + tox_df['OrganismName'].astype(object) + ')' # Create new AnalyteDisplay field, copy values from Analyte column, and add the organism name in parentheses
     #tox_df['AnalyteDisplay'] = tox_df['AnalyteDisplay'].replace('\'', '', regex=True) # Strip single quote
     #tox_df['AnalyteDisplay'] = tox_df['AnalyteDisplay'].replace(',', '', regex=True) # Strip comma
 
     # Add analyte category fields
-    analytes_df = p_utils.import_csv('../../assets/joined_analyte_list_3-21-23.csv') # Import reference table
+    analytes_df = p_utils.import_stage_columns('../../assets/joined_analyte_list_3-21-23.csv', 'analytes_lookup') # Import reference table (only the columns used by the join)
     analyte_cols = analytes_df[['CedenAnalyteName', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3']]
+    analyte_cols = p_utils.match_categories(analyte_cols, 'CedenAnalyteName', tox_df['Analyte'].dtype) # Match the categorical Analyte column for a faster join
     tox_df = pd.merge(tox_df, analyte_cols, how='left', left_on='Analyte', right_on='CedenAnalyteName') # Join AnalyteGroup fields to data frame 
     tox_df.drop(['CedenAnalyteName'], axis=1, inplace=True) # Drop unneeded fields
 
@@ -99,11 +103,12 @@ if __name__ == '__main__':
     tox_df['MatrixDisplay'] = tox_df['MatrixDisplay'].apply(lambda x: p_utils.get_matrix_name(x)) # Standardize the matrix values. App uses the MatrixDisplay field to show the matrix tags
 
     # Add region field
-    stations_df = p_utils.import_csv('../../support_files/swamp_stations.csv', date_cols=['LastSampleDate'])
+    stations_df = p_utils.import_stage_columns('../../support_files/swamp_stations.csv', 'stations_lookup')
     station_cols = stations_df[['StationCode', 'Region']] 
+    station_cols = p_utils.match_categories(station_cols, 'StationCode', tox_df['StationCode'].dtype) # Keep StationCode categorical after the join
     tox_df = pd.merge(tox_df, station_cols, how='left', on='StationCode') # Join region field
     # After joining, some records will have a blank region value. Use the first character of StationCode (usually a number in reference to the region) or leave blank
-    tox_df['Region'] = tox_df.apply(
+    tox_df['Region'] = tox_df[['StationCode', 'Region']].apply(
         lambda row: row['StationCode'][0] if np.isnan(row['Region']) else row['Region'],
         axis=1
     )
@@ -125,13 +130,15 @@ if __name__ == '__main__':
     tox_df.loc[tox_df['ParentProject'].isin(p_constants.spot_parent_projects), 'Spot'] = True
 
     # Add Reference Site column
-    ref_sites_df = p_utils.import_csv(p_constants.reference_sites_file)
+    ref_sites_df = p_utils.import_stage_columns(p_constants.reference_sites_file, 'reference_sites_lookup')
     ref_cols = ref_sites_df[['cedenid', 'StationCategory']] 
     tox_df = pd.merge(tox_df, ref_cols, how='left', left_on=tox_df['StationCode'].str.lower(), right_on=ref_cols['cedenid'].str.lower())
     tox_df = tox_df.drop(['key_0', 'cedenid'], axis=1)
 
     # Add display text for 15 degree samples; language provided by Bryn
     tox_df.loc[(tox_df['Treatment'] == 'Temperature') & (tox_df['UnitTreatment'] == 'Deg C') & (tox_df['TreatmentConcentration'] == 15), 'DisplayText'] = 'Test conducted at a non-standard temperature of 15 degrees C.'
+    m['rows_out'] = len(tox_df)
+    p_metrics.end_stage(m)
 
 
     #####  Write data
@@ -139,6 +146,8 @@ if __name__ == '__main__':
     tox_file_name = 'swamp_toxicity_data'
 
     # Write file in dated folder in export folder
+    m = p_metrics.start_stage('write', rows_in=len(tox_df))
     p_utils.write_csv(tox_df, tox_file_name + '_' + p_constants.today, '../../export' + '/' + p_constants.today) 
+    p_metrics.end_stage(m)
 
     print('%s finished running' % os.path.basename(__file__))
@@ -11,6 +11,7 @@ import sys
 sys.path.insert(0, '../utils/') 
 import chunked_upload as cu # chunked_upload.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 # import ckanapi
 
@@ -30,7 +31,8 @@ if __name__ == '__main__':
     file_path = directory + '/' + matched_file[0]
 
     # Upload file
-    cu.upload_chunked_data(p_constants.portal_resource_ids['toxicity'], file_path, (1024 * 1024 * 64)) # 64MB chunk 
+    with p_metrics.stage('upload'):
+        cu.upload_chunked_data(p_constants.portal_resource_ids['toxicity'], file_path, (1024 * 1024 * 64)) # 64MB chunk 
 
     # 10/9/23 - Chunked upload was not working, so I used the ckanapi code below. Chunked upload is working now, but keep the code below for reference
     #ckan = ckanapi.RemoteCKAN(p_constants.HOST, apikey=p_constants.KEY)
@@ -0,0 +1,514 @@
+'''
+Functions for the CEDEN archive: the raw data pulled from the CEDEN data marts on each run (ceden_stations, ceden_swamp_wq, ceden_swamp_tissue, ceden_swamp_tox, ceden_swamp_phab), saved as compressed snapshots instead of full dated CSV copies
+
+Each snapshot is split into blocks of rows by a hash of the StationCode (so the records of a station are always in the same block). Each block is saved as a zstd-compressed parquet file named by a hash of its contents, so a block that has not changed since a previous run is not saved again. Most of the CEDEN records do not change from day to day, so a new snapshot usually only adds the blocks of the stations with new or changed records
+
+Archive folder layout (p_constants.archive_dir):
+--- blocks/<first 2 characters of hash>/<hash>.parquet: the blocks of rows
+--- manifests/<dataset>/<date>.json: list of the blocks in each snapshot, with the column names, data types, and the minimum/maximum values of some of the columns of each block (see p_constants.archive_stats_cols)
+--- manifests/<dataset>/<date>.order.parquet: the original position of each row, used to put the rows back in the order they were pulled
+
+The blocks that are no longer used by any snapshot (after the retention policy deletes old snapshots) are deleted by running: python p_archive.py compact. Blocks and temporary files modified in the last SWAMP_ARCHIVE_GRACE_HOURS hours are kept, because a download script may be saving them
+
+To get the CSV file of a snapshot (ex. the water quality data pulled on 2024-03-14), run: python p_archive.py materialize ceden_swamp_wq --date 2024-03-14
+
+The archive can also be queried without getting the full snapshot. Only the blocks that can contain matching rows are read (using the StationCode bucket and the block statistics), and blocks that are the same in both snapshots are skipped when comparing two dates:
+--- Rows of a station and analyte as of a date: python p_archive.py query ceden_swamp_wq --date 2024-03-14 --where StationCode=514FC1278 --where "Analyte=Oxygen, Dissolved, Total"
+--- Rows that changed between two dates: python p_archive.py diff ceden_swamp_wq 2024-03-01 2024-03-14 --where StationCode=514FC1278 --key StationCode SampleDate Analyte SampleTypeCode CollectionReplicate ResultsReplicate
+'''
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import glob
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import p_constants # p_constants.py
+import p_utils # p_utils.py
+
+
+# Version of the archive format. Saved in each manifest
+archive_version = 1
+
+# Target number of rows in each block, and the maximum number of blocks in a snapshot. The number of blocks is a power of 2, so it only changes when the size of a dataset doubles (or halves). When it changes, the blocks of the new snapshot will not match the blocks of older snapshots (the older snapshots can still be read)
+block_rows = 20000
+max_buckets = 256
+
+# Column used to split the rows of a snapshot into blocks. Datasets without this column are split by a hash of the whole row
+partition_col = 'StationCode'
+
+
+# Function for getting the path of a block file
+def get_block_path(block_hash, archive_dir):
+    return os.path.join(archive_dir, 'blocks', block_hash[:2], block_hash + '.parquet')
+
+# Function for getting the path of the manifest of a snapshot. Use ext='order.parquet' for the file with the original row order
+def get_manifest_path(dataset, date, archive_dir, ext='json'):
+    return os.path.join(archive_dir, 'manifests', dataset, '%s.%s' % (date, ext))
+
+# Function for converting the text columns of a dataframe before it is saved. Categorical columns are saved as text (the categories are restored when the snapshot is read), and any non-text values in text columns (ex. numbers in a column that is mostly text) are converted to text so that each column has a single type in the parquet file. The CSV text of the values is not changed
+def normalize_columns(df):
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or (df[col].dtype == object):
+            values = df[col].astype(object)
+            df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+# Function for getting the number of blocks for a number of rows
+def get_n_buckets(n_rows):
+    n_buckets = 1
+    while (n_buckets < max_buckets) and (n_buckets * block_rows < n_rows):
+        n_buckets *= 2
+    return n_buckets
+
+# Function for getting the bucket of a partition column value
+def get_bucket(value, n_buckets):
+    return int(hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:8], 16) % n_buckets
+
+# Function for finding the bucket (block number) of each row. The bucket only depends on the value of the partition column, so the rows of a station are always saved in the same bucket
+def get_buckets(df, n_buckets):
+    if partition_col not in df.columns:
+        return (pd.util.hash_pandas_object(df, index=False).to_numpy() % n_buckets).astype('int64')
+    codes, uniques = pd.factorize(df[partition_col])
+    # Hash each unique value once. hashlib is used instead of hash() because hash() of a string changes from one Python session to the next
+    unique_buckets = np.array([get_bucket(value, n_buckets) for value in uniques], dtype='int64')
+    return np.where(codes == -1, 0, unique_buckets[codes])
+
+# Function for getting the hash of a block. Uses the column names, data types, and the (sorted) hashes of the rows, so a block with the same rows has the same hash no matter what order the rows were pulled in
+def get_block_hash(block_df, row_hashes):
+    h = hashlib.sha256()
+    h.update(json.dumps([list(map(str, block_df.columns)), [str(dtype) for dtype in block_df.dtypes]]).encode('utf-8'))
+    h.update(np.sort(row_hashes).tobytes())
+    return h.hexdigest()
+
+# Function for converting a value to a type that can be saved in the manifest (JSON)
+def get_stat_value(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+# Function for getting the minimum and maximum values of the statistics columns of a block. Used to skip blocks that cannot match a query without reading them
+def get_block_stats(block_df):
+    stats = {}
+    for col in p_constants.archive_stats_cols:
+        if col not in block_df.columns:
+            continue
+        values = block_df[col].dropna()
+        if len(values) == 0:
+            stats[col] = [None, None]
+            continue
+        try:
+            stats[col] = [get_stat_value(values.min()), get_stat_value(values.max())]
+        except TypeError:
+            # Mixed types that cannot be compared
+            continue
+    return stats
+
+# Function for saving a block file, if a block with the same hash is not already saved. The block is written to a temporary file first, so a block file is never left half-written. Returns True if the block was saved
+# If the block is already saved, only its modified time is updated (os.utime raises FileNotFoundError if it is not saved). compact_archive does not delete recently modified blocks, so a block that is not used by any snapshot yet (ex. a block of a deleted snapshot that the new snapshot uses again) is not deleted before the manifest of the new snapshot is written
+def write_block(block_df, block_hash, archive_dir):
+    block_path = get_block_path(block_hash, archive_dir)
+    try:
+        os.utime(block_path)
+        return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(block_path), exist_ok=True)
+    temp_path = p_utils.get_temp_path(block_path)
+    try:
+        pq.write_table(pa.Table.from_pandas(block_df, preserve_index=False), temp_path, compression='zstd')
+        os.replace(temp_path, block_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+# Function for writing a JSON or parquet file of a manifest through a temporary file
+def write_manifest_file(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = p_utils.get_temp_path(path)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Function for adding a snapshot of a dataset (ex. 'ceden_swamp_wq') to the archive. Only the blocks that are not already in the archive are saved. If there is already a snapshot for the date, it is replaced. Returns the manifest of the snapshot
+def add_snapshot(df, dataset, date=p_constants.today, archive_dir=p_constants.archive_dir):
+    # Data types before the text columns are converted, used to restore the categorical columns when the snapshot is read
+    dtypes = {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+    df = normalize_columns(df.reset_index(drop=True))
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    n_buckets = get_n_buckets(len(df))
+    buckets = get_buckets(df, n_buckets)
+
+    # Sort the rows by bucket, then by row hash. order[i] is the original position of row i of the archive
+    order = np.lexsort((row_hashes, buckets))
+    bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+    block_positions = np.split(order, bounds) if len(order) > 0 else []
+
+    def save_block(positions):
+        block_df = df.iloc[positions].reset_index(drop=True)
+        block_hash = get_block_hash(block_df, row_hashes[positions])
+        is_new = write_block(block_df, block_hash, archive_dir)
+        return {'hash': block_hash, 'bucket': int(buckets[positions[0]]), 'rows': len(positions), 'stats': get_block_stats(block_df)}, is_new
+
+    with ThreadPoolExecutor(max_workers=p_constants.workers if p_constants.workers > 1 else None) as executor:
+        results = list(executor.map(save_block, block_positions))
+
+    manifest = {
+        'version': archive_version,
+        'dataset': dataset,
+        'date': date,
+        'rows': len(df),
+        'columns': list(map(str, df.columns)),
+        'dtypes': dtypes,
+        'partition_col': partition_col if partition_col in df.columns else None,
+        'n_buckets': n_buckets,
+        'blocks': [block for block, is_new in results]
+    }
+    def write_manifest_json(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    write_manifest_file(get_manifest_path(dataset, date, archive_dir, 'order.parquet'), lambda path: pq.write_table(pa.table({'Position': order.astype('int64')}), path, compression='zstd'))
+    # The manifest is written last, so a snapshot is only listed once all of its files are saved
+    write_manifest_file(get_manifest_path(dataset, date, archive_dir), write_manifest_json)
+    manifest['new_blocks'] = sum(is_new for block, is_new in results)
+    return manifest
+
+# Function for listing the dates of the snapshots of a dataset, oldest first
+def get_snapshot_dates(dataset, archive_dir=p_constants.archive_dir):
+    paths = glob.glob(os.path.join(archive_dir, 'manifests', dataset, '*.json'))
+    return sorted(os.path.basename(path)[:-len('.json')] for path in paths)
+
+# Function for listing the datasets in the archive
+def get_datasets(archive_dir=p_constants.archive_dir):
+    manifest_dir = os.path.join(archive_dir, 'manifests')
+    if not os.path.exists(manifest_dir):
+        return []
+    return sorted(name for name in os.listdir(manifest_dir) if os.path.isdir(os.path.join(manifest_dir, name)))
+
+# Function for importing the manifest of the snapshot of a dataset on a date. If there is no snapshot on that date, the most recent snapshot before that date is used. If no date is given, the most recent snapshot is used
+def import_manifest(dataset, date=None, archive_dir=p_constants.archive_dir):
+    dates = [d for d in get_snapshot_dates(dataset, archive_dir) if (date is None) or (d <= date)]
+    if len(dates) == 0:
+        raise ValueError('No snapshot of %s in %s on or before %s' % (dataset, archive_dir, date or 'today'))
+    with open(get_manifest_path(dataset, dates[-1], archive_dir)) as f:
+        return json.load(f)
+
+# Function for converting the columns of a dataframe read from the archive back to the data types of the snapshot (categorical columns, and empty columns)
+def restore_dtypes(df, manifest):
+    for col in df.columns:
+        dtype = manifest['dtypes'].get(col)
+        if dtype == 'category':
+            df[col] = df[col].astype('category')
+        elif (dtype is not None) and (str(df[col].dtype) != dtype) and (df[col].isna().all()):
+            df[col] = pd.Series(index=df.index, dtype=dtype)
+    return df
+
+# Function for reading blocks of a snapshot. Only the given columns are read (all columns if None). Returns a dataframe with the rows of the blocks, in archive order
+def read_blocks(manifest, blocks, columns=None, archive_dir=p_constants.archive_dir):
+    columns = columns or manifest['columns']
+    if len(blocks) == 0:
+        empty_df = pd.DataFrame({col: pd.Series(dtype='object' if manifest['dtypes'][col] == 'category' else manifest['dtypes'][col]) for col in columns})
+        return restore_dtypes(empty_df, manifest)
+    with ThreadPoolExecutor() as executor:
+        tables = list(executor.map(lambda block: pq.read_table(get_block_path(block['hash'], archive_dir), columns=columns), blocks))
+    df = pa.concat_tables(tables, promote_options='default').to_pandas()
+    return restore_dtypes(df, manifest)
+
+# Function for getting the full snapshot of a dataset on a date (or the most recent snapshot before that date), with the rows in the order they were pulled. Only the given columns are read (all columns if None)
+def materialize(dataset, date=None, columns=None, archive_dir=p_constants.archive_dir):
+    manifest = import_manifest(dataset, date, archive_dir)
+    df = read_blocks(manifest, manifest['blocks'], columns, archive_dir)
+    order = pq.read_table(get_manifest_path(dataset, manifest['date'], archive_dir, 'order.parquet')).column('Position').to_numpy()
+    # Row i of the archive came from position order[i] of the original data
+    positions = np.empty(len(order), dtype='int64')
+    positions[order] = np.arange(len(order))
+    return df.iloc[positions].reset_index(drop=True)
+
+# Function for converting the filter values to the data type of each column (ex. text dates to dates, text numbers to numbers), so that they can be compared to the values in the archive
+# Filters are a dict of {column: condition}. The condition can be a single value, a list of values, or a (minimum, maximum) tuple (either can be None)
+def convert_filters(filters, manifest):
+    converted = {}
+    for col, condition in (filters or {}).items():
+        if col not in manifest['dtypes']:
+            raise ValueError('%s is not a column of %s' % (col, manifest['dataset']))
+        dtype = manifest['dtypes'][col]
+        if dtype.startswith('datetime64'):
+            convert = pd.Timestamp
+        elif (dtype.startswith('int')) or (dtype.startswith('float')):
+            convert = float
+        else:
+            convert = str
+        if isinstance(condition, tuple):
+            converted[col] = tuple(None if value is None else convert(value) for value in condition)
+        else:
+            converted[col] = [convert(value) for value in (condition if isinstance(condition, list) else [condition])]
+    return converted
+
+# Function for checking if a block can contain rows that match the filters, using the bucket and the block statistics saved in the manifest. Blocks that cannot match are skipped without being read
+def block_matches(block, filters, manifest):
+    for col, condition in filters.items():
+        # The bucket of a block only depends on the partition column, so a block can only contain the partition column values of its bucket
+        if (col == manifest['partition_col']) and (isinstance(condition, list)):
+            if block['bucket'] not in {get_bucket(value, manifest['n_buckets']) for value in condition}:
+                return False
+        if col not in block['stats']:
+            continue
+        low, high = block['stats'][col]
+        if low is None:
+            # All of the values in the block are missing
+            return False
+        if manifest['dtypes'][col].startswith('datetime64'):
+            low, high = pd.Timestamp(low), pd.Timestamp(high)
+        try:
+            if isinstance(condition, tuple):
+                if ((condition[0] is not None) and (condition[0] > high)) or ((condition[1] is not None) and (condition[1] < low)):
+                    return False
+            elif not any(low <= value <= high for value in condition):
+                return False
+        except TypeError:
+            # Values that cannot be compared to the statistics (ex. text in a numeric column)
+            continue
+    return True
+
+# Function for keeping the rows of a dataframe that match the filters (see convert_filters)
+def filter_rows(df, filters):
+    mask = pd.Series(True, index=df.index)
+    for col, condition in filters.items():
+        if isinstance(condition, tuple):
+            if condition[0] is not None:
+                mask &= df[col] >= condition[0]
+            if condition[1] is not None:
+                mask &= df[col] <= condition[1]
+        else:
+            mask &= df[col].isin(condition)
+    return df[mask]
+
+# Function for getting the rows of a dataset that match the filters, as of a date (the snapshot on that date, or the most recent snapshot before that date). Only the blocks that can contain matching rows, and only the given columns (all columns if None), are read
+# Ex. query('ceden_swamp_wq', '2024-03-14', {'StationCode': '514FC1278', 'Analyte': ['Temperature', 'pH'], 'SampleDate': ('2020-01-01', None)})
+# The rows are returned in archive order (grouped by block), not in the order they were pulled
+def query(dataset, date=None, filters=None, columns=None, archive_dir=p_constants.archive_dir):
+    manifest = import_manifest(dataset, date, archive_dir)
+    filters = convert_filters(filters, manifest)
+    blocks = [block for block in manifest['blocks'] if block_matches(block, filters, manifest)]
+    read_cols = None if columns is None else list(dict.fromkeys(list(columns) + list(filters)))
+    df = filter_rows(read_blocks(manifest, blocks, read_cols, archive_dir), filters)
+    return df[columns or manifest['columns']].reset_index(drop=True)
+
+# Function for finding the rows that were added or removed between two snapshots of a dataset. Only the rows that match the filters are compared. Blocks that are the same in both snapshots are skipped without being read
+# If key columns are given (columns that identify a record, ex. ['StationCode', 'SampleDate', 'Analyte', 'SampleTypeCode', 'CollectionReplicate', 'ResultsReplicate']), a record that was removed and added back with different values is listed as changed, with the names of the columns that changed
+# Returns a dataframe of the rows with a Change column: Removed (only in the first snapshot), Added (only in the second snapshot), Changed (before) and Changed (after)
+def diff(dataset, date_1, date_2, filters=None, key_cols=None, archive_dir=p_constants.archive_dir):
+    manifest_1 = import_manifest(dataset, date_1, archive_dir)
+    manifest_2 = import_manifest(dataset, date_2, archive_dir)
+    filters_1 = convert_filters(filters, manifest_1)
+    filters_2 = convert_filters(filters, manifest_2)
+    blocks_1 = [block for block in manifest_1['blocks'] if block_matches(block, filters_1, manifest_1)]
+    blocks_2 = [block for block in manifest_2['blocks'] if block_matches(block, filters_2, manifest_2)]
+    if manifest_1['n_buckets'] == manifest_2['n_buckets']:
+        unchanged = {block['hash'] for block in blocks_1} & {block['hash'] for block in blocks_2}
+        blocks_1 = [block for block in blocks_1 if block['hash'] not in unchanged]
+        blocks_2 = [block for block in blocks_2 if block['hash'] not in unchanged]
+
+    # Compare the columns that are in both snapshots
+    columns = [col for col in manifest_2['columns'] if col in manifest_1['columns']]
+    missing_cols = [col for col in (key_cols or []) if col not in columns]
+    if len(missing_cols) > 0:
+        raise ValueError('Key columns not in both snapshots of %s: %s' % (dataset, ', '.join(missing_cols)))
+    df_1 = filter_rows(read_blocks(manifest_1, blocks_1, columns, archive_dir), filters_1).reset_index(drop=True)
+    df_2 = filter_rows(read_blocks(manifest_2, blocks_2, columns, archive_dir), filters_2).reset_index(drop=True)
+
+    # Match identical rows. Each row is numbered within its group of identical rows, so duplicate rows are matched one to one
+    def get_row_ids(df):
+        row_hashes = pd.util.hash_pandas_object(normalize_columns(df), index=False)
+        return pd.MultiIndex.from_arrays([row_hashes.to_numpy(), row_hashes.groupby(row_hashes).cumcount().to_numpy()])
+    row_ids_1 = get_row_ids(df_1)
+    row_ids_2 = get_row_ids(df_2)
+    removed = df_1[~row_ids_1.isin(row_ids_2)]
+    added = df_2[~row_ids_2.isin(row_ids_1)]
+
+    removed = removed.assign(Change='Removed')
+    added = added.assign(Change='Added')
+    if key_cols:
+        get_keys = lambda df: pd.MultiIndex.from_frame(normalize_columns(df[key_cols]))
+        removed_keys = get_keys(removed)
+        added_keys = get_keys(added)
+        removed.loc[removed_keys.isin(added_keys), 'Change'] = 'Changed (before)'
+        added.loc[added_keys.isin(removed_keys), 'Change'] = 'Changed (after)'
+
+        # List the columns that changed, for the records that have one row in each snapshot
+        before = removed[(removed['Change'] == 'Changed (before)') & ~removed_keys.duplicated(keep=False)]
+        after = added[(added['Change'] == 'Changed (after)') & ~added_keys.duplicated(keep=False)]
+        before = normalize_columns(before).set_index(get_keys(before))
+        after = normalize_columns(after).set_index(get_keys(after))
+        common_keys = before.index.intersection(after.index)
+        before, after = before.loc[common_keys], after.loc[common_keys]
+        differs = pd.DataFrame({col: (before[col] != after[col]) & ~(before[col].isna() & after[col].isna()) for col in columns if col not in key_cols}, index=common_keys)
+        changed_cols = differs.apply(lambda row: ', '.join(row.index[row]), axis=1) if len(differs) > 0 else pd.Series(dtype=object, index=common_keys)
+        removed['ChangedColumns'] = changed_cols.reindex(removed_keys).to_numpy()
+        added['ChangedColumns'] = changed_cols.reindex(added_keys).to_numpy()
+
+    changes_df = pd.concat([removed, added], ignore_index=True)
+    changes_df['Change'] = pd.Categorical(changes_df['Change'], categories=['Removed', 'Changed (before)', 'Changed (after)', 'Added'], ordered=True)
+    if key_cols:
+        changes_df = changes_df.sort_values(key_cols + ['Change'], kind='stable')
+    return changes_df[['Change'] + [col for col in changes_df.columns if col != 'Change']].reset_index(drop=True)
+
+# Function for choosing which snapshot dates to keep: every snapshot from the last keep_days days, the first snapshot of each month for the last keep_months months (all months if keep_months is 0), and the most recent snapshot
+def get_retained_dates(dates, today=p_constants.today, keep_days=p_constants.archive_keep_days, keep_months=p_constants.archive_keep_months):
+    today = datetime.strptime(today, '%Y-%m-%d')
+    day_cutoff = (today - timedelta(days=keep_days)).strftime('%Y-%m-%d')
+    month_cutoff = ''
+    if keep_months:
+        month_index = today.year * 12 + today.month - 1 - keep_months
+        month_cutoff = '%04d-%02d' % (month_index // 12, month_index % 12 + 1)
+    retained = set(dates[-1:])
+    months = set()
+    for date in sorted(dates):
+        if date >= day_cutoff:
+            retained.add(date)
+        elif (date[:7] not in months) and (date[:7] > month_cutoff):
+            retained.add(date)
+        months.add(date[:7])
+    return sorted(retained)
+
+# Function for deleting the snapshots of a dataset that are not kept by the retention policy (see get_retained_dates). The blocks of the deleted snapshots are deleted by compact_archive (python p_archive.py compact). Returns the deleted dates
+def apply_retention(dataset, today=p_constants.today, archive_dir=p_constants.archive_dir):
+    dates = get_snapshot_dates(dataset, archive_dir)
+    retained = set(get_retained_dates(dates, today))
+    deleted = [date for date in dates if date not in retained]
+    for date in deleted:
+        # The manifest is deleted first, so a snapshot is never listed without its order file
+        os.remove(get_manifest_path(dataset, date, archive_dir))
+        order_path = get_manifest_path(dataset, date, archive_dir, 'order.parquet')
+        if os.path.exists(order_path):
+            os.remove(order_path)
+    return deleted
+
+# Function for deleting the block files that are not used by any snapshot of any dataset, and any temporary files left by a script that stopped while writing. Returns the number of files deleted and the number of bytes freed
+# A download script that is saving a snapshot has blocks (and temporary files) that are not listed in a manifest until the snapshot is complete, and the data types can be refreshed at the same time (see update_swamp_data.bat). So only the files that were not modified in the last grace_hours hours are deleted
+def compact_archive(archive_dir=p_constants.archive_dir, grace_hours=p_constants.archive_grace_hours):
+    # The cutoff is taken before the manifests are read, so a block that is added to a manifest after they are read was modified after the cutoff
+    cutoff = datetime.now().timestamp() - grace_hours * 3600
+    used = set()
+    for dataset in get_datasets(archive_dir):
+        for date in get_snapshot_dates(dataset, archive_dir):
+            with open(get_manifest_path(dataset, date, archive_dir)) as f:
+                used.update(block['hash'] for block in json.load(f)['blocks'])
+
+    n_files, n_bytes = 0, 0
+    for path in glob.glob(os.path.join(archive_dir, 'blocks', '*', '*')):
+        name = os.path.basename(path)
+        if ((name.endswith('.tmp')) or (name[:-len('.parquet')] not in used)) and (os.path.getmtime(path) < cutoff):
+            n_bytes += os.path.getsize(path)
+            os.remove(path)
+            n_files += 1
+    return n_files, n_bytes
+
+# Function for saving the raw data of a run in the archive: add the snapshot for today, then apply the retention policy. The blocks that are no longer used are not deleted here, because another download script may be saving a snapshot at the same time. They are deleted by the compact command (python p_archive.py compact, see compact_archive)
+def archive_snapshot(df, dataset, archive_dir=p_constants.archive_dir):
+    print('--- Saving snapshot of %s in the CEDEN archive' % dataset)
+    manifest = add_snapshot(df, dataset, p_constants.today, archive_dir)
+    print('--- %s rows in %s blocks (%s new, %s unchanged since a previous snapshot)' % (manifest['rows'], len(manifest['blocks']), manifest['new_blocks'], len(manifest['blocks']) - manifest['new_blocks']))
+    deleted = apply_retention(dataset, p_constants.today, archive_dir)
+    if len(deleted) > 0:
+        print('--- Removed %s snapshots of %s (retention policy): %s' % (len(deleted), dataset, ', '.join(deleted)))
+
+# Function for adding the dated CSV copies from before the archive was added (ceden_files/<date>/<dataset>_<date>.csv) to the archive. The CSV files are not deleted
+def import_dated_csvs(ceden_dir='../../ceden_files', archive_dir=p_constants.archive_dir):
+    for dataset, data_type in p_constants.archive_datasets.items():
+        existing = set(get_snapshot_dates(dataset, archive_dir))
+        for path in sorted(glob.glob(os.path.join(ceden_dir, '*', '%s_*.csv' % dataset))):
+            date = os.path.basename(os.path.dirname(path))
+            if (date in existing) or (os.path.basename(path) != '%s_%s.csv' % (dataset, date)):
+                continue
+            print('--- Importing %s' % path)
+            # round_trip reads the numbers exactly as they were written, so the snapshot has the same values as the original data
+            df = p_utils.read_csv(path, engine='pandas', na_values=p_constants.allowed_nans, keep_default_na=False, low_memory=False, float_precision='round_trip')
+            if data_type:
+                df = p_utils.apply_schema(df, data_type)
+            add_snapshot(df, dataset, date, archive_dir)
+
+# Function for converting the --where arguments of the command line (ex. StationCode=514FC1278, SampleDate>=2020-01-01) to filters (see convert_filters). Repeating a column with = matches any of the values
+def parse_where(conditions):
+    filters = {}
+    for condition in conditions or []:
+        for operator in ['>=', '<=', '=']:
+            if operator in condition:
+                col, value = condition.split(operator, 1)
+                break
+        else:
+            raise ValueError('Could not read the condition %s. Use column=value, column>=value, or column<=value' % condition)
+        if operator == '=':
+            filters.setdefault(col, []).append(value)
+        else:
+            low, high = filters.get(col, (None, None))
+            filters[col] = (value, high) if operator == '>=' else (low, value)
+    return filters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the CEDEN archive (%s)' % p_constants.archive_dir)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List the snapshots in the archive')
+    materialize_parser = commands.add_parser('materialize', help='Write the CSV file of a snapshot')
+    materialize_parser.add_argument('dataset', help='Dataset name (ex. ceden_swamp_wq)')
+    materialize_parser.add_argument('--date', help='Snapshot date (YYYY-MM-DD). Uses the most recent snapshot on or before this date. Defaults to the most recent snapshot')
+    materialize_parser.add_argument('--outdir', default='.', help='Folder to write the CSV file in')
+    query_parser = commands.add_parser('query', help='Write the rows of a snapshot that match the conditions')
+    query_parser.add_argument('dataset', help='Dataset name (ex. ceden_swamp_wq)')
+    query_parser.add_argument('--date', help='Snapshot date (YYYY-MM-DD). Uses the most recent snapshot on or before this date. Defaults to the most recent snapshot')
+    query_parser.add_argument('--where', action='append', help='Condition (ex. StationCode=514FC1278, SampleDate>=2020-01-01). Can be repeated')
+    query_parser.add_argument('--columns', nargs='+', help='Columns to write. Defaults to all columns')
+    query_parser.add_argument('--outdir', default='.', help='Folder to write the CSV file in')
+    diff_parser = commands.add_parser('diff', help='Write the rows that were added, removed, or changed between two snapshots')
+    diff_parser.add_argument('dataset', help='Dataset name (ex. ceden_swamp_wq)')
+    diff_parser.add_argument('date_1', help='Date of the first snapshot (YYYY-MM-DD)')
+    diff_parser.add_argument('date_2', help='Date of the second snapshot (YYYY-MM-DD)')
+    diff_parser.add_argument('--where', action='append', help='Condition (ex. StationCode=514FC1278, SampleDate>=2020-01-01). Can be repeated')
+    diff_parser.add_argument('--key', nargs='+', help='Columns that identify a record. Records with the same key in both snapshots are listed as changed')
+    diff_parser.add_argument('--outdir', default='.', help='Folder to write the CSV file in')
+    commands.add_parser('import-csv', help='Add the dated CSV copies in ceden_files to the archive')
+    commands.add_parser('compact', help='Apply the retention policy and delete unused blocks (not modified in the last SWAMP_ARCHIVE_GRACE_HOURS hours)')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for dataset in get_datasets():
+            print('%s: %s' % (dataset, ', '.join(get_snapshot_dates(dataset))))
+    elif args.command == 'materialize':
+        df = materialize(args.dataset, args.date)
+        file_name = '%s_%s' % (args.dataset, import_manifest(args.dataset, args.date)['date'])
+        p_utils.write_csv(df, file_name, args.outdir)
+        print('--- Wrote %s rows to %s' % (len(df), os.path.join(args.outdir, file_name + '.csv')))
+    elif args.command == 'query':
+        df = query(args.dataset, args.date, parse_where(args.where), args.columns)
+        file_name = '%s_%s_query' % (args.dataset, import_manifest(args.dataset, args.date)['date'])
+        p_utils.write_csv(df, file_name, args.outdir)
+        print('--- Wrote %s rows to %s' % (len(df), os.path.join(args.outdir, file_name + '.csv')))
+    elif args.command == 'diff':
+        df = diff(args.dataset, args.date_1, args.date_2, parse_where(args.where), args.key)
+        file_name = '%s_diff_%s_%s' % (args.dataset, args.date_1, args.date_2)
+        p_utils.write_csv(df, file_name, args.outdir)
+        print('--- %s' % (', '.join('%s: %s' % (change, count) for change, count in df['Change'].value_counts().sort_index().items() if count > 0) or 'No changes'))
+        print('--- Wrote %s rows to %s' % (len(df), os.path.join(args.outdir, file_name + '.csv')))
+    elif args.command == 'import-csv':
+        import_dated_csvs()
+    elif args.command == 'compact':
+        for dataset in get_datasets():
+            apply_retention(dataset)
+        n_files, n_bytes = compact_archive()
+        print('--- Deleted %s unused blocks (%.1f MB)' % (n_files, n_bytes / 1024 ** 2))
@@ -11,10 +11,43 @@ SERVER1 = os.environ.get('SERVER1')
 UID = os.environ.get('UID')
 PWD = os.environ.get('PWD')
 
+# Source of the data downloaded by the download scripts (see p_source.py):
+# --- 'datamart' (default): the CEDEN data marts (SERVER1)
+# --- 'local': a local SQLite database with tables of the same names as the data mart tables (SWAMP_SOURCE_DB), ex. loaded from test files or from the synthetic data (see benchmark/generate_data.py)
+# --- 'record': the CEDEN data marts, and the result of each query is also saved to the source cache (SWAMP_SOURCE_CACHE)
+# --- 'replay': the query results saved to the source cache by a previous run in record mode. The data marts are not used
+source = os.environ.get('SWAMP_SOURCE', 'datamart')
+source_db = os.environ.get('SWAMP_SOURCE_DB', '../../support_files/source/ceden_datamart.sqlite')
+source_cache_dir = os.environ.get('SWAMP_SOURCE_CACHE', '../../support_files/source/cache')
+
 # Environment variables for the open data portal
 HOST = os.environ.get('CK_host')
 KEY = os.environ.get('CK_key') 
 
+# Memory budget (in MB) for the steps that can run in chunked mode (water quality data quality and processing). When this is set, the input file is imported and processed in batches of rows that fit within the budget, and each batch is appended to the output file. When it is not set (0), the whole file is imported at once
+memory_budget_mb = int(os.environ.get('SWAMP_MEMORY_BUDGET_MB', 0))
+
+# Number of worker processes for the steps that can run in parallel (tissue length-adjusted average model fitting, and the data quality steps of large datasets, see p_utils_dq.add_data_quality). Defaults to 1 (no worker processes)
+workers = int(os.environ.get('SWAMP_WORKERS', 1))
+
+# Incremental mode for the tissue annual averages. When this is set (1), only the station/species/analyte/year groups with new, removed, or changed records are recalculated, and the results are combined with the averages saved from the previous run
+tissue_incremental = bool(int(os.environ.get('SWAMP_TISSUE_INCREMENTAL', 0)))
+
+# Incremental mode for the data quality steps (water quality, habitat, tissue). When this is set (1), the DataQuality and DataQualityIndicator values are saved to a cache file for each data type (see dq_cache_file), and only the records whose data quality fields are not in the cache are assessed (see p_utils_dq.add_cached_data_quality)
+dq_incremental = bool(int(os.environ.get('SWAMP_DQ_INCREMENTAL', 0)))
+
+# CSV engine used to import and export the data files: 'pandas' (default) or 'pyarrow'. The pyarrow engine uses multiple threads to import and export large files and requires the pyarrow package. If pyarrow is not installed, or a file cannot be handled by it, the pandas engine is used instead. The engine can also be chosen for each call (see p_utils.read_csv and p_utils.write_csv)
+csv_engine = os.environ.get('SWAMP_CSV_ENGINE', 'pandas')
+
+# Run metrics (see p_metrics.py). The wall time, CPU time, memory, and row counts of each stage of the data scripts are written to <metrics_dir>/swamp_metrics_<run ID>.jsonl. Set SWAMP_RUN_ID at the start of a run (see update_swamp_data.bat) so that all of the scripts of the run write to the same file. Defaults to today's date
+metrics_enabled = bool(int(os.environ.get('SWAMP_METRICS', 1)))
+metrics_dir = '../../support_files/metrics'
+run_id = os.environ.get('SWAMP_RUN_ID') or str(datetime.today()).split(' ')[0]
+
+# Optional run metrics that slow down the scripts: tracemalloc measurements of the Python memory allocated in each stage (SWAMP_METRICS_TRACEMALLOC=1), and a cProfile profile of one stage (SWAMP_PROFILE_STAGE=<stage name> or <script name>:<stage name>, ex. 2_wq_data_quality.py:data_quality)
+metrics_tracemalloc = bool(int(os.environ.get('SWAMP_METRICS_TRACEMALLOC', 0)))
+profile_stage = os.environ.get('SWAMP_PROFILE_STAGE')
+
 allowed_nans = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN',
                 '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
                 'NULL', 'NaN', 'nan', 'null']
@@ -121,6 +154,35 @@ datamart_tables = {
     'water_quality': 'WQDMart_MV'
 }
 
+# Row filters of the download queries (see p_query.py). Each condition is (column, operator, value), and a list of conditions is an OR group. The water quality data is downloaded with two queries: the SWAMP records for the analytes in ceden_wq_analytes, and the SPoT records (all analytes)
+download_filters = {
+    'stations': [],
+    'water_quality_swamp': [('Program', '=', 'Surface Water Ambient Monitoring Program'), ('ParentProject', 'not in', spot_parent_projects), ('Analyte', 'in', ceden_wq_analytes)],
+    'water_quality_spot': [('Program', '=', 'Surface Water Ambient Monitoring Program'), ('ParentProject', 'in', spot_parent_projects)],
+    'habitat': [('Program', 'in', habitat_programs), ('Analyte', 'in', ceden_phab_analytes)],
+    'toxicity': [('Program', '=', 'Surface Water Ambient Monitoring Program'), ('Mean', 'is not null'), ('CollectionReplicate', '=', 1), ('LabReplicate', '=', 1)],
+    'tissue': [('ProgramName', '=', 'Surface Water Ambient Monitoring Program')]
+}
+
+# Data types whose station index is used to find the LastSampleDate of each station in the sites step. The data quality step of each data type writes its station index to support_files/swamp_<type>_station_index.csv (see p_utils.get_station_index)
+# The tissue data quality step also writes a station index, so the tissue stations can be included by adding 'tissue' to this list. The tissue pushdown rules below then turn off, so the station index includes the tissue replicates and the records with no SampleDate, as for the other data types
+station_index_types = ['wq', 'phab', 'tox']
+
+# Filters of the process scripts that are also applied in the download queries (pushdown), so the rows are not downloaded, imported, and scored just to be dropped by the process scripts. The process scripts still apply the same filters. A filter is only pushed down if the records it drops are not used before the process script drops them:
+# --- The data quality assessment and the other filters look at each record on its own, so dropping a record does not change the other records
+# --- The sites step uses the station indexes of the station_index_types data types (all of the records with a data quality category, see p_utils.get_station_index). For these data types, only the FIELDQA_SWAMP records are pushed down, because the station indexes already exclude them. The other filters (replicates, Result -88, blank matrices, no sample date) stay in the process scripts, because dropping those records earlier could change the LastSampleDate of a station
+# --- Text filters are limited to station codes. Text comparisons are not case-sensitive in the data marts
+# Note: the columns are the data mart columns, which are renamed in some of the data quality scripts (ex. ResultReplicate is ResultsReplicate in the tissue process script)
+# Set SWAMP_DOWNLOAD_PUSHDOWN=0 to download (and archive) all of the records of the download queries
+download_pushdown = bool(int(os.environ.get('SWAMP_DOWNLOAD_PUSHDOWN', 1)))
+download_pushdown_rules = {
+    'water_quality': [[('StationCode', 'is null'), ('StationCode', '!=', 'FIELDQA_SWAMP')]],
+    'habitat': [[('StationCode', 'is null'), ('StationCode', '!=', 'FIELDQA_SWAMP')]],
+    'toxicity': [[('StationCode', 'is null'), ('StationCode', '!=', 'FIELDQA_SWAMP')]],
+    # The tissue records are not used by the sites step, so the filters of the tissue process script are pushed down. If 'tissue' is in station_index_types, no tissue filters are pushed down (the tissue process script does not drop the FIELDQA_SWAMP records)
+    'tissue': [] if 'tissue' in station_index_types else [('CollectionReplicate', '=', 1), ('CompositeReplicate', '=', 1), ('ResultReplicate', '=', 1), ('SampleDate', 'is not null')]
+}
+
 # The data categories that will be included in any analysis/summary (data processing only). The same changes must also be made in the app code.
 # Categories excluded: "MetaData", "Reject record"
 dq_categories = [
@@ -132,6 +194,30 @@ dq_categories = [
     'Not assessed'
 ]
 
+# Numeric columns whose missing values are written as "NaN" text in the data quality files (see p_utils.write_csv). The open data portal requires missing numbers to be encoded as "NaN" to define the data type as numeric. The columns stay numeric (NaN) in the scripts
+nan_text_cols = ['TargetLatitude', 'TargetLongitude']
+
+# Relative location of the data quality rules file: the codes of each field and their data quality scores (see p_utils_dq.py). To change the rules, save a new dated copy of the file and update this path
+dq_rules_file = '../../assets/dq_rules_10-19-26.csv'
+
+# Relative location of the data quality cache file of each data type (ex. swamp_water_quality_dq_cache.pkl), used by the incremental mode of the data quality steps (see dq_incremental). The cache is cleared automatically when the rules file changes
+dq_cache_file = '../../support_files/swamp_%s_dq_cache.pkl'
+
+# Data quality diagnostics (see p_utils_dq.report_dq_diagnostics). The codes that do not match a rule are counted by column and code, and listed at the end of each data quality step with a few example records (identified by the key columns). The full report is saved to dq_diagnostics_file for each data type (ex. swamp_water_quality_dq_diagnostics.json)
+# Set SWAMP_DQ_MAX_UNKNOWN_CODES to stop the run when codes that are not in the rules are found more times than this (a record with two of these codes counts twice). Not set by default (no limit)
+dq_diagnostics_file = '../../support_files/swamp_%s_dq_diagnostics.json'
+dq_diagnostics_examples = 5
+dq_diagnostics_key_cols = ['StationCode', 'SampleDate', 'Analyte', 'MatrixName']
+dq_max_unknown_codes = int(os.environ['SWAMP_DQ_MAX_UNKNOWN_CODES']) if os.environ.get('SWAMP_DQ_MAX_UNKNOWN_CODES') else None
+
+# Columns used for the data quality rule fields by each data type, where the column name is different from the field name in the rules file. The toxicity data has the QA codes of the toxicity results in ToxResultQACode, and the lab replicate number in LabReplicate
+dq_column_maps = {
+    'toxicity': {
+        'QACode': 'ToxResultQACode',
+        'ResultsReplicate': 'LabReplicate'
+    }
+}
+
 # Date fields in the phab dataset that should be imported as the date data type
 phab_date_cols = ['SampleDate']
 
@@ -146,6 +232,31 @@ portal_resource_ids = {
 # Relative location of RB boundaries layer used for assigning RB value to stations
 rb_boundaries_file = '../../assets/rb_boundaries.geojson'
 
+# Relative location of the cache of station RB values from previous runs. Stations with the same StationCode and coordinates as in the cache reuse the cached RB value instead of being compared to the RB boundaries again
+region_cache_file = '../../support_files/swamp_station_regions.csv'
+
+# Relative location of the CEDEN archive, where the raw data pulled on each run is saved as compressed snapshots (see p_archive.py)
+archive_dir = '../../ceden_files/archive'
+
+# Datasets saved in the CEDEN archive, and the data type of each dataset (used to apply the column schema when the dated CSV copies from before the archive are imported)
+archive_datasets = {
+    'ceden_stations': None,
+    'ceden_swamp_phab': 'habitat',
+    'ceden_swamp_tissue': 'tissue',
+    'ceden_swamp_tox': 'toxicity',
+    'ceden_swamp_wq': 'water_quality'
+}
+
+# Retention policy of the CEDEN archive: every snapshot from the last archive_keep_days days is kept, plus the first snapshot of each month for the last archive_keep_months months (0 = keep the first snapshot of every month). The most recent snapshot is always kept
+archive_keep_days = int(os.environ.get('SWAMP_ARCHIVE_KEEP_DAYS', 30))
+archive_keep_months = int(os.environ.get('SWAMP_ARCHIVE_KEEP_MONTHS', 0))
+
+# The unused blocks of the CEDEN archive are deleted by the compact command (python p_archive.py compact), not by the download scripts. Blocks and temporary files modified in the last archive_grace_hours hours are not deleted, because a download script that is running may be saving them
+archive_grace_hours = float(os.environ.get('SWAMP_ARCHIVE_GRACE_HOURS', 24))
+
+# Columns whose minimum and maximum values are saved for each block of the CEDEN archive. Used to skip the blocks that cannot match a query
+archive_stats_cols = ['StationCode', 'SampleDate', 'Analyte', 'Program', 'ParentProject', 'Project']
+
 reference_sites_file = '../../assets/reference_sites_1-27-23.csv'
 
 # Date fields in the tissue dataset that should be imported as the date data type
@@ -157,6 +268,167 @@ today = str(datetime.today()).split(' ')[0]
 # Date fields in the tox dataset that should be imported as the date data type
 tox_date_cols = ['SampleDate', 'ToxBatchStartDate']
 
+# Column schema for each data type, applied when the data is downloaded or imported (see p_utils.apply_schema)
+# category: Text fields that repeat a small set of values across many records (ex. StationCode, Analyte). Storing these as categorical columns uses much less memory and speeds up isin, merge, and groupby calls
+# numeric: Fields that should always be numbers. Values that cannot be converted are replaced with NaN
+# date: Fields that should always be dates. Values that cannot be converted are replaced with NaT
+# Fields that are not in the dataframe are skipped, so the lists can include fields that are only present in some of the files for a data type
+schemas = {
+    'habitat': {
+        'category': ['Program', 'ParentProject', 'Project', 'StationCode', 'StationName', 'SampleTypeCode', 'MatrixName', 'Analyte', 'Unit', 'ResultQualCode', 'QACode', 'BatchVerification', 'DataQuality', 'DataQualityIndicator'],
+        'numeric': ['Result', 'MDL', 'RL', 'TargetLatitude', 'TargetLongitude'],
+        'date': phab_date_cols
+    },
+    'tissue': {
+        'category': ['ProgramName', 'ParentProjectName', 'ProjectCode', 'ProjectName', 'StationCode', 'StationName', 'CommonName', 'FinalID', 'TissueName', 'SampleTypeCode', 'MatrixName', 'Analyte', 'DWC_AnalyteWFraction', 'Unit', 'ResultQualCode', 'QACode', 'BatchVerification', 'DataQuality', 'DataQualityIndicator'],
+        'numeric': ['Result', 'MDL', 'RL', 'TargetLatitude', 'TargetLongitude', 'TLAvgLength(mm)'],
+        'date': tissue_date_cols
+    },
+    'toxicity': {
+        'category': ['Program', 'ParentProject', 'Project', 'StationCode', 'StationName', 'SampleTypeCode', 'MatrixName', 'Analyte', 'Unit', 'OrganismName', 'ResultQualCode', 'ToxResultQACode', 'Treatment', 'UnitTreatment', 'DataQuality'],
+        'numeric': ['Mean', 'TargetLatitude', 'TargetLongitude'],
+        'date': tox_date_cols
+    },
+    'water_quality': {
+        'category': ['Program', 'ParentProject', 'Project', 'StationCode', 'StationName', 'SampleTypeCode', 'MatrixName', 'MethodName', 'Analyte', 'Fraction', 'Unit', 'ResultQualCode', 'QACode', 'BatchVerification', 'ComplianceCode', 'DataQuality', 'DataQualityIndicator'],
+        'numeric': ['Result', 'MDL', 'RL', 'TargetLatitude', 'TargetLongitude', 'CollectionDepth'],
+        'date': wq_date_cols
+    }
+}
+
+# Columns used by each stage of the scripts (column manifests, see p_utils.check_columns and p_utils.get_stage_columns)
+# requires: columns the stage cannot run without. The scripts check the header of the input file for these columns before importing it, so a missing column stops the script right away instead of after a long import
+# optional: columns that are used if they are in the data
+# produces: columns added by the stage
+# carries: the other input columns kept in the output of the stage. 'all' if every input column is kept (the water quality, habitat, and toxicity exports include all of the CEDEN columns, so these stages cannot drop columns without changing the exports), or a list of columns
+column_manifests = {
+    # Data quality rule fields (p_utils_dq.add_data_quality). The DataQuality and DataQualityIndicator values are calculated from these columns only. The columns of the toxicity data are different (see dq_column_maps)
+    'data_quality': {
+        'requires': ['QACode', 'StationCode', 'Analyte', 'ResultQualCode', 'SampleDate', 'Result', 'TargetLatitude', 'SampleTypeCode', 'MatrixName', 'CollectionReplicate', 'Datum'],
+        'optional': ['BatchVerification', 'ResultsReplicate'],
+        'produces': ['DataQuality', 'DataQualityIndicator'],
+        'carries': 'all'
+    },
+    # Non-detect values (p_utils.get_nd_values)
+    'nd_values': {
+        'requires': ['Result', 'ResultQualCode', 'MDL'],
+        'optional': [],
+        'produces': ['ResultAdjusted', 'DisplayText', 'Censored'],
+        'carries': []
+    },
+    # Data quality scripts. Datum is joined from the CEDEN stations table, and the tissue columns have the data mart names (renamed before the data quality functions run)
+    'wq_data_quality': {
+        'requires': ['QACode', 'StationCode', 'Analyte', 'ResultQualCode', 'SampleDate', 'Result', 'TargetLatitude', 'TargetLongitude', 'SampleTypeCode', 'MatrixName', 'CollectionReplicate'],
+        'optional': ['BatchVerification', 'ResultsReplicate'],
+        'produces': ['Datum', 'DataQuality', 'DataQualityIndicator'],
+        'carries': 'all'
+    },
+    'phab_data_quality': {
+        'requires': ['QACode', 'StationCode', 'Analyte', 'ResultQualCode', 'SampleDate', 'Result', 'TargetLatitude', 'TargetLongitude', 'SampleTypeCode', 'MatrixName', 'CollectionReplicate'],
+        'optional': ['BatchVerification', 'ResultsReplicate'],
+        'produces': ['Datum', 'DataQuality', 'DataQualityIndicator'],
+        'carries': 'all'
+    },
+    'tissue_data_quality': {
+        'requires': ['QACode', 'StationCode', 'Analyte', 'ResQualCode', 'SampleDate', 'Result', 'TargetLatitude', 'TargetLongitude', 'SampleTypeCode', 'Matrix', 'CollectionReplicate'],
+        'optional': ['BatchVerification', 'ResultReplicate'],
+        'produces': ['Datum', 'DataQuality', 'DataQualityIndicator'],
+        'carries': 'all'
+    },
+    # Process scripts
+    'wq_process': {
+        'requires': ['ParentProject', 'StationCode', 'SampleDate', 'CollectionReplicate', 'ResultsReplicate', 'MatrixName', 'Analyte', 'Result', 'ResultQualCode', 'MDL', 'QACode'],
+        'optional': [],
+        'produces': ['ResultDisplay', 'DisplayText', 'Censored', 'AnalyteDisplay', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3', 'MatrixDisplay', 'Region', 'Bioassessment', 'Bioaccumulation', 'Fhab', 'Spot', 'StationCategory'],
+        'carries': 'all'
+    },
+    'phab_process': {
+        'requires': ['ParentProject', 'StationName', 'StationCode', 'SampleDate', 'CollectionReplicate', 'MatrixName', 'Analyte', 'Unit', 'Result', 'ResultQualCode', 'QACode'],
+        'optional': [],
+        'produces': ['AnalyteDisplay', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3', 'MatrixDisplay', 'Region', 'Bioassessment', 'Bioaccumulation', 'Fhab', 'Spot', 'StationCategory'],
+        'carries': 'all'
+    },
+    'tox_process': {
+        'requires': ['ParentProject', 'StationName', 'StationCode', 'SampleDate', 'SampleTypeCode', 'CollectionReplicate', 'MatrixName', 'Analyte', 'ResultQualCode', 'TargetLatitude', 'TargetLongitude', 'LabReplicate', 'Mean', 'OrganismName', 'Treatment', 'UnitTreatment', 'TreatmentConcentration'],
+        'optional': [],
+        'produces': ['MeanDisplay', 'Censored', 'AnalyteDisplay', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3', 'MatrixDisplay', 'Region', 'Bioassessment', 'Bioaccumulation', 'Fhab', 'Spot', 'StationCategory'],
+        'carries': 'all'
+    },
+    # The tissue process script only exports averages, so it only imports the columns used to filter the records and calculate the averages
+    'tissue_process': {
+        'requires': ['ProgramName', 'ParentProjectName', 'ProjectCode', 'ProjectName', 'StationCode', 'StationName', 'SampleDate', 'CommonName', 'FinalID', 'TissueName', 'TissuePrep', 'NumberFishperComp', 'Analyte', 'DWC_AnalyteWFraction', 'Unit', 'Result', 'ResultQualCode', 'MDL', 'CollectionReplicate', 'CompositeReplicate', 'ResultsReplicate', 'TLAvgLength(mm)', 'TissueResultRowID', 'CompositeCompositeID', 'TargetLatitude', 'TargetLongitude', 'Datum', 'DataQuality'],
+        'optional': [],
+        'produces': ['AnalyteDisplay', 'AnalyteGroup1', 'MatrixDisplay', 'Region', 'Bioassessment', 'Bioaccumulation', 'Fhab', 'Spot', 'StationCategory'],
+        'carries': []
+    },
+    # Lookup tables joined by the process scripts
+    'stations_lookup': {
+        'requires': ['StationCode', 'Region'],
+        'optional': [],
+        'produces': [],
+        'carries': []
+    },
+    'analytes_lookup': {
+        'requires': ['CedenAnalyteName', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3'],
+        'optional': [],
+        'produces': [],
+        'carries': []
+    },
+    'reference_sites_lookup': {
+        'requires': ['cedenid', 'StationCategory'],
+        'optional': [],
+        'produces': [],
+        'carries': []
+    },
+    # Station summary tables (see summary/1_station_summary.py). Only the columns used by the summary are imported from the exported datasets
+    'wq_station_summary': {
+        'requires': ['StationCode', 'AnalyteDisplay', 'MatrixDisplay', 'Unit', 'ResultDisplay', 'Censored', 'SampleDate', 'DataQuality'],
+        'optional': [],
+        'produces': ['Count', 'CensoredCount', 'Min', 'Max', 'Median', 'LatestValue', 'LatestDate', 'FirstYear', 'LastYear'],
+        'carries': []
+    },
+    'phab_station_summary': {
+        'requires': ['StationCode', 'AnalyteDisplay', 'MatrixDisplay', 'Unit', 'ResultDisplay', 'Censored', 'SampleDate', 'DataQuality'],
+        'optional': [],
+        'produces': ['Count', 'CensoredCount', 'Min', 'Max', 'Median', 'LatestValue', 'LatestDate', 'FirstYear', 'LastYear'],
+        'carries': []
+    },
+    'tox_station_summary': {
+        'requires': ['StationCode', 'AnalyteDisplay', 'MatrixDisplay', 'Unit', 'MeanDisplay', 'Censored', 'SampleDate', 'DataQuality'],
+        'optional': [],
+        'produces': ['Count', 'CensoredCount', 'Min', 'Max', 'Median', 'LatestValue', 'LatestDate', 'FirstYear', 'LastYear'],
+        'carries': []
+    },
+    'tissue_station_summary': {
+        'requires': ['StationCode', 'AnalyteDisplay', 'MatrixDisplay', 'Unit', 'Result', 'Censored', 'LastSampleDate', 'SampleYear', 'DataQuality'],
+        'optional': [],
+        'produces': ['Count', 'CensoredCount', 'Min', 'Max', 'Median', 'LatestValue', 'LatestDate', 'FirstYear', 'LastYear'],
+        'carries': []
+    }
+}
+
+# Station summary tables for the dashboard (see summary/1_station_summary.py). The records of each exported dataset are summarized for each station, analyte, matrix, and unit (station_summary_group_cols). For each data type:
+# --- file_name: the file name of the dataset in the dated export folder (without the date). The summary table is written to the same folder as swamp_<data type>_station_summary_<date>.csv
+# --- stage: the column manifest of the summary (see column_manifests)
+# --- value: the column of the values that are summarized (min, max, median, and latest value)
+# --- date: the date of the records, used to find the latest value
+# --- year: the year of the records, used for the first and last year. If None, the year of the date column is used
+station_summary_group_cols = ['StationCode', 'AnalyteDisplay', 'MatrixDisplay', 'Unit']
+station_summaries = {
+    'water_quality': {'file_name': 'swamp_water_quality_data', 'stage': 'wq_station_summary', 'value': 'ResultDisplay', 'date': 'SampleDate', 'year': None},
+    'habitat': {'file_name': 'swamp_habitat_data', 'stage': 'phab_station_summary', 'value': 'ResultDisplay', 'date': 'SampleDate', 'year': None},
+    'toxicity': {'file_name': 'swamp_toxicity_data', 'stage': 'tox_station_summary', 'value': 'MeanDisplay', 'date': 'SampleDate', 'year': None},
+    'tissue': {'file_name': 'swamp_tissue_summary_data', 'stage': 'tissue_station_summary', 'value': 'Result', 'date': 'LastSampleDate', 'year': 'SampleYear'}
+}
+
+# Open data portal resource IDs of the station summary tables (see summary/2_station_summary_upload_portal.py). The portal resources of the summary tables have not been created yet. Once a resource is created, set its ID here or in the SWAMP_<DATA TYPE>_SUMMARY_RESOURCE_ID environment variable (ex. SWAMP_WATER_QUALITY_SUMMARY_RESOURCE_ID). The summary tables without a resource ID are not uploaded
+station_summary_resource_ids = {
+    'water_quality': os.environ.get('SWAMP_WATER_QUALITY_SUMMARY_RESOURCE_ID'),
+    'habitat': os.environ.get('SWAMP_HABITAT_SUMMARY_RESOURCE_ID'),
+    'toxicity': os.environ.get('SWAMP_TOXICITY_SUMMARY_RESOURCE_ID'),
+    'tissue': os.environ.get('SWAMP_TISSUE_SUMMARY_RESOURCE_ID')
+}
+
 # Relative paths of data files in the export folder
 upload_file_paths = {
     'habitat': '../../export/swamp_habitat_data.csv',
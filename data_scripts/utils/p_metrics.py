@@ -0,0 +1,217 @@
+'''
+Functions for recording run metrics for the stages of each data script (ex. import, clean, data quality, filter, enrich, write, upload). For each stage, the wall time, CPU time, memory (resident set size at the start and end of the stage, and the peak during the stage), and the number of input and output rows are written as one JSON record to the metrics file of the run (p_constants.metrics_dir/swamp_metrics_<run ID>.jsonl). The records of all of the scripts run by the batch file are written to the same file, so the files of two runs can be compared to see where time and memory go and to catch regressions
+
+Usage in a script:
+
+    with p_metrics.stage('import') as m:
+        wq_df = p_utils.read_csv(...)
+        m['rows_out'] = len(wq_df)
+
+For a stage that is a long block of code at the top level of a script, use start_stage and end_stage instead, so the code does not have to be indented in a with block:
+
+    m = p_metrics.start_stage('enrich', rows_in=len(phab_df))
+    ...
+    m['rows_out'] = len(phab_df)
+    p_metrics.end_stage(m)
+
+Recording the metrics takes a few system calls per stage, so it is on by default (set SWAMP_METRICS=0 to turn it off). Two optional measurements are slower and are off by default:
+--- SWAMP_METRICS_TRACEMALLOC=1: also record the Python memory allocated during each stage (tracemalloc). This slows down the scripts while it is on
+--- SWAMP_PROFILE_STAGE=<stage name> (ex. data_quality or 2_wq_data_quality.py:data_quality): profile the stage with cProfile and save the profile to the metrics folder (<script>_<stage>_<run ID>.prof). Open the file with python -m pstats or snakeviz
+
+To print the metrics of a run: python p_metrics.py (latest run) or python p_metrics.py --run <run ID>
+'''
+
+import argparse
+import cProfile
+from contextlib import contextmanager
+import glob
+import json
+import os
+import pandas as pd
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import p_constants # p_constants.py
+
+
+# Stack of the stages that are running (stages can be nested, ex. a data quality stage inside a chunk stage). The name of a nested stage includes the names of the stages it is in (ex. chunk/data_quality)
+running_stages = []
+
+
+# Function for getting the name of the script that is running (ex. 2_wq_data_quality.py)
+def get_script_name():
+    return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python'
+
+# Function for getting the path of the metrics file of a run
+def get_metrics_path(run_id=p_constants.run_id, metrics_dir=p_constants.metrics_dir):
+    return os.path.join(metrics_dir, 'swamp_metrics_%s.jsonl' % run_id)
+
+# Function for getting the current resident set size (RSS) of the process in MB. Uses psutil if it is installed, and /proc/self/statm on Linux otherwise. Returns None if the RSS cannot be read
+def get_rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# Function for getting the peak RSS of the process in MB (the peak since the process started, or since the peak was last reset with reset_peak_rss). Returns None if the peak cannot be read
+def get_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2 # Windows
+    except (ImportError, AttributeError):
+        return None
+
+# Function for resetting the peak RSS of the process to the current RSS, so that the peak of each stage can be measured. Only possible on Linux (by writing 5 to /proc/self/clear_refs). Returns False if the peak cannot be reset, in which case the peak of a stage is the peak of the process up to the end of the stage
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# Function for checking if a stage should be profiled. The SWAMP_PROFILE_STAGE value can be the stage name (ex. data_quality) or the script and stage name (ex. 2_wq_data_quality.py:data_quality)
+def is_profiled(name):
+    profile_stage = p_constants.profile_stage
+    return bool(profile_stage) and (profile_stage in [name, '%s:%s' % (get_script_name(), name)])
+
+# Function for appending a record to the metrics file of the run
+def write_record(record, run_id=p_constants.run_id, metrics_dir=p_constants.metrics_dir):
+    os.makedirs(metrics_dir, exist_ok=True)
+    with open(get_metrics_path(run_id, metrics_dir), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+# Function (context manager) for recording the metrics of a stage. Use in a with block, and set 'rows_in' and 'rows_out' in the returned dictionary. The record is written when the with block ends, including when the stage raises an error (with status 'error')
+@contextmanager
+def stage(name, rows_in=None):
+    parent = '/'.join(s['name'] for s in running_stages)
+    metrics = {'name': '%s/%s' % (parent, name) if parent else name, 'rows_in': rows_in, 'rows_out': None, 'peak_rss_mb': None}
+    if not p_constants.metrics_enabled:
+        yield metrics
+        return
+
+    started = datetime.now()
+    rss_start_mb = get_rss_mb()
+    # Save the peak of the stage this stage is in before the peak is reset
+    if running_stages:
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            running_stages[-1]['peak_rss_mb'] = max(running_stages[-1]['peak_rss_mb'] or 0, peak_rss_mb)
+    peak_reset = reset_peak_rss()
+    if p_constants.metrics_tracemalloc:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if is_profiled(metrics['name']) else None
+    running_stages.append(metrics)
+    status = 'error'
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield metrics
+        status = 'ok'
+    finally:
+        if profiler:
+            profiler.disable()
+        wall_s = time.perf_counter() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        running_stages.pop()
+
+        # The peak of a nested stage is also a peak of the stage it is in. The peak was reset at the start of the nested stage, so it is passed up to the stage it is in
+        peak_rss_mb = get_peak_rss_mb()
+        if (peak_rss_mb is not None) and (metrics['peak_rss_mb'] is not None):
+            peak_rss_mb = max(peak_rss_mb, metrics['peak_rss_mb'])
+        if running_stages and (peak_rss_mb is not None):
+            running_stages[-1]['peak_rss_mb'] = max(running_stages[-1]['peak_rss_mb'] or 0, peak_rss_mb)
+
+        rss_end_mb = get_rss_mb()
+        record = {
+            'run_id': p_constants.run_id,
+            'script': get_script_name(),
+            'stage': metrics['name'],
+            'started': started.isoformat(timespec='seconds'),
+            'wall_s': round(wall_s, 3),
+            'cpu_s': round(cpu_s, 3),
+            'rss_start_mb': None if rss_start_mb is None else round(rss_start_mb, 1),
+            'rss_end_mb': None if rss_end_mb is None else round(rss_end_mb, 1),
+            'peak_rss_mb': None if peak_rss_mb is None else round(peak_rss_mb, 1),
+            'peak_is_stage': peak_reset, # False if the peak could not be reset at the start of the stage (the peak is then the peak of the process up to the end of the stage)
+            'rows_in': None if metrics['rows_in'] is None else int(metrics['rows_in']),
+            'rows_out': None if metrics['rows_out'] is None else int(metrics['rows_out']),
+            'status': status,
+            'pid': os.getpid()
+        }
+        if p_constants.metrics_tracemalloc:
+            traced_end, traced_peak = tracemalloc.get_traced_memory()
+            record['traced_delta_mb'] = round((traced_end - traced_start) / 1024 ** 2, 1)
+            record['traced_peak_mb'] = round((traced_peak - traced_start) / 1024 ** 2, 1)
+        try:
+            if profiler:
+                os.makedirs(p_constants.metrics_dir, exist_ok=True)
+                record['profile'] = os.path.join(p_constants.metrics_dir, '%s_%s_%s.prof' % (os.path.splitext(get_script_name())[0], metrics['name'].replace('/', '-'), p_constants.run_id))
+                profiler.dump_stats(record['profile'])
+            write_record(record)
+        except OSError as e:
+            print('--- Could not write the run metrics: %s' % e)
+
+# Function for starting a stage without a with block (see stage). Returns the metrics dictionary of the stage. Set 'rows_in' and 'rows_out' in the dictionary, and pass it to end_stage when the stage is done. If the script stops with an error before end_stage is called, the stage is not recorded
+def start_stage(name, rows_in=None):
+    context = stage(name, rows_in)
+    metrics = context.__enter__()
+    metrics['context'] = context
+    return metrics
+
+# Function for ending a stage started with start_stage and writing its record
+def end_stage(metrics):
+    metrics.pop('context').__exit__(None, None, None)
+
+# Function for importing the metrics of a run as a dataframe. Uses the latest run in the metrics folder if no run ID is given
+def import_metrics(run_id=None, metrics_dir=p_constants.metrics_dir):
+    if run_id is None:
+        paths = glob.glob(os.path.join(metrics_dir, 'swamp_metrics_*.jsonl'))
+        if not paths:
+            return None
+        path = max(paths, key=os.path.getmtime)
+    else:
+        path = get_metrics_path(run_id, metrics_dir)
+    return pd.read_json(path, lines=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the metrics of a run of the data scripts')
+    parser.add_argument('--run', help='Run ID (default: the latest run in the metrics folder)')
+    parser.add_argument('--metrics-dir', default=p_constants.metrics_dir, help='Metrics folder')
+    args = parser.parse_args()
+
+    metrics_df = import_metrics(args.run, args.metrics_dir)
+    if metrics_df is None:
+        sys.exit('No metrics files in %s' % args.metrics_dir)
+    cols = [col for col in ['script', 'stage', 'wall_s', 'cpu_s', 'rss_start_mb', 'rss_end_mb', 'peak_rss_mb', 'traced_peak_mb', 'rows_in', 'rows_out', 'status'] if col in metrics_df.columns]
+    for col in ['rows_in', 'rows_out']:
+        metrics_df[col] = metrics_df[col].astype('Int64')
+    print('Run %s' % metrics_df['run_id'].iloc[0])
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(metrics_df[cols].to_string(index=False))
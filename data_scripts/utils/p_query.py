@@ -0,0 +1,94 @@
+'''
+Functions for building the SQL queries of the download scripts. The row filters of each query are defined as a list of conditions in p_constants (download_filters and download_pushdown_rules) instead of SQL text, and the values are sent as query parameters (?), so values with quotes do not need to be escaped
+
+Each condition is a tuple (column, operator, value), ex. ('Analyte', 'in', ['pH', 'Temperature']). Operators: '=', '!=', 'in', 'not in', 'is null', 'is not null' (no value). A list of conditions is an OR group, ex. [('Unit', 'is null'), ('Unit', '!=', 'NR')]. The conditions of a query are combined with AND
+
+The conditions follow the SQL rules for missing values: a NULL value does not match '=', '!=', 'in', or 'not in'. Use an OR group with 'is null' to keep the rows with NULL values, ex. [('StationCode', 'is null'), ('StationCode', '!=', 'FIELDQA_SWAMP')]. apply_conditions filters a dataframe with the same rules (used by benchmark/generate_data.py to write the same rows as the download scripts)
+'''
+
+import numpy as np
+import re
+import p_constants # p_constants.py
+
+
+# Operators that compare a column to a value (or list of values), and operators without a value
+value_operators = ['=', '!=', 'in', 'not in']
+null_operators = ['is null', 'is not null']
+
+
+# Function for checking a column name, since column names are part of the SQL text (only the values are parameters)
+def check_column(column):
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', column):
+        raise ValueError('Invalid column name in query condition: %r' % column)
+    return column
+
+# Function for building the SQL text and parameters of a condition (or of an OR group of conditions)
+def build_condition(condition):
+    if isinstance(condition, list):
+        parts = [build_condition(c) for c in condition]
+        return '(' + ' OR '.join(sql for sql, _ in parts) + ')', [param for _, params in parts for param in params]
+    column, operator = check_column(condition[0]), condition[1].lower()
+    if operator in null_operators:
+        return '%s %s' % (column, operator.upper()), []
+    if operator not in value_operators:
+        raise ValueError('Unknown operator in query condition: %r' % condition[1])
+    value = condition[2]
+    if operator in ['in', 'not in']:
+        values = list(value)
+        if not values:
+            raise ValueError('Empty list of values in query condition for %s' % column)
+        return '%s %s (%s)' % (column, operator.upper(), ', '.join(['?'] * len(values))), values
+    return '%s %s ?' % (column, operator), [value]
+
+# Function for building a SELECT query of a table with the given conditions. Returns the SQL text and the list of parameters
+def build_query(table, conditions=(), columns=None):
+    check_column(table)
+    sql = 'SELECT %s FROM %s' % (', '.join(check_column(c) for c in columns) if columns else '*', table)
+    params = []
+    if conditions:
+        parts = [build_condition(c) for c in conditions]
+        sql += ' WHERE ' + ' AND '.join(part_sql for part_sql, _ in parts)
+        params = [param for _, part_params in parts for param in part_params]
+    return sql, params
+
+# Function for getting the conditions of a download query (see p_constants.download_filters), with the pushdown rules of the data type added if download_pushdown is on (see p_constants.download_pushdown_rules)
+def get_download_conditions(query_name, data_type, pushdown=None):
+    pushdown = p_constants.download_pushdown if pushdown is None else pushdown
+    return list(p_constants.download_filters[query_name]) + (list(p_constants.download_pushdown_rules.get(data_type, [])) if pushdown else [])
+
+# Function for building a download query (see get_download_conditions). Returns the SQL text and the list of parameters
+def get_download_query(query_name, data_type, columns=None, pushdown=None):
+    return build_query(p_constants.datamart_tables[data_type], get_download_conditions(query_name, data_type, pushdown), columns)
+
+# Function for filtering a dataframe with a list of conditions, with the same rules as the SQL query. Returns a boolean array of the rows that match all of the conditions
+def apply_conditions(df, conditions):
+    mask = np.ones(len(df), dtype=bool)
+    for condition in conditions:
+        mask &= get_condition_mask(df, condition)
+    return mask
+
+# Function for getting the boolean array of the rows of a dataframe that match a condition (or an OR group of conditions)
+def get_condition_mask(df, condition):
+    if isinstance(condition, list):
+        mask = np.zeros(len(df), dtype=bool)
+        for c in condition:
+            mask |= get_condition_mask(df, c)
+        return mask
+    series = df[condition[0]]
+    operator = condition[1].lower()
+    if operator == 'is null':
+        return series.isna().to_numpy()
+    if operator == 'is not null':
+        return series.notna().to_numpy()
+    value = condition[2]
+    if operator == '=':
+        mask = series == value
+    elif operator == '!=':
+        mask = series != value
+    elif operator == 'in':
+        mask = series.isin(list(value))
+    elif operator == 'not in':
+        mask = ~series.isin(list(value))
+    else:
+        raise ValueError('Unknown operator in query condition: %r' % condition[1])
+    return (mask & series.notna()).to_numpy(dtype=bool)
@@ -0,0 +1,138 @@
+'''
+Functions for finding the Regional Water Quality Control Board (RB) region of a set of points (stations) without geopandas. The RB boundaries are loaded from the geojson file once and projected to EPSG:3310 (NAD 83 CA Teale Albers), the same projection used by the geopandas version of the sites step. Point-in-polygon and nearest-boundary checks are done on all of the points at once with NumPy
+'''
+
+import json
+import numpy as np
+
+
+# Parameters of the EPSG:3310 projection (NAD 83 / California Albers, https://spatialreference.org/ref/epsg/3310/). NAD 83 uses the GRS 80 ellipsoid
+albers_params = {
+    'a': 6378137.0, # Semi-major axis (meters)
+    'f': 1 / 298.257222101, # Flattening
+    'lat_1': 34.0, # First standard parallel
+    'lat_2': 40.5, # Second standard parallel
+    'lat_0': 0.0, # Latitude of origin
+    'lon_0': -120.0, # Central meridian
+    'x_0': 0.0, # False easting
+    'y_0': -4000000.0 # False northing
+}
+
+# Maximum number of point/edge pairs that are compared at once. Larger batches are faster but use more memory (about 50 bytes per pair)
+max_batch_pairs = 2 ** 22
+
+# Function used for calculating q, a term of the Albers equal area projection formulas (Snyder, Map Projections - A Working Manual, p. 101)
+def albers_q(sin_lat, e):
+    return (1 - e ** 2) * (sin_lat / (1 - (e * sin_lat) ** 2) - (1 / (2 * e)) * np.log((1 - e * sin_lat) / (1 + e * sin_lat)))
+
+# Function for projecting longitude and latitude (decimal degrees) to x and y (meters) with the Albers equal area projection. Uses the EPSG:3310 parameters by default
+def project_albers(lon, lat, params=albers_params):
+    a = params['a']
+    e = np.sqrt(2 * params['f'] - params['f'] ** 2)
+    sin_lat_1 = np.sin(np.radians(params['lat_1']))
+    sin_lat_2 = np.sin(np.radians(params['lat_2']))
+    m_1 = np.cos(np.radians(params['lat_1'])) / np.sqrt(1 - (e * sin_lat_1) ** 2)
+    m_2 = np.cos(np.radians(params['lat_2'])) / np.sqrt(1 - (e * sin_lat_2) ** 2)
+    q_0 = albers_q(np.sin(np.radians(params['lat_0'])), e)
+    q_1 = albers_q(sin_lat_1, e)
+    q_2 = albers_q(sin_lat_2, e)
+    n = (m_1 ** 2 - m_2 ** 2) / (q_2 - q_1)
+    c = m_1 ** 2 + n * q_1
+    rho_0 = a * np.sqrt(c - n * q_0) / n
+
+    q = albers_q(np.sin(np.radians(np.asarray(lat, dtype='float64'))), e)
+    rho = a * np.sqrt(c - n * q) / n
+    theta = n * np.radians(np.asarray(lon, dtype='float64') - params['lon_0'])
+    x = rho * np.sin(theta) + params['x_0']
+    y = rho_0 - rho * np.cos(theta) + params['y_0']
+    return x, y
+
+# Function for loading the regions from a geojson file of polygon or multipolygon features. The region value of each feature is taken from the given property (ex. 'rb'). Returns a list of regions, each with the region value, its bounding box, and the edges of all of its rings (outer boundaries and holes) in EPSG:3310 coordinates
+def load_regions(path, value_property='rb'):
+    with open(path) as f:
+        features = json.load(f)['features']
+
+    regions = []
+    for feature in features:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        starts, ends = [], []
+        for polygon in polygons:
+            for ring in polygon:
+                ring = np.asarray(ring, dtype='float64')[:, :2]
+                x, y = project_albers(ring[:, 0], ring[:, 1])
+                points = np.column_stack([x, y])
+                # Each ring is closed (the last point is the same as the first), so each point and the next point make an edge
+                starts.append(points[:-1])
+                ends.append(points[1:])
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        regions.append({
+            'value': feature['properties'][value_property],
+            'bbox': (starts[:, 0].min(), starts[:, 1].min(), starts[:, 0].max(), starts[:, 1].max()),
+            'starts': starts,
+            'ends': ends
+        })
+    return regions
+
+# Function for splitting a number of edges into batches so that each batch compares at most max_batch_pairs point/edge pairs
+def get_edge_batches(n_points, n_edges):
+    batch_size = max(max_batch_pairs // max(n_points, 1), 1)
+    return [slice(i, i + batch_size) for i in range(0, n_edges, batch_size)]
+
+# Function for checking which points are inside a region. Uses the ray casting (even-odd) rule: a point is inside if a ray from the point crosses the region's edges an odd number of times. Holes are handled by the same rule
+def contains_points(region, x, y):
+    inside = np.zeros(len(x), dtype=bool)
+    # Only check the points within the region's bounding box
+    min_x, min_y, max_x, max_y = region['bbox']
+    candidates = np.flatnonzero((x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y))
+    if len(candidates) == 0:
+        return inside
+
+    px = x[candidates][:, None]
+    py = y[candidates][:, None]
+    crossings = np.zeros(len(candidates), dtype=bool)
+    for batch in get_edge_batches(len(candidates), len(region['starts'])):
+        x1, y1 = region['starts'][batch, 0], region['starts'][batch, 1]
+        x2, y2 = region['ends'][batch, 0], region['ends'][batch, 1]
+        # The edge crosses the horizontal line through the point, and the crossing is to the right of the point
+        spans = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        crossings ^= (np.count_nonzero(spans & (px < x_cross), axis=1) % 2).astype(bool)
+    inside[candidates] = crossings
+    return inside
+
+# Function for calculating the distance from each point to the nearest edge of a region
+def get_distances(region, x, y):
+    px = x[:, None]
+    py = y[:, None]
+    distances = np.full(len(x), np.inf)
+    for batch in get_edge_batches(len(x), len(region['starts'])):
+        x1, y1 = region['starts'][batch, 0], region['starts'][batch, 1]
+        dx = region['ends'][batch, 0] - x1
+        dy = region['ends'][batch, 1] - y1
+        length_squared = dx ** 2 + dy ** 2
+        # Position of the closest point on each edge, as a fraction of the edge length (0 = start of the edge, 1 = end of the edge)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(((px - x1) * dx + (py - y1) * dy) / length_squared, 0, 1)
+        t = np.nan_to_num(t) # Edges with a length of 0
+        distances = np.minimum(distances, np.hypot(px - (x1 + t * dx), py - (y1 + t * dy)).min(axis=1))
+    return distances
+
+# Function for finding the region value of each point (longitude and latitude in decimal degrees). Points inside a region get the value of the first region that contains them. Points outside of all regions (ex. points slightly outside of the border) get the value of the nearest region
+def get_region_values(regions, lon, lat):
+    x, y = project_albers(lon, lat)
+    values = np.array([region['value'] for region in regions], dtype=object)
+    region_index = np.full(len(x), -1)
+    for i, region in enumerate(regions):
+        unassigned = region_index == -1
+        inside = np.zeros(len(x), dtype=bool)
+        inside[unassigned] = contains_points(region, x[unassigned], y[unassigned])
+        region_index[inside] = i
+
+    missing = np.flatnonzero(region_index == -1)
+    if len(missing) > 0:
+        distances = np.column_stack([get_distances(region, x[missing], y[missing]) for region in regions])
+        region_index[missing] = distances.argmin(axis=1)
+    return values[region_index]
@@ -0,0 +1,127 @@
+'''
+Functions for getting the data of the download scripts from a data source (see p_constants.source). The download scripts send the same SQL queries to every source, so the scripts can be run (and timed) without access to the CEDEN data marts:
+
+--- datamart: the CEDEN data marts. Requires pyodbc and the SERVER1, UID, and PWD environment variables
+--- local: a local SQLite database with tables of the same names as the data mart tables (ex. WQDMart_MV). SQLite supports the queries used by the download scripts (SELECT, WHERE, IN, IS NOT NULL, !=). Note: text comparisons are case-sensitive in SQLite and not in the data marts
+--- record: the CEDEN data marts, and the result of each query is also saved to the source cache
+--- replay: the query results saved to the source cache. A query that was not recorded raises an error
+
+Each query result in the source cache is a zstd-compressed parquet file named by a hash of the normalized SQL (whitespace collapsed and keywords in upper case outside of the quoted text values, without the final semicolon) and the query parameters, so queries that only differ in formatting use the same result. The normalized SQL and parameters are saved in the file and checked when the result is read
+
+To load a local database from CSV files (ex. test files with the columns of the data mart tables), run: python p_source.py load <table name> <CSV file> [--db <database path>]
+To load a local database with synthetic data, run: python generate_data.py --rows 100000 --source-db <database path> (in the benchmark folder)
+'''
+
+import argparse
+from contextlib import closing
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import re
+import sqlite3
+import p_constants # p_constants.py
+
+
+# Data sources (see p_constants.source)
+sources = ['datamart', 'local', 'record', 'replay']
+
+# Pattern of the quoted text values in a SQL query (ex. 'Surface Water Ambient Monitoring Program'). Quotes inside a value are doubled
+sql_text_pattern = re.compile(r"('(?:[^']|'')*')")
+
+
+# Function for normalizing a SQL query: whitespace is collapsed and the query is put in upper case, except for the quoted text values. The final semicolon is removed
+def normalize_sql(sql):
+    parts = sql_text_pattern.split(sql)
+    parts = [part if (i % 2) else re.sub(r'\s+', ' ', part).upper() for i, part in enumerate(parts)]
+    return ''.join(parts).strip().rstrip(';').strip()
+
+# Function for getting the cache key of a query: the normalized SQL, and the parameters (if any) on a second line
+def get_cache_key(sql, params=None):
+    return normalize_sql(sql) + ('\n' + json.dumps(list(params), default=str) if params else '')
+
+# Function for getting the path of the cached result of a query
+def get_cache_path(sql, params=None, cache_dir=p_constants.source_cache_dir):
+    sql_hash = hashlib.sha256(get_cache_key(sql, params).encode('utf-8')).hexdigest()[:24]
+    return os.path.join(cache_dir, '%s.parquet' % sql_hash)
+
+# Function for connecting to the CEDEN data marts
+def connect_datamart():
+    import pyodbc
+    return pyodbc.connect(Driver='SQL Server', Server=p_constants.SERVER1, uid=p_constants.UID, pwd=p_constants.PWD)
+
+# Function for connecting to the local database. Raises an error if the database does not exist (instead of creating an empty database)
+def connect_local(db_path=p_constants.source_db):
+    if not os.path.exists(db_path):
+        raise FileNotFoundError('Local source database %s does not exist (see p_source.py)' % db_path)
+    return sqlite3.connect(db_path)
+
+# Function for saving the result of a query to the source cache
+def write_cache(df, sql, params=None, cache_dir=p_constants.source_cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_cache_path(sql, params, cache_dir)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'swamp_sql': get_cache_key(sql, params).encode('utf-8')})
+    # Write to a temporary file first, so an interrupted run does not leave a partial result in the cache
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+    return path
+
+# Function for reading the result of a query from the source cache. Raises an error if the query was not recorded
+def read_cache(sql, params=None, cache_dir=p_constants.source_cache_dir):
+    path = get_cache_path(sql, params, cache_dir)
+    if not os.path.exists(path):
+        raise FileNotFoundError('No recorded result for the query in %s. Run the download script with SWAMP_SOURCE=record first. Query: %s' % (cache_dir, normalize_sql(sql)))
+    table = pq.read_table(path)
+    if table.schema.metadata.get(b'swamp_sql', b'').decode('utf-8') != get_cache_key(sql, params):
+        raise ValueError('The recorded result in %s is for a different query' % path)
+    return table.to_pandas()
+
+# Function for getting the result of a query as a Pandas dataframe from the data source (p_constants.source by default). The query parameters (params) replace the ? placeholders of the query (see p_query.py). The date columns are converted to dates
+def read_sql(sql, date_cols=None, source=None, params=None):
+    source = source or p_constants.source
+    if source not in sources:
+        raise ValueError('Unknown data source: %s (SWAMP_SOURCE must be one of: %s)' % (source, ', '.join(sources)))
+    if source == 'replay':
+        return read_cache(sql, params)
+    if source == 'local':
+        with closing(connect_local()) as cnxn:
+            return pd.read_sql(sql, cnxn, parse_dates=date_cols, params=params)
+    cnxn = connect_datamart()
+    df = pd.read_sql(sql, cnxn, parse_dates=date_cols, params=params)
+    if source == 'record':
+        write_cache(df, sql, params)
+    return df
+
+# Function for getting the name of the data source, used in the messages of the download scripts
+def get_source_name(source=None):
+    source = source or p_constants.source
+    if source == 'local':
+        return p_constants.source_db
+    if source == 'replay':
+        return p_constants.source_cache_dir
+    return p_constants.SERVER1
+
+# Function for writing a table to the local database, one dataframe (chunk of rows) at a time. An existing table with the same name is replaced
+def write_local_table(table, chunks, db_path=p_constants.source_db):
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    with closing(sqlite3.connect(db_path)) as cnxn:
+        for i, chunk_df in enumerate(chunks):
+            chunk_df.to_sql(table, cnxn, if_exists='append' if i else 'replace', index=False, chunksize=50000)
+        cnxn.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load a table of the local source database from a CSV file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load_parser = subparsers.add_parser('load', help='Load a CSV file as a table of the local database (replaces the table if it exists)')
+    load_parser.add_argument('table', help='Table name (ex. WQDMart_MV, see p_constants.datamart_tables)')
+    load_parser.add_argument('csv', help='CSV file with the columns of the table')
+    load_parser.add_argument('--db', default=p_constants.source_db, help='Local database path')
+    args = parser.parse_args()
+
+    print('--- Loading %s into %s' % (args.csv, args.table))
+    write_local_table(args.table, pd.read_csv(args.csv, chunksize=500000, low_memory=False), args.db)
@@ -2,20 +2,26 @@
 Shared functions used across multiple (or all) scripts
 '''
 
+import datetime
+import hashlib
+import numpy as np
 import os
 import pandas as pd
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import p_constants # p_constants.py
+import p_source # p_source.py
 
 
-# Function for downloading data as a Pandas dataframe
-def download_data(sql, date_cols):
-    import pyodbc
+# Function for downloading data as a Pandas dataframe from the data source (the CEDEN data marts by default, see p_source.py). The query parameters (params) replace the ? placeholders of the query (see p_query.get_download_query). If a data type is given, the column schema for that data type is applied to the downloaded data (see apply_schema)
+def download_data(sql, date_cols, data_type=None, params=None):
     try:
-        cnxn = pyodbc.connect(Driver='SQL Server', Server=p_constants.SERVER1, uid=p_constants.UID, pwd=p_constants.PWD)
-        df = pd.read_sql(sql, cnxn, parse_dates=date_cols)
+        df = p_source.read_sql(sql, date_cols, params=params)
+        if (data_type):
+            df = apply_schema(df, data_type)
         return df
-    except:
-        print("Couldn't connect to %s." % p_constants.SERVER1)
+    except Exception as e:
+        print("Couldn't get data from %s: %s" % (p_source.get_source_name(), e))
 
 # This function checks whether or not a row in a pandas df qualifies as a non-detect result and returns 3 values in an array based on that evaluation:
 #   1. The result value to be used in the dashboard (the original value in the Result field, if present. Otherwise, an adjusted value of 1/2 MDL)
@@ -59,6 +65,43 @@ def get_censored_result(row):
         return pd.Series([row['Result'], False])
 '''
 
+# Function for applying the column schema of a data type (defined in p_constants.schemas) to a dataframe. Categorical fields are converted to the category type, and numeric and date fields are converted to numbers and dates. Fields in the schema that are not in the dataframe are skipped
+def apply_schema(df, data_type):
+    schema = p_constants.schemas[data_type]
+    for col in schema['category']:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in schema['numeric']:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in schema['date']:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+# Function for getting the dtype argument for pd.read_csv from the column schema of a data type. Reading the categorical fields directly as categories avoids creating a string object for every value in the file
+def get_schema_dtypes(data_type):
+    return {col: 'category' for col in p_constants.schemas[data_type]['category']}
+
+# Function for adding a new value to the categories of a categorical column. Categorical columns only accept values that are already one of the categories, so this must be done before assigning a new value. Other column types are returned unchanged
+def add_category(series, value):
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series
+
+# Function for filling empty values in a column with a text value. Works on both text and categorical columns
+def fill_missing(series, value):
+    return add_category(series, value).fillna(value)
+
+# Function for matching the key column of a lookup table (ex. station regions) to the categorical key column of the data before the two are merged. If the key columns have different types, pandas converts the merged key back to an object column and the join is slower. Lookup rows with a key that is not one of the categories could not be matched by the join anyway, so they are dropped here. Otherwise they would become null keys and match the records with a null key
+def match_categories(lookup, col, dtype):
+    if not isinstance(dtype, pd.CategoricalDtype):
+        return lookup
+    lookup = lookup.copy()
+    is_null = lookup[col].isna()
+    lookup[col] = lookup[col].astype(dtype)
+    return lookup[is_null | lookup[col].notna()]
+
 # Function used for standardizing the matrix name
 # Ex. some values have 'samplewater' in them but have extra letters or words. Need all of them to say 'samplewater'. Only concerned about 'samplewater' and 'sediment' for now but may need to add more later
 def get_matrix_name(matrix):
@@ -69,30 +112,363 @@ def get_matrix_name(matrix):
     else:
         return matrix
     
-# Function for importing a local CSV file as a Pandas DF
-def import_csv(path, fields=None, date_cols=None):
-    if (fields):
-        df = pd.read_csv(path, usecols=fields, parse_dates=date_cols)
+# Function for importing a CSV file with the given CSV engine ('pandas' or 'pyarrow', defaults to p_constants.csv_engine). Any other pd.read_csv arguments (parse_dates, dtype, na_values, etc.) are passed through
+# The pyarrow engine does not support the low_memory argument, so it is removed. If the file cannot be imported with the pyarrow engine (ex. pyarrow is not installed or an argument is not supported), the pandas engine is used instead
+def read_csv(path, engine=None, **read_args):
+    engine = engine or p_constants.csv_engine
+    if engine == 'pyarrow':
+        arrow_args = {key: value for key, value in read_args.items() if key != 'low_memory'}
+        try:
+            df = pd.read_csv(path, engine='pyarrow', **arrow_args)
+            return restore_text_columns(df, path, read_args)
+        except (ImportError, ValueError) as e:
+            print('--- Could not import %s with the pyarrow engine, using the pandas engine instead: %s' % (path, e))
+    return pd.read_csv(path, **read_args)
+
+# Function for checking if a column imported with the pyarrow engine was converted to dates or times. pyarrow converts any column of ISO dates or times (ex. 2024-12-30, 2024-12-30T00:00:00, 12:30:00) even if it is not in parse_dates. Dates are stored as datetime64 values, or as datetime.date and datetime.time objects in an object column. For categorical columns, the categories are checked
+def is_inferred_date(series):
+    values = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return True
+    first = values.dropna()[:1].tolist()
+    return (values.dtype == object) and (len(first) > 0) and isinstance(first[0], (datetime.date, datetime.time))
+
+# Function for importing the columns that the pyarrow engine converted to dates or times but are not in parse_dates (see is_inferred_date) again as text with the pandas engine, so they have the same values as when the file is imported with the pandas engine. Otherwise, a text column like LastSampleDate (2024-12-30T00:00:00) would be written back to the file in a different format (2024-12-30)
+# The missing values (na_values, keep_default_na) and categorical columns (dtype) of the original import are kept
+def restore_text_columns(df, path, read_args):
+    date_cols = read_args.get('parse_dates') or []
+    text_cols = [col for col in df.columns if (col not in date_cols) and is_inferred_date(df[col])]
+    if not text_cols:
         return df
+    dtype = read_args.get('dtype')
+    text_dtypes = {col: (dtype.get(col, str) if isinstance(dtype, dict) else (dtype or str)) for col in text_cols}
+    na_args = {key: value for key, value in read_args.items() if key in ['na_values', 'keep_default_na']}
+    text_df = pd.read_csv(path, usecols=text_cols, dtype=text_dtypes, **na_args)
+    for col in text_cols:
+        df[col] = text_df[col]
+    return df
+
+# Function for importing a local CSV file as a Pandas DF. If a data type is given, the column schema for that data type is applied (see apply_schema)
+def import_csv(path, fields=None, date_cols=None, data_type=None, engine=None):
+    dtypes = get_schema_dtypes(data_type) if data_type else None
+    if (fields):
+        df = read_csv(path, engine=engine, usecols=fields, parse_dates=date_cols, dtype=dtypes)
     else:
-        df = pd.read_csv(path, parse_dates=date_cols)
-        return df
+        df = read_csv(path, engine=engine, parse_dates=date_cols, dtype=dtypes)
+    if (data_type):
+        df = apply_schema(df, data_type)
+    return df
+
+# Function for getting the column names of a CSV file from its header, without importing any rows
+def get_file_columns(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+# Function for checking that a list of columns (ex. the columns of a dataframe or the header of a file) has all of the columns required by a stage (see p_constants.column_manifests). Raises a ValueError that lists the missing columns
+def check_columns(columns, stage, source='the data'):
+    missing = [col for col in p_constants.column_manifests[stage]['requires'] if col not in columns]
+    if missing:
+        raise ValueError('%s is missing the columns required by the %s stage: %s' % (source, stage, ', '.join(missing)))
+    return columns
+
+# Function for checking the header of a CSV file before it is imported (see check_columns). Returns the column names of the file
+def check_file_columns(path, stage):
+    return check_columns(get_file_columns(path), stage, path)
+
+# Function for getting the columns used by a stage (the required and optional columns, see p_constants.column_manifests) from the available columns, in the order of the available columns. Raises an error if a required column is missing
+def get_used_columns(stage, columns):
+    manifest = p_constants.column_manifests[stage]
+    check_columns(columns, stage)
+    used = set(manifest['requires'] + manifest['optional'])
+    return [col for col in columns if col in used]
+
+# Function for getting the columns a stage needs from the available columns: the columns used by the stage (see get_used_columns), plus the columns it carries to its output. The result can be used as the usecols argument of read_csv or to select the columns of a dataframe
+def get_stage_columns(stage, columns):
+    manifest = p_constants.column_manifests[stage]
+    if manifest['carries'] == 'all':
+        check_columns(columns, stage)
+        return list(columns)
+    keep = set(get_used_columns(stage, columns) + manifest['carries'])
+    return [col for col in columns if col in keep]
+
+# Function for importing the columns of a CSV file used by a stage (see get_stage_columns). The header is checked first, so a missing required column raises an error before the file is imported. Date columns that are not used by the stage are not parsed. Any other pd.read_csv arguments are passed through
+def import_stage_columns(path, stage, engine=None, parse_dates=None, **read_args):
+    usecols = get_stage_columns(stage, check_file_columns(path, stage))
+    parse_dates = [col for col in (parse_dates or []) if col in usecols]
+    return read_csv(path, engine=engine, usecols=usecols, parse_dates=parse_dates, **read_args)
+
+# Function for estimating how many rows of a CSV file can be held in memory at a time within a memory budget (in MB). A sample of rows is imported to measure the size of one row in memory. The size is multiplied by working_factor because the processing steps make temporary copies of the data
+def get_chunk_rows(path, memory_budget_mb, working_factor=4, sample_rows=10000, **read_args):
+    sample_df = pd.read_csv(path, nrows=sample_rows, **read_args)
+    row_bytes = sample_df.memory_usage(index=True, deep=True).sum() / max(len(sample_df), 1)
+    return max(int((memory_budget_mb * 1024 * 1024) / (row_bytes * working_factor)), 1)
+
+# Function for combining the column types that pandas inferred for the chunks of a file into the type it would infer for the whole file. Whole numbers are imported as integers, unless some values are missing or are decimals (then all of the values are floats). Any other mix of types (ex. numbers and text, or true/false values and missing values) is imported as text
+def combine_dtypes(dtypes):
+    dtypes = set(str(dtype) for dtype in dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if dtypes <= {'int64', 'float64'}:
+        return 'float64'
+    return 'object'
+
+# Function for getting the column types of a CSV file before it is imported in chunks. pandas infers the type of each column from the rows it imports, so a column can get a different type in each chunk and be written differently in each chunk (ex. a column of whole numbers is written as 1 in a chunk with no missing values and as 1.0 in a chunk with missing values)
+# The file is scanned once in chunks, and the types of the chunks are combined (see combine_dtypes). Only the columns that do not have a type in dtype or parse_dates are scanned. Returns the dtype argument for pd.read_csv, with the types of all of the columns
+def get_chunk_dtypes(path, chunk_rows, **read_args):
+    dtype = dict(read_args.get('dtype') or {})
+    date_cols = read_args.get('parse_dates') or []
+    columns = read_args.get('usecols') or get_file_columns(path)
+    scan_cols = [col for col in columns if (col not in dtype) and (col not in date_cols)]
+    if scan_cols:
+        scan_args = {key: value for key, value in read_args.items() if key in ['na_values', 'keep_default_na']}
+        chunk_dtypes = {col: [] for col in scan_cols}
+        with pd.read_csv(path, usecols=scan_cols, chunksize=chunk_rows, **scan_args) as reader:
+            for chunk_df in reader:
+                for col in scan_cols:
+                    chunk_dtypes[col].append(chunk_df[col].dtype)
+        dtype.update({col: combine_dtypes(dtypes) for col, dtypes in chunk_dtypes.items()})
+    return dtype
+
+# Function for importing a local CSV file in chunks that fit within a memory budget (in MB). Returns an iterator of dataframes. Any other pd.read_csv arguments (parse_dates, dtype, etc.) are passed through
+# Every chunk is imported with the same column types (see get_chunk_dtypes), so the chunks are written the same way as the whole file
+def import_csv_chunks(path, memory_budget_mb, **read_args):
+    chunk_rows = get_chunk_rows(path, memory_budget_mb, **read_args)
+    read_args = dict(read_args, dtype=get_chunk_dtypes(path, chunk_rows, **read_args))
+    with pd.read_csv(path, chunksize=chunk_rows, **read_args) as reader:
+        for chunk_df in reader:
+            yield chunk_df
 
 # Function for joining datum to the CEDEN data structure
 def join_datum(data, sites):
+    sites = match_categories(sites, 'StationCode', data['StationCode'].dtype) # Keep the StationCode column categorical after the join
     df = pd.merge(data, sites, on='StationCode', how='left') # Left join on StationCode
     df = df.fillna(value={'Datum': 'NR'}) # Fill empty datum values with 'NR'
     return df
 
+# Function for replacing a regex pattern in a text or categorical column. For categorical columns, the replacement is done once on the categories instead of on every value, and the column stays categorical (replacing the values directly fails when a replaced value is not one of the categories)
+def replace_pattern(series, pattern, value):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        if categories.dtype == object:
+            replaced = categories.str.replace(pattern, value, regex=True)
+            if (replaced != categories).any():
+                return series.map(dict(zip(categories, replaced))).astype('category')
+        return series
+    return series.replace(pattern, value, regex=True)
+
+# Function for replacing special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, and quotes) with a space in all of the text columns of a dataframe. For categorical columns, the replacement is done once on the categories instead of on every value
+def strip_special_characters(df):
+    pattern = r'[\t\r\n\f\v|"]'
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = replace_pattern(df[col], pattern, ' ')
+    text_cols = df.select_dtypes(include='object').columns
+    if len(text_cols) > 0:
+        df[text_cols] = df[text_cols].replace(pattern, ' ', regex=True)
+    return df
+
+# Function for getting the SHA-256 hash of a file's contents. Used to check if an input file (ex. the RB boundaries layer) has changed since a cached result was saved
+def get_file_hash(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+# Function for getting the most recent record for each station. The most recent record of a set of most recent records is the same as the most recent record overall, so this function can also be run on results that were already reduced (ex. chunks, or the station indexes of several data types)
+def get_latest_records(df):
+    # Sort by sample date descending. We want the most recent date for each station
+    df = df.sort_values('SampleDate', ascending=False)
+
+    # Remove duplicate records using Station Code. The keep option will keep the first duplicate record found (the one with the most recent sample date) and drop the others
+    return df.drop_duplicates(subset=['StationCode'], keep='first')
+
+# Function for creating the station index of a data quality dataset: one row per station with the most recent SampleDate, the StationName and coordinates on that date, and the number of records in each data quality category. The sites step combines the station indexes of the data types (see p_constants.station_index_types) to find the LastSampleDate of each station, so the same records that the sites step uses are selected here
+def get_station_index(df):
+    # The coordinates are numbers after p_utils_dq.clean_data. Convert them in case they were imported from a file where the missing coordinates are written as 'NaN' text
+    df = df.assign(
+        TargetLatitude=pd.to_numeric(df['TargetLatitude'], errors='coerce'),
+        TargetLongitude=pd.to_numeric(df['TargetLongitude'], errors='coerce')
+    )
+
+    # Filter for data quality categories, drop FieldQA station code, and drop stations with null latitude or longitude coordinates
+    df = df[
+        (df['DataQuality'].isin(p_constants.dq_categories)) & 
+        (df['StationCode'] != 'FIELDQA_SWAMP') & 
+        (df['TargetLatitude'].notna()) & 
+        (df['TargetLongitude'].notna())
+    ]
+    df = df[['StationCode', 'StationName', 'TargetLatitude', 'TargetLongitude', 'SampleDate', 'DataQuality']].astype({'StationCode': object, 'StationName': object, 'DataQuality': object})
+
+    # Count the records in each data quality category
+    counts = df.groupby(['StationCode', 'DataQuality']).size().unstack(fill_value=0).reindex(columns=p_constants.dq_categories, fill_value=0)
+    index_df = get_latest_records(df.drop('DataQuality', axis=1))
+    return pd.merge(index_df, counts, how='left', left_on='StationCode', right_index=True)
+
+# Function for combining station indexes that were created from separate parts of the same dataset (ex. chunks). The record counts are added together and the most recent record is kept for each station
+def combine_station_indexes(index_dfs):
+    index_df = pd.concat(index_dfs, ignore_index=True)
+    counts = index_df.groupby('StationCode')[p_constants.dq_categories].sum()
+    index_df = get_latest_records(index_df.drop(p_constants.dq_categories, axis=1))
+    return pd.merge(index_df, counts, how='left', left_on='StationCode', right_index=True)
+
+# Function for summarizing an exported dataset for each station, analyte, matrix, and unit (see p_constants.station_summaries): the number of records (Count), the number of censored records (CensoredCount), the min, max, and median of the value column, the value and date of the most recent record (LatestValue, LatestDate), and the first and last year with records (FirstYear, LastYear). Only the records in the data quality categories used by the dashboard are summarized (see p_constants.dq_categories)
+def get_station_summary(df, value_col, date_col, year_col=None):
+    group_cols = p_constants.station_summary_group_cols
+    df = df[df['DataQuality'].isin(p_constants.dq_categories)]
+    df = df.assign(
+        Value=pd.to_numeric(df[value_col], errors='coerce'),
+        Year=df[year_col] if year_col else df[date_col].dt.year,
+        IsCensored=(df['Censored'] == True)
+    )
+    groups = df.groupby(group_cols, dropna=False, sort=True, observed=True)
+    summary_df = groups.agg(
+        Count=('Value', 'size'),
+        CensoredCount=('IsCensored', 'sum'),
+        Min=('Value', 'min'),
+        Max=('Value', 'max'),
+        Median=('Value', 'median'),
+        FirstYear=('Year', 'min'),
+        LastYear=('Year', 'max')
+    ).reset_index()
+
+    # Find the most recent record of each group: sort the records by group and date (records with the same date stay in file order) and take the last record of each group. The groups are numbered in the same order as the summary rows
+    group_ids = groups.ngroup().to_numpy()
+    dates = df[date_col].to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((dates.view('int64'), group_ids))
+    last_rows = order[np.r_[group_ids[order][1:] != group_ids[order][:-1], True]] if len(order) else order
+    summary_df['LatestValue'] = df['Value'].to_numpy()[last_rows]
+    summary_df['LatestDate'] = dates[last_rows]
+    summary_df[['FirstYear', 'LastYear']] = summary_df[['FirstYear', 'LastYear']].astype('Int64')
+    return summary_df[group_cols + ['Count', 'CensoredCount', 'Min', 'Max', 'Median', 'LatestValue', 'LatestDate', 'FirstYear', 'LastYear']]
+
 # Function for printing a space and line between messages in console (for better readability)
 def print_spacer():
     print('')
     print(u'\u2500' * 15) # Print horizontal line
     
+# Number of rows converted to CSV text at a time by the pyarrow engine. The batches are converted on multiple threads
+csv_batch_rows = 100000
+
+# Function for getting the format pandas to_csv uses for a date column: YYYY-MM-DD if none of the values have a time, otherwise YYYY-MM-DD HH:MM:SS
+def get_csv_date_format(series):
+    if (series.dt.nanosecond.any()) or (series.dt.microsecond.any()):
+        raise NotImplementedError('Dates with fractions of a second are not supported')
+    if (series.dt.hour.any()) or (series.dt.minute.any()) or (series.dt.second.any()):
+        return '%Y-%m-%d %H:%M:%S'
+    return '%Y-%m-%d'
+
+# Function for converting the values of a column to CSV text with pyarrow, using the same formatting as pandas to_csv: floats use the shortest text that reads back as the same number (ex. 1.0, 1e-05), dates are written as YYYY-MM-DD (or YYYY-MM-DD HH:MM:SS if any value has a time), booleans are written as True/False, and missing values are written as na_text (empty text by default). Values that contain a comma, quote, or line break are quoted
+def format_csv_values(series, date_format=None, na_text=''):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Format the categories once and look up the text of each value
+        categories = format_csv_values(pd.Series(series.cat.categories))
+        codes = series.cat.codes.to_numpy()
+        return pc.fill_null(categories.take(pa.array(codes, mask=(codes == -1))), '')
+
+    mask = series.isna().to_numpy()
+    if pd.api.types.is_datetime64_dtype(dtype):
+        values = pc.strftime(pa.array(series).cast(pa.timestamp('s')), format=date_format or get_csv_date_format(series))
+    elif pd.api.types.is_float_dtype(dtype) and isinstance(dtype, np.dtype):
+        values = pa.array(series.to_numpy().astype(str), mask=mask)
+    elif pd.api.types.is_bool_dtype(dtype) and isinstance(dtype, np.dtype):
+        values = pa.array(np.where(series.to_numpy(), 'True', 'False'))
+    elif pd.api.types.is_integer_dtype(dtype):
+        values = pa.array(series).cast(pa.string())
+    elif dtype == object:
+        values = pa.array(series.where(~mask, None).map(str, na_action='ignore'), type=pa.string())
+    else:
+        raise NotImplementedError('Columns of type %s are not supported' % dtype)
+
+    # Quote the values that contain a delimiter, quote, or line break. Quotes inside the value are doubled
+    needs_quotes = pc.match_substring_regex(values, '[,"\r\n]')
+    quoted = pc.binary_join_element_wise('"', pc.replace_substring(values, '"', '""'), '"', '')
+    return pc.fill_null(pc.if_else(needs_quotes, quoted, values), na_text)
+
+# Function for converting a batch of rows to CSV text with pyarrow. Returns the UTF-8 bytes of the lines, each ending with the line separator used by pandas (os.linesep). Date formats and missing value texts are given for each column (see get_csv_date_format and write_csv)
+def format_csv_batch(df, date_formats=None, na_texts=None):
+    import pyarrow.compute as pc
+    date_formats = date_formats or {}
+    na_texts = na_texts or {}
+    columns = [format_csv_values(df.iloc[:, i], date_formats.get(i), na_texts.get(i, '')) for i in range(df.shape[1])]
+    lines = pc.binary_join_element_wise(*columns, ',') if len(columns) > 1 else columns[0]
+    lines = pc.binary_join_element_wise(lines, '', os.linesep)
+    # The text of all of the lines is stored back to back in the data buffer of the string array
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)[lines.offset:lines.offset + len(lines) + 1]
+    data = lines.buffers()[2]
+    return data.to_pybytes()[offsets[0]:offsets[-1]] if (data is not None) and (len(lines) > 0) else b''
+
+# Function for writing a dataframe to a CSV file with the pyarrow engine. The file matches the one written by pandas to_csv(index=False)
+def to_csv_pyarrow(df, file_path, header=True, mode='w', encoding='utf-8-sig', nan_text_cols=None):
+    batches = [df.iloc[i:i + csv_batch_rows] for i in range(0, len(df), csv_batch_rows)]
+    # The date format depends on all of the values in the column, so it is chosen before the column is split into batches
+    date_formats = {i: get_csv_date_format(df.iloc[:, i]) for i in range(df.shape[1]) if pd.api.types.is_datetime64_dtype(df.dtypes.iloc[i])}
+    na_texts = {i: 'NaN' for i, col in enumerate(df.columns) if col in (nan_text_cols or [])}
+    with open(file_path, mode + 'b') as f:
+        if encoding == 'utf-8-sig':
+            f.write(b'\xef\xbb\xbf')
+        if header:
+            f.write(format_csv_batch(pd.DataFrame([[str(col) for col in df.columns]], columns=df.columns)))
+        with ThreadPoolExecutor() as executor:
+            for lines in executor.map(lambda batch: format_csv_batch(batch, date_formats, na_texts), batches):
+                f.write(lines)
+
+# Function for writing a dataframe to a CSV file with the given CSV engine ('pandas' or 'pyarrow', defaults to p_constants.csv_engine). If the dataframe cannot be written with the pyarrow engine, the pandas engine is used instead
+# The missing values of the nan_text_cols columns are written as "NaN" text instead of empty text
+def to_csv(df, file_path, engine=None, header=True, mode='w', encoding='utf-8-sig', nan_text_cols=None):
+    engine = engine or p_constants.csv_engine
+    if engine == 'pyarrow':
+        try:
+            return to_csv_pyarrow(df, file_path, header=header, mode=mode, encoding=encoding, nan_text_cols=nan_text_cols)
+        except (ImportError, NotImplementedError) as e:
+            print('--- Could not write %s with the pyarrow engine, using the pandas engine instead: %s' % (file_path, e))
+    nan_text_cols = [col for col in (nan_text_cols or []) if col in df.columns]
+    if nan_text_cols:
+        df = df.assign(**{col: df[col].astype(object).where(df[col].notna(), 'NaN') for col in nan_text_cols})
+    df.to_csv(file_path, index=False, header=header, mode=mode, encoding=encoding)
+
+# Function for getting the temporary file path used while writing a file. Files are written to a temporary file first and then renamed to the final file name, so a file is never left half-written if the script stops while writing
+def get_temp_path(file_path):
+    return '%s.%s.tmp' % (file_path, os.getpid())
+
 # Function for exporting a PD dataframe as a CSV file
-def write_csv(df, file_name, outdir):
-    # Create folder if it does not already exist
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
-    file_path = outdir + '/' + file_name + '.csv'
-    df.to_csv(file_path, index=False, encoding='utf-8-sig')
+# Use append=True to add the rows to the end of an existing file (chunked mode). The header and byte order mark are only written with the first chunk
+# Use copies to write the same file to other locations (ex. a dated folder in the export or CEDEN archive folder). copies is a list of (file_name, outdir) pairs. The dataframe is only converted to CSV once, and each copy is a hard link to the first file (or a byte copy if a hard link cannot be made, ex. the folders are on different drives). copies cannot be used with append=True, because the rows would be added to a hard-linked file once for each copy
+# Note: because the copies can be hard links, do not edit a written file in place. Files written by this function are replaced, not modified, so the other copies are not affected
+# Use engine to choose the CSV engine for this file ('pandas' or 'pyarrow', defaults to p_constants.csv_engine)
+# Use nan_text_cols to write the missing values of these numeric columns as "NaN" text (see p_constants.nan_text_cols)
+def write_csv(df, file_name, outdir, append=False, copies=None, engine=None, nan_text_cols=None):
+    if append and copies:
+        raise ValueError('write_csv cannot append to copies of %s. Append to the file, then write the copies' % file_name)
+    destinations = [(file_name, outdir)] + (copies or [])
+    file_paths = []
+    for name, folder in destinations:
+        # Create folder if it does not already exist
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        file_paths.append(folder + '/' + name + '.csv')
+
+    if (append):
+        for file_path in file_paths:
+            to_csv(df, file_path, engine=engine, header=False, mode='a', encoding='utf-8', nan_text_cols=nan_text_cols)
+        return
+
+    temp_paths = [get_temp_path(file_paths[0])]
+    try:
+        to_csv(df, temp_paths[0], engine=engine, nan_text_cols=nan_text_cols)
+        for file_path in file_paths[1:]:
+            temp_path = get_temp_path(file_path)
+            temp_paths.append(temp_path)
+            try:
+                os.link(temp_paths[0], temp_path)
+            except OSError:
+                shutil.copyfile(temp_paths[0], temp_path)
+        for temp_path, file_path in zip(temp_paths, file_paths):
+            os.replace(temp_path, file_path)
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
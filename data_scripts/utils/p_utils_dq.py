@@ -1,317 +1,556 @@
+import json
+import numpy as np
+import os
+import pandas as pd
 import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-# DICTIONARIES
-# The following dictionaries refer to codes and their corresponding data quality value as determined by
-# Melissa Morris of SWRCB, Office of Information Management and Analysis. 
-# 0: QC record, 1: Passed QC, 2: Needs some review, 3: Spatial Accuracy Unknown, 4: Needs extensive review, 5: unknown data quality, 6: reject data record
-# (as of 1/22/18)
+import p_constants # p_constants.py
+import p_utils # p_utils.py
 
-# These codes not included in this dictionary and currently skipped over later in the script: VFIRL, ROQ, H6, BRK
+# DATA QUALITY RULES
+# The codes and their corresponding data quality scores were determined by Melissa Morris of SWRCB, Office of Information Management and Analysis (as of 1/22/18).
+# 0: QC record, 1: Passed QC, 2: Needs some review, 3: Spatial Accuracy Unknown, 4: Needs extensive review, 5: unknown data quality, 6: reject data record, 7: no rule matched the record (error in data)
+# The rules are saved in the rules file (p_constants.dq_rules_file), one rule per row, so the codes and scores can be updated without changing this script. To change the rules, save a new dated copy of the file and update p_constants.dq_rules_file. Columns:
+# --- Field: the field checked by the rule (ex. QACode). The column of the field can be different for each data type (see p_constants.dq_column_maps)
+# --- Rule: equals (the value is equal to Value), each_equals (the value is a comma-separated list of codes, ex. VRIL,FDP, and each code is checked separately), search (the value contains the Value regular expression), year_equals (the year of the date is Value), equals_positive_result (the value is equal to Value and the Result of the record is a number greater than 0)
+# --- Value, ValueType: the value compared, as 'text' or as a 'number' (ex. TargetLatitude -88). Text values do not match numbers, so the text replicate codes ("0" to "8") only match replicate columns that were imported as text
+# --- Code: the code shown in the DataQualityIndicator field. If empty, the value of the record is shown
+# --- Score: the data quality score of a record that matches the rule
+# The rules of a field are checked in the order of the file and the first rule that matches is used (ex. the search rule of StationCode is checked before the equals rules)
+
+# These codes not included in the rules and currently skipped over later in the script: VFIRL, ROQ, H6, BRK
 # Need to check with David, Melissa, Andrew?
-QA_Code_list = {"AWM": 1, "AY": 2, "BB": 2, "BBM": 2, "BCQ": 1, "BE": 2, "BH": 1, "BLM": 4, "BRKA": 2, "BS": 2,
-                    "BT": 6, "BV": 2, "BX": 4, "BY": 4, "BZ": 4, "BZ15": 2, "C": 1, "CE": 4, "CIN": 2, "CJ": 2, "CNP": 2,
-                    "CQA": 1, "CS": 2, "CSG": 2, "CT": 2, "CVH": 1, "CVHB": 4, "CVL": 1, "CVLB": 4, "CZM": 2, "D": 1,
-                    "DB": 2, "DBLOD": 2, "DBM": 2, "DF": 2, "DG": 1, "DO": 1, "DRM": 2, "DS": 1, "DT": 1, "ERV": 4, "EUM": 4,
-                    "EX": 4, "F": 2, "FCL": 2, "FDC": 2, "FDI": 2, "FDO": 6, "FDP": 2, "FDR": 1, "FDS": 1, "FEU": 6, "FIA": 6,
-                    "FIB": 4, "FIF": 6, "FIO": 4, "FIP": 4, "FIT": 2, "FIV": 6, "FLV": 2, "FNM": 6, "FO": 2, "FS": 6, "FTD": 6,
-                    "FTT": 6, "FUD": 6, "FX": 4, "GB": 2, "GBC": 4, "GC": 1, "GCA": 1, "GD": 1, "GN": 4, "GR": 4, "H": 2, "H22": 4,
-                    "H24": 4, "H8": 2, "HB": 2, "HD": 4, "HH": 2, "HNO2": 2, "HR": 1, "HS": 4, "HT": 1, "IE": 2, "IF": 2, "IL": 4,
-                    "ILM": 2, "ILN": 2, "ILO": 2, "IM": 2, "IP": 4, "IP5": 4, "IPMDL2": 4, "IPMDL3": 4, "IPRL": 4, "IS": 4,
-                    "IU": 4, "IZM": 2, "J": 2, "JA": 2, "JDL": 2, "LB": 2, "LC": 4, "LRGN": 6, "LRIL": 6, "LRIP": 6, "LRIU": 6,
-                    "LRJ": 6, "LRJA": 6, "LRM": 6, "LRQ": 6, "LST": 6, "M": 2, "MAL": 1, "MN": 4, "N": 2, "NAS": 2, "NBC": 2,
-                    "NC": 1, "NG": 1, "NMDL": 1, "None": 1, "NR": 5, "NRL": 1, "NTR": 1, "OA": 2, "OV": 2, "P": 4, "PG": 4,
-                    "PI": 4, "PJ": 1, "PJM": 1, "PJN": 1, "PP": 4, "PRM": 4, "Q": 4, "QAX": 1, "QG": 4, "R": 6, "RE": 1, "REL": 1,
-                    "RIP": 6, "RIU": 6, "RJ": 6, "RLST": 6, "RPV": 4, "RQ": 2, "RU": 4, "RY": 4, "SC": 1, "SCR": 2, "SLM": 1, "TA": 4,
-                    "TAC": 1, "TC": 4, "TCI": 4, "TCT": 4, "TD": 4, "TH": 4, "THS": 4, "TK": 4, "TL": 2, "TNC": 2, "TNS": 1, "TOQ": 4,
-                    "TP": 4, "TR": 6, "TS": 4, "TW": 2, "UF": 2, "UJ": 2, "UKM": 4, "ULM": 4, "UOL": 2, "VCQ": 2, "VQN": 2, "VC": 2,
-                    "VBB": 2, "VBS": 2, "VBY": 4, "VBZ": 4, "VBZ15": 2, "VCJ": 2, "VCO": 2, "VCR": 2, "VD": 1, "VDO": 1, "VDS": 1,
-                    "VELB": 1, "VEUM": 4, "VFDP": 2, "VFIF": 6, "VFNM": 6, "VFO": 2, "VGB": 2, "VGBC": 4, "VGN": 4, "VH": 2, "VH24": 4,
-                    "VH8": 2, "VHB": 2, "VIE": 2, "VIL": 4, "VILN": 4, "VILO": 2, "VIP": 4, "VIP5": 4, "VIPMDL2": 4, "VIPMDL3": 4,
-                    "VIPRL": 4, "VIS": 4, "VIU": 4, "VJ": 2, "VJA": 2, "VLB": 2, "VLMQO": 2, "VM": 2, "VNBC": 2, "VNC": 1, "VNMDL": 1,
-                    "VNTR": 1, "VPJM": 1, "VPMQO": 2, "VQAX": 1, "VQCA": 4, "VQCP": 4, "VR": 6, "VRBS": 6, "VRBZ": 6, "VRDO": 6,
-                    "VRE": 1, "VREL": 1, "VRGN": 6, "VRIL": 6, "VRIP": 6, "VRIU": 6, "VRJ": 6, "VRLB": 6, "VRLST": 6, "VRQ": 2,
-                    "VRVQ": 6, "VS": 2, "VSC": 1, "VSCR": 2, "VSD3": 1, "VTAC": 1, "VTCI": 4, "VTCT": 4, "VTNC": 2, "VTOQ": 4, "VTR": 6,
-                    "VTW": 4, "VVQ": 6, "WOQ": 4,  }
-BatchVerification_list = {"NA": 5, "NR": 5, "VAC": 1, "VAC,VCN": 6, "VAC,VMD": 2, "VAC,VMD,VQI": 4,
-                                  "VAC,VQI": 4, "VAC,VR": 6, "VAF": 1, "VAF,VMD": 2, "VAF,VQI": 4, "VAP": 1,
-                                  "VAP,VI": 4, "VAP,VQI": 4, "VCN": 6, "VLC": 1, "VLC,VMD": 2, "VLC,VMD,VQI": 4,
-                                  "VLC,VQI": 4, "VLF": 1, "VMD": 2, "VQI": 4, "VQI,VTC": 4, "VQN": 5, "VR": 6, "VTC": 2}
-ResultQualCode_list = {"/oC": 4, "<": 1, "<=": 1, "=": 1, ">": 1, ">=": 1, "A": 1, "CG": 4, "COL": 1, "DNQ": 2,
-                           "JF": 1, "NA": 6, "ND": 1, "NR": 6, "NRS": 6, "NRT": 6, "NSI": 1, "P": 1, "PA": 1, "w/C": 4,
-                           "": 1, "Systematic Contamination": 4, }
-Latitude_list = {"-88": 0, "": 6, '0.0': 6, -88: 0 }
-Result_list = {"": 1, }
-StationCode_list = {"LABQA": 0, "LABQA_SWAMP": 0, "000NONPJ": 0, "FIELDQA": 0, "Non Project QA Sample": 0,
-                    "Laboratory QA Sample": 0, "Field QA sample": 0, "FIELDQA SWAMP": 0, "000NONSW": 0, "FIELDQA_SWAMP": 0}
-SampleTypeCode_list = {"LabBlank": 0, "CompBLDup": 0, "LCS": 0, "CRM": 0, "FieldBLDup_Grab": 0, "FieldBLDup_Int": 0,
-                        "FieldBLDup": 0, "FieldBlank": 0, "TravelBlank": 0, "EquipBlank": 0, "DLBlank": 0,
-                        "FilterBlank": 0, "MS1": 0, "MS2": 0, "MS3": 0, "MSBLDup": 0, }
-SampleDate_list = {"Jan  1 1950 12:00AM": 0, }
-MatrixName_list = {"blankwater": 0, "Blankwater": 0, "labwater": 0, "blankmatrix": 0, }
-CollectionReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
-ResultsReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
-Datum_list = {"NR": 3}
+# The codes that are not in the rules are counted by column and code and listed in the data quality diagnostics report of each data type (see report_dq_diagnostics)
+
 DQ_Codes = {0: "MetaData", 1: "Passed", 2: "Some review needed", 3: "Spatial accuracy unknown",
             4: "Extensive review needed", 5: "Unknown data quality", 6: "Reject record", 7: 'Error in data'}
 
-# dictionary of dictionaries
-CodeColumns = {
-    "QACode": QA_Code_list,
-    "BatchVerification": BatchVerification_list,
-    "ResultQualCode": ResultQualCode_list,
-    "TargetLatitude": Latitude_list,
-    "Result": Result_list,
-    "StationCode": StationCode_list,
-    "SampleTypeCode": SampleTypeCode_list,
-    "SampleDate": SampleDate_list,
-    "MatrixName": MatrixName_list,
-    "CollectionReplicate": CollectionReplicate_list,
-    "ResultsReplicate": ResultsReplicate_list,
-    "Datum": Datum_list
-}
-
-def check_latitude(val):
-    try:
-        lat = float(val)
-        return lat
-    except ValueError:
-        # a missing latitude value (and non-numeric values) should throw an error
-        # missing values should be encoded as 'NaN' to define data type as numeric on open data portal
-        return 'NaN'
-
-def check_longitude(val):
-    try:
-        long = float(val)
-        if 0. < long < 10000.0:
-            val = -long
-        return val
-    except ValueError:
-        # a missing longitude value (and non-numeric values) should throw an error
-        # missing values should be encoded as 'NaN' to define data type as numeric on open data portal
-        return 'NaN'
+# Rules in the rules file
+dq_rules = ['equals', 'each_equals', 'search', 'year_equals', 'equals_positive_result']
+
+# Evaluation plans of the data types, compiled from the rules file the first time they are used (see get_dq_plan)
+dq_plans = {}
+
+# Minimum number of records for scoring the data quality on worker processes (see add_data_quality). Smaller datasets are scored faster on one process than it takes to start the workers
+dq_shard_min_rows = 200000
+
+# Codes that do not match a rule, counted for each data type by (column, code): the number of records with the code and a few example records (see add_dq_diagnostics and report_dq_diagnostics)
+dq_diagnostics = {}
+
+# Version of the data quality cache files (see add_cached_data_quality). Increase it when the cache contents or the record fingerprints change, so that the cache files saved by an older version are not used
+dq_cache_version = 1
+
+
+# Function for importing the data quality rules file as a dataframe
+def import_dq_rules(path=p_constants.dq_rules_file):
+    rules_df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    unknown = sorted(set(rules_df['Rule']) - set(dq_rules))
+    if unknown:
+        raise ValueError('Unknown rules in %s: %s' % (path, ', '.join(unknown)))
+    rules_df['Score'] = rules_df['Score'].astype(int)
+    return rules_df
+
+# Function for getting the value of a rule as text or as a number (see ValueType in the rules file)
+def get_rule_value(rule):
+    if rule['Rule'] == 'search':
+        return re.compile(rule['Value'])
+    if rule['ValueType'] == 'number':
+        return float(rule['Value'])
+    return rule['Value']
+
+# Function for getting the text codes of a field that are in the rules file (ex. all of the QACode codes). Used by benchmark/generate_data.py to generate records with these codes
+def get_rule_codes(field, rules_df=None):
+    rules_df = import_dq_rules() if rules_df is None else rules_df
+    rules_df = rules_df[(rules_df['Field'] == field) & (rules_df['ValueType'] == 'text') & (rules_df['Rule'].isin(['equals', 'each_equals']))]
+    return sorted(set(rules_df['Value']))
+
+# Function for compiling the data quality rules into an evaluation plan for a data type: one step for each field, in the order of the rules file, with the column of the field (see p_constants.dq_column_maps) and the rules of the field. Runs of equals rules are combined into one dictionary lookup (the first rule for a value is kept)
+def compile_dq_plan(rules_df, column_map=None):
+    column_map = column_map or {}
+    manifest = p_constants.column_manifests['data_quality']
+    steps = []
+    for field in rules_df['Field'].drop_duplicates():
+        field_rules = rules_df[rules_df['Field'] == field]
+        matchers = []
+        for rule in field_rules.to_dict('records'):
+            kind = 'equals' if rule['Rule'] == 'each_equals' else rule['Rule']
+            if (kind == 'equals') and matchers and (matchers[-1][0] == 'equals'):
+                matchers[-1][1].setdefault(get_rule_value(rule), (rule['Code'], rule['Score']))
+            elif kind == 'equals':
+                matchers.append(('equals', {get_rule_value(rule): (rule['Code'], rule['Score'])}))
+            else:
+                matchers.append((kind, get_rule_value(rule), rule['Code'], rule['Score']))
+        steps.append({
+            'field': field,
+            'column': column_map.get(field, field),
+            'optional': field in manifest['optional'],
+            'each': (field_rules['Rule'] == 'each_equals').any(),
+            'positive_result': (field_rules['Rule'] == 'equals_positive_result').any(),
+            'matchers': matchers
+        })
+    return steps
+
+# Function for getting the evaluation plan of a data type. The plan is compiled once and reused
+def get_dq_plan(data_type=None):
+    if data_type not in dq_plans:
+        dq_plans[data_type] = compile_dq_plan(import_dq_rules(), p_constants.dq_column_maps.get(data_type))
+    return dq_plans[data_type]
+
+# Function for finding the first rule of a field that matches a value. Returns the (code, score) of the rule, or None if no rule matches. positive is True if the Result of the record is a number greater than 0
+def match_rules(matchers, value, positive=False):
+    for matcher in matchers:
+        kind = matcher[0]
+        if kind == 'equals':
+            try:
+                if value in matcher[1]:
+                    code, score = matcher[1][value]
+                    return (code or value, score)
+            except TypeError:
+                pass
+        elif kind == 'search':
+            if isinstance(value, str) and matcher[1].search(value):
+                return (matcher[2] or value, matcher[3])
+        elif kind == 'year_equals':
+            if value == matcher[1]:
+                return (matcher[2] or value, matcher[3])
+        elif kind == 'equals_positive_result':
+            if positive and value == matcher[1]:
+                return (matcher[2] or value, matcher[3])
+    return None
+
+# Function for getting the (code, score) entries of one value of a field. For fields with comma-separated codes (each_equals), each code is checked separately, and the codes that do not match a rule are added to the unknown_codes list
+def get_value_entries(step, value, positive=False, unknown_codes=None):
+    if step['each']:
+        entries = []
+        for code in str(value).split(','):
+            entry = match_rules(step['matchers'], code, positive)
+            if entry is not None:
+                entries.append(entry)
+            elif unknown_codes is not None:
+                unknown_codes.append(code)
+        return tuple(entries)
+    entry = match_rules(step['matchers'], value, positive)
+    return () if entry is None else (entry,)
+
+# Function for scoring text values that hold a list of codes (ex. QACode "VRIL,FDP", or BatchVerification "VAC,VMD,VQI" if its codes were scored one by one). code_scores is a dictionary of the (code shown in the DataQualityIndicator, score) of each code, where an empty code shows the code itself
+# The values are split into codes and all of the codes are looked up at once. Returns a dataframe with one row per value (in the same order): the highest and lowest score of the codes of the value (MaxScore, MinScore, NaN if none of the codes are in code_scores), the codes with the highest score in the order of the value (MaxCodes), and the codes that are not in code_scores (UnknownCodes)
+def score_code_lists(values, code_scores, sep=','):
+    codes = pd.Series(values, dtype=object).reset_index(drop=True).astype(str).str.split(sep).explode()
+    positions = pd.Index(list(code_scores), dtype=object).get_indexer(codes.to_numpy())
+    known = positions >= 0
+    scores = np.array([score for _, score in code_scores.values()] + [-1])[positions]
+    shown = np.array([code for code, _ in code_scores.values()] + [''], dtype=object)[positions]
+    codes_df = pd.DataFrame({'Value': codes.index, 'Code': np.where(shown == '', codes.to_numpy(), shown), 'Score': scores})
+
+    known_df = codes_df[known]
+    value_scores = known_df.groupby('Value')['Score'].agg(['max', 'min'])
+    max_df = known_df[known_df['Score'].to_numpy() == value_scores['max'].reindex(known_df['Value']).to_numpy()]
+    result = pd.DataFrame(index=pd.RangeIndex(len(values)))
+    result['MaxScore'] = value_scores['max']
+    result['MinScore'] = value_scores['min']
+    result['MaxCodes'] = max_df.groupby('Value', sort=False)['Code'].agg(tuple).reindex(result.index)
+    result['UnknownCodes'] = codes_df[~known].groupby('Value', sort=False)['Code'].agg(tuple).reindex(result.index)
+    for col in ['MaxCodes', 'UnknownCodes']:
+        result[col] = [codes if isinstance(codes, tuple) else () for codes in result[col]]
+    return result
+
+# Function for scoring a column of code lists record by record (see score_code_lists). Each distinct value is scored once. Returns a dataframe with the same index as the column. Missing values get no scores or codes
+def score_code_column(series, code_scores, sep=','):
+    keys, uniques = pd.factorize(series, use_na_sentinel=True)
+    result = score_code_lists(uniques, code_scores, sep)
+    # The missing values (key -1) get the last row, which has no scores or codes
+    missing = pd.DataFrame({'MaxScore': [np.nan], 'MinScore': [np.nan], 'MaxCodes': [()], 'UnknownCodes': [()]})
+    result = pd.concat([result, missing], ignore_index=True).iloc[keys]
+    result.index = series.index
+    return result
+
+# Function for getting the (code, score) entries and the codes that do not match a rule of each value of a field (see get_value_entries). The values to check are given by the checked array; the other values get no entries
+# For fields with lists of codes where every rule is an equals rule (ex. QACode), the codes of all of the values are scored at once (see score_code_lists). The data quality of a record only depends on the highest and lowest score of each field and the codes with the highest score (see get_data_quality), so each value gets the entries of its codes with the highest score, and one entry with the lowest score (without a code) if it is lower
+def get_step_entries(step, values, checked):
+    entries = [()] * len(values)
+    unknown_codes = [()] * len(values)
+    checked = np.flatnonzero(checked)
+    if step['each'] and (len(step['matchers']) == 1) and (step['matchers'][0][0] == 'equals'):
+        scored = score_code_lists([values[i][0] for i in checked], step['matchers'][0][1])
+        for i, max_score, min_score, max_codes, unknown in zip(checked, scored['MaxScore'], scored['MinScore'], scored['MaxCodes'], scored['UnknownCodes']):
+            value_entries = tuple((code, int(max_score)) for code in max_codes)
+            if min_score < max_score:
+                value_entries += (('', int(min_score)),)
+            entries[i] = value_entries
+            unknown_codes[i] = unknown
+        return entries, unknown_codes
+    for i in checked:
+        value, positive = values[i]
+        codes = []
+        entries[i] = get_value_entries(step, value, positive, codes)
+        unknown_codes[i] = tuple(codes)
+    return entries, unknown_codes
+
+# Function for getting the distinct values of a field, and for each record, the position of its value in the distinct values (-1 for missing values). The year is used for fields with year rules. For fields with a rule that depends on the Result, each distinct value is paired with whether the Result is positive
+# Also returns which of the distinct values need to be checked against the rules. A numeric field can have a distinct value for almost every record (ex. Result), so for fields with only equals rules, the numeric values are first compared to the numeric rule values all at once
+def get_field_values(df, step, result_column):
+    series = df[step['column']]
+    if any(matcher[0] == 'year_equals' for matcher in step['matchers']):
+        series = series.dt.year
+    keys, uniques = pd.factorize(series, use_na_sentinel=True)
+    checked = np.ones(len(uniques), dtype=bool)
+    if all(matcher[0] == 'equals' for matcher in step['matchers']) and not step['each'] and pd.api.types.is_numeric_dtype(uniques.dtype) and not pd.api.types.is_bool_dtype(uniques.dtype):
+        rule_values = [value for matcher in step['matchers'] for value in matcher[1] if isinstance(value, (int, float))]
+        checked = np.isin(uniques, rule_values)
+    if not step['positive_result']:
+        return keys, [(value, False) for value in uniques], checked
+    keys = np.where(keys >= 0, keys * 2 + get_positive_results(df, result_column), -1)
+    return keys, [(value, positive) for value in uniques for positive in (False, True)], np.repeat(checked, 2)
+
+# Function for getting a boolean array of the records with a Result that is a number greater than 0
+def get_positive_results(df, column):
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    result = df[column]
+    if pd.api.types.is_numeric_dtype(result) and not pd.api.types.is_bool_dtype(result):
+        return (result > 0).to_numpy(dtype=bool)
+    return result.map(lambda x: isinstance(x, (int, float)) and x > 0).to_numpy(dtype=bool)
+
+# Function for getting the data quality of a record from its list of (col, code, score) entries. Returns the DataQuality and DataQualityIndicator values
+def get_data_quality(entries):
+    # Initialize a list of dictionaries
+    # ex. [{col: ###, code: ###, score: #}}, ...]
+    DQ = [{'col': col, 'code': code, 'score': score} for col, code, score in entries]
+
+    # A word about that DQ variable:
+    # DQ might host a long list of numbers but if there is ever a zero, that whole
+    # record should be classified as a QC record. If there isnt a zero and the
+    # maximum value is a 1, then that record passed our data quality estimate
+    # unblemished. If there isn't a zero and the max DQ values is greater than 1,
+    # then ... we get the max value and store the corresponding value (from the
+    # DQ_Codes dictionary, defined above). If the Max DQ is 6 (which is a reject
+    # record) and QInd is empty, then this is a special rule case and we label it as
+    # such. Otherwise, we throw all of the QInd information into the Quality
+    # indicator column. QInd might look like:
+    #   ['ResQualCode:npr,kqed', 'BatchVerificationCode:lol,btw,omg', ]
+    # and the this gets converted and stored into the records new column called Data
+    # Quality indicator a:
+    # 'ResQualCode:npr,kqed; BatchVerificationCode:lol,btw,omg'
+
+    # A record that does not match any rule cannot be assessed
+    if not DQ:
+        return DQ_Codes[7], ''
+
+    # Find the min and max DQ scores
+    min_DQ = min(i['score'] for i in DQ)
+    max_DQ = max(i['score'] for i in DQ)
+
+    # Determine the DQ variable for the data record
+    if min_DQ == 0:
+        return DQ_Codes[0], ''
+    elif max_DQ == 1:
+        return DQ_Codes[1], ''
+
+    # Data quality indicator:
+    # iterate through all the code matches again and append all where score = max DQ to new list. This is in case there are mulitple codes sharing the same max DQ.
+    equal_max_DQ = []
+    for i in DQ:
+        if i['score'] == max_DQ:
+            equal_max_DQ.append(i)
+
+    # join array items to form the DQ indicator column value
+    DQ_indicator = '; '.join(map(str, [i['col'] + ':' + str(i['code']) for i in equal_max_DQ]))
+
+    if max_DQ == 6 and DQ_indicator == '':
+        return DQ_Codes[max_DQ], 'ResultQualCode Special Rules'
+    return DQ_Codes[max_DQ], DQ_indicator
 
+# Function for cleaning a dataframe of CEDEN records before the data quality fields are added. The numeric columns stay numeric: values that are not numbers become missing values (NaN), and the missing values are only written as "NaN" text when the data is exported (see p_constants.nan_text_cols)
 def clean_data(df):
-    # Clean null values. We have to make a distinction between None, 'None', and ''
-    # 'None' and '' are used specifically in the datasets, but None gets translated to 'None' unless we replace it with '' explicitly
-    # df.fillna('')
-
-    # Strip special characters
-    df.replace(r'\t',' ', regex=True, inplace=True) # tab
-    df.replace(r'\r',' ', regex=True, inplace=True) # carriage return
-    df.replace(r'\n',' ', regex=True, inplace=True) # newline
-    df.replace(r'\f',' ', regex=True, inplace=True) # formfeed
-    df.replace(r'\v',' ', regex=True, inplace=True) # vertical tab
-    df.replace(r'\|', ' ', regex=True, inplace=True) # pipe
-    df.replace(r'\"', ' ', regex=True, inplace=True) # quotes
+    # Strip special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, quotes). Works on both text and categorical columns
+    df = p_utils.strip_special_characters(df)
 
     # Process the data to make sure the fields are compatible with the portal’s data type definition. 
-    # For numeric, make sure that all values can be recognized as a number. Missing values have to be encoded as "NaN". 
+    # For numeric, make sure that all values can be recognized as a number. Missing values are encoded as "NaN" when the file is written (see p_utils.write_csv).
     # For dates, the data has to be formatted as YYYY-MM-DD (you can also add a time to that - YYYY-MM-DD HH:MM:SS), and missing values have to be encoded as an empty text string ("").
 
-    # Check numeric columns
-    numeric_cols = ['CollectionDepth', 'CollectionReplicate', 'ResultsReplicate', 'Result']
+    # Check numeric columns. Columns that were not imported as numbers (ex. a column with text values) are converted, and the values that are not numbers become missing values
+    numeric_cols = ['CollectionDepth', 'CollectionReplicate', 'ResultsReplicate', 'Result', 'TargetLatitude', 'TargetLongitude']
     for col in numeric_cols:
-        try:
-            df[col].fillna('NaN')
-        except:
-            print('%s field does not exist for dataframe' % col)
+        if (col in df.columns) and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
 
-    # Check latitude and longitude values (numeric)
+    # Check longitude values
     # sometimes the Longitude gets entered as 119 instead of -119...
     # make sure Longitude value is negative and less than 10000 (could be projected)
-    # check for missing and non-numeric values, replace with 'NaN'
-    df['TargetLatitude'] = df['TargetLatitude'].map(check_latitude).fillna('NaN')
-    df['TargetLongitude'] = df['TargetLongitude'].map(check_longitude).fillna('NaN')
+    longitude = df['TargetLongitude']
+    df['TargetLongitude'] = longitude.mask((longitude > 0) & (longitude < 10000), -longitude)
 
-    df.fillna('')
-    
     return df
 
-def add_data_quality(df):
-    # Function for adding QACode data quality codes and scores to DQ dictionary
-    def add_QACode(row):
-        col = 'QACode'
-        values = row[col].split(',')
-        for i in values:
-            try:
-                DQ.append({'col': col, 'code': i, 'score': QA_Code_list[i]})
-            except:
-                print(i + ' not a valid key in  QA_Code_list')
-
-    # Function for adding StationCode data quality codes and scores to DQ dictionary
-    def add_StationCode(row):
-        col = 'StationCode'
-        val = row[col]
-        if bool(re.search('000NONPJ', val)):
-            # if a record has 000NONPJ or any variant in the StationCode value, add 0 to DQ
-            DQ.append({'col': col, 'code': '000NONPJ', 'score': 0})
-        elif val in StationCode_list:
-            DQ.append({'col': col, 'code': val, 'score': StationCode_list[val]})
-
-    # Function for adding Analyte data quality codes and scores to DQ dictionary
-    def add_Analyte(row):
-        col = 'Analyte'
-        value = row[col]
-        # If the analyte name contains 'surrogate', mark DQ with a 0
-        if bool(re.search('[Ss]urrogate', row[col])):
-            DQ.append({'col': col, 'code': row[col], 'score': 0})
-
-    # Function for adding ResultQualCode data quality codes and scores to DQ dictionary
-    def add_ResultQualCode(row):
-        col = 'ResultQualCode'
-        val = row[col]
-        # special cases for ResQualCode
-        year = row['SampleDate'].year
-        if val == 'DNQ' and year < 2008:
-            DQ.append({'col': col, 'code': val, 'score': ResultQualCode_list[val]})
-        elif val == 'ND':
-            # the Benthic dataset can have an ND value as long as the result
-            # is not positive. Record is a pass if less than or equal to zero
-            # reject if result is positive
-            try:
-                result = row['Result']
-                if isinstance(result, (int, float)) and result > 0:
-                    DQ.append({'col': col, 'code': val, 'score': 6})
-                else:
-                    DQ.append({'col': col, 'code': val, 'score': 1})
-            except KeyError:
-                DQ.append({'col': col, 'code': val, 'score': 1})
-        # End of Special Rules for ResultQualCode
-        # check each value in the code dictionary and add numerical value to DQ
-        elif val in ResultQualCode_list:
-            DQ.append({'col': col, 'code': val, 'score': ResultQualCode_list[val]})
-
-    # Function for adding Result data quality codes and scores to DQ dictionary
-    def add_Result(row):
-        col = 'Result'
-        val = row[col]
-        # Results can be empty if ResultQualCode == 'ND'
-        if val == '' and row['ResultQualCode'] == 'ND':
-            DQ.append({'col': col, 'code': val, 'score': 1})
-        else:
-            # All other values, look up in code dictionary
-            if val in Result_list:
-                DQ.append({'col': col, 'code': val, 'score': Result_list[val]})
-
-    def add_BatchVerification(row):
-        try:
-            col = 'BatchVerification'
-            val = row[col]
-            if val in BatchVerification_list:
-                DQ.append({'col': col, 'code': val, 'score': BatchVerification_list[val]})
-        except:
-            pass
-
-    def add_Latitude(row):
-        col = 'TargetLatitude'
-        val = row[col]
-        if val in Latitude_list:
-            DQ.append({'col': col, 'code': val, 'score': Latitude_list[val]})
-
-    def add_SampleTypeCode(row):
-        col = 'SampleTypeCode'
-        val = row[col]
-        if val in SampleTypeCode_list:
-            DQ.append({'col': col, 'code': val, 'score': SampleTypeCode_list[val]})
-
-    def add_SampleDate(row):
-        col = 'SampleDate'
-        year = row[col].year
-        if year == 1950:
-            DQ.append({'col': col, 'code': row[col], 'score': 0})
-
-    def add_MatrixName(row):
-        col = 'MatrixName'
-        val = row[col]
-        if val in MatrixName_list:
-            DQ.append({'col': col, 'code': val, 'score': MatrixName_list[val]})
-
-    def add_CollectionReplicate(row):
-        col = 'CollectionReplicate'
-        val = row[col]
-        if val in CollectionReplicate_list:
-            DQ.append({'col': col, 'code': val, 'score': CollectionReplicate_list[val]})
-
-    def add_ResultsReplicate(row):
-        try:
-            col = 'ResultsReplicate'
-            val = row[col]
-            if val in ResultsReplicate_list:
-                DQ.append({'col': col, 'code': val, 'score': ResultsReplicate_list[val]})
-        except:
-            pass
-
-    def add_Datum(row):
-        col = 'Datum'
-        val = row[col]
-        if val in Datum_list:
-            DQ.append({'col': col, 'code': val, 'score': Datum_list[val]})
-        
-    for index, row in df.iterrows():
-        # Initialize a list of dictionaries
-        # ex. [{col: ###, code: ###, score: #}}, ...]
-        DQ = []
-
-        # Go through each column and append DQ dictionaries to DQ
-        add_QACode(row)
-        add_StationCode(row)
-        add_Analyte(row)
-        add_ResultQualCode(row)
-        add_Result(row)
-        add_BatchVerification(row)
-        add_Latitude(row)
-        add_SampleTypeCode(row)
-        add_SampleDate(row)
-        add_MatrixName(row)
-        add_CollectionReplicate(row)
-        add_ResultsReplicate(row)
-        add_Datum(row)
-
-        # A word about that DQ variable:
-        # DQ might host a long list of numbers but if there is ever a zero, that whole
-        # record should be classified as a QC record. If there isnt a zero and the
-        # maximum value is a 1, then that record passed our data quality estimate
-        # unblemished. If there isn't a zero and the max DQ values is greater than 1,
-        # then ... we get the max value and store the corresponding value (from the
-        # DQ_Codes dictionary, defined above). If the Max DQ is 6 (which is a reject
-        # record) and QInd is empty, then this is a special rule case and we label it as
-        # such. Otherwise, we throw all of the QInd information into the Quality
-        # indicator column. QInd might look like:
-        #   ['ResQualCode:npr,kqed', 'BatchVerificationCode:lol,btw,omg', ]
-        # and the this gets converted and stored into the records new column called Data
-        # Quality indicator a:
-        # 'ResQualCode:npr,kqed; BatchVerificationCode:lol,btw,omg'
-
-        # Find the min and max DQ scores
-        min_DQ = min(i['score'] for i in DQ)
-        max_DQ = max(i['score'] for i in DQ)
-
-        # Determine the DQ variable for the data record
-        if min_DQ == 0:
-            df.at[index, 'DataQuality'] = DQ_Codes[0]
-            df.at[index, 'DataQualityIndicator'] = ''
-        elif max_DQ == 1:
-            df.at[index, 'DataQuality'] = DQ_Codes[1]
-            df.at[index, 'DataQualityIndicator'] = ''
-        else:
-            # Data quality score
-            df.at[index, 'DataQuality'] = DQ_Codes[max_DQ]
-
-            # Data quality indicator:
-            # iterate through all the code matches again and append all where score = max DQ to new list. This is in case there are mulitple codes sharing the same max DQ.
-            equal_max_DQ = []
-            for i in DQ:
-                if i['score'] == max_DQ:
-                    equal_max_DQ.append(i)
-
-            # join array items to form the DQ indicator column value
-            DQ_indicator = '; '.join(map(str, [i['col'] + ':' + i['code'] for i in equal_max_DQ]))
-            
-            # write to record dictionary
-            if max_DQ == 6 and DQ_indicator == '':
-                df.at[index, 'DataQualityIndicator'] = 'ResultQualCode Special Rules'
-            else:
-                df.at[index, 'DataQualityIndicator'] = DQ_indicator
+# Function for calculating the data quality of the records of a dataframe (see the rules above). The data type selects the columns of the fields (see p_constants.dq_column_maps). Returns the group ID of each record, the (DataQuality, DataQualityIndicator) values of each group, and for each (column, code) that does not match a rule, the number of records with the code and the positions of the first few of them (up to p_constants.dq_diagnostics_examples)
+# The rules are not checked record by record. The rules of a field are checked once for each distinct value of the field, and each distinct set of (code, score) entries gets an ID. The records are then grouped by the combination of the IDs of their fields, and the data quality is calculated once for each group
+def score_data_quality(df, data_type=None):
+    plan = get_dq_plan(data_type)
+    missing = [step['column'] for step in plan if (step['column'] not in df.columns) and not step['optional']]
+    if missing:
+        raise ValueError('The data is missing the columns required by the data quality rules: %s' % ', '.join(missing))
+    plan = [step for step in plan if step['column'] in df.columns]
+    result_column = p_constants.dq_column_maps.get(data_type, {}).get('Result', 'Result')
+
+    # ID 0 is the empty set of entries (values that do not match any rule, and missing values)
+    entry_sets = {(): 0}
+    entry_ids = []
+    unknown_codes = {}
+    for step in plan:
+        keys, values, checked = get_field_values(df, step, result_column)
+        counts = np.bincount(keys[keys >= 0], minlength=len(values))
+        value_ids = np.zeros(len(values), dtype='int64')
+        step_entries, step_unknown_codes = get_step_entries(step, values, checked)
+        for i in np.flatnonzero(checked):
+            entries = tuple((step['column'], code, score) for code, score in step_entries[i])
+            value_ids[i] = entry_sets.setdefault(entries, len(entry_sets))
+        add_step_unknown_codes(unknown_codes, step, keys, counts, step_unknown_codes)
+        # The last position is used for the missing values (key -1)
+        entry_ids.append(np.append(value_ids, 0)[keys])
+
+    # Group the records by the combination of the entry IDs of their fields. The groups are numbered in the order of their first record
+    group_ids = np.zeros(len(df), dtype='int64')
+    for ids in entry_ids:
+        group_ids = pd.factorize(group_ids * len(entry_sets) + ids)[0]
+    first_rows = np.unique(group_ids, return_index=True)[1]
+
+    # Calculate the data quality of each group, from the entries of the fields in the order of the rules file
+    entry_lists = {entry_id: entries for entries, entry_id in entry_sets.items()}
+    group_dq = [get_data_quality([entry for ids in entry_ids for entry in entry_lists[ids[row]]]) for row in first_rows]
+    return group_ids, group_dq, unknown_codes
+
+# Function for adding the codes of one field that do not match a rule to the unknown codes of a dataframe (see score_data_quality). step_unknown_codes holds the codes of each distinct value of the field, keys the position of the value of each record, and counts the number of records of each value
+def add_step_unknown_codes(unknown_codes, step, keys, counts, step_unknown_codes):
+    for i, codes in enumerate(step_unknown_codes):
+        for code in codes:
+            unknown = unknown_codes.setdefault((step['column'], code), {'records': 0, 'rows': []})
+            unknown['records'] += int(counts[i])
+            if len(unknown['rows']) < p_constants.dq_diagnostics_examples:
+                unknown['rows'].extend(np.flatnonzero(keys == i)[:p_constants.dq_diagnostics_examples - len(unknown['rows'])].tolist())
+
+# Function for finding the codes of the records of a dataframe that do not match a rule, without calculating the data quality (see score_data_quality). The rules are checked once for each distinct value of each field. Used in incremental mode, so that the records found in the data quality cache are also counted in the diagnostics
+def get_unknown_codes(df, data_type=None):
+    plan = [step for step in get_dq_plan(data_type) if step['column'] in df.columns]
+    result_column = p_constants.dq_column_maps.get(data_type, {}).get('Result', 'Result')
+    unknown_codes = {}
+    for step in plan:
+        keys, values, checked = get_field_values(df, step, result_column)
+        counts = np.bincount(keys[keys >= 0], minlength=len(values))
+        add_step_unknown_codes(unknown_codes, step, keys, counts, get_step_entries(step, values, checked)[1])
+    return unknown_codes
+
+# Function for getting the columns of a dataframe that are used to calculate the data quality: the columns of the rule fields, and the Result column
+def get_dq_columns(df, data_type=None):
+    result_column = p_constants.dq_column_maps.get(data_type, {}).get('Result', 'Result')
+    columns = [step['column'] for step in get_dq_plan(data_type)]
+    return [col for col in df.columns if (col in columns) or (col == result_column)]
+
+# Function for scoring one shard (block of rows) of a dataframe in a worker process (see score_data_quality_sharded). The rows of all of the shards are saved as record batches of an Arrow IPC file in a shared memory block created by the main process, so the worker reads its batch from the block instead of receiving a pickled copy of the rows
+def score_shard(shared_name, size, batch, data_type):
+    import pyarrow as pa
+    block = shared_memory.SharedMemory(name=shared_name)
+    try:
+        buffer = pa.py_buffer(block.buf)[:size]
+        reader = pa.ipc.open_file(buffer)
+        df = reader.get_batch(batch).to_pandas()
+        result = score_data_quality(df, data_type)
+        del buffer, reader, df # Release the views of the shared memory block before closing it
+    finally:
+        block.close()
+    return result
+
+# Function for calculating the data quality of the records of a dataframe on a pool of worker processes. The rows are split into one block per worker, each block is scored separately, and the results are combined in the order of the rows. Each record is scored independently of the others, so each record gets the same DataQuality and DataQualityIndicator values as with score_data_quality
+# Returns None if the data cannot be passed to the workers as Arrow record batches (ex. pyarrow is not installed, or a column has both text and numbers), so that the data can be scored on one process instead
+def score_data_quality_sharded(df, data_type, workers):
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df[get_dq_columns(df, data_type)], preserve_index=False)
+    except Exception as e:
+        print('--- Could not split the data quality step across worker processes, running it on one process: %s' % e)
+        return None
+
+    # Write one record batch per block of rows to an Arrow IPC file in shared memory
+    block_rows = -(-len(df) // workers)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        for start in range(0, len(df), block_rows):
+            writer.write_batch(table.slice(start, block_rows).combine_chunks().to_batches()[0])
+    data = sink.getvalue()
+    n_batches = -(-len(df) // block_rows)
+    block = shared_memory.SharedMemory(create=True, size=max(data.size, 1))
+    try:
+        block.buf[:data.size] = memoryview(data).cast('B')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shard_results = list(executor.map(score_shard, [block.name] * n_batches, [data.size] * n_batches, range(n_batches), [data_type] * n_batches))
+    finally:
+        block.close()
+        block.unlink()
+
+    # Combine the groups of the shards by their (DataQuality, DataQualityIndicator) values, numbered in the order of their first record
+    group_ids = []
+    group_numbers = {}
+    unknown_codes = {}
+    start = 0
+    for shard_group_ids, shard_group_dq, shard_unknown_codes in shard_results:
+        numbers = np.array([group_numbers.setdefault(dq, len(group_numbers)) for dq in shard_group_dq], dtype='int64')
+        group_ids.append(numbers[shard_group_ids])
+        # The example rows of the shards are positions in the shard, so the position of the first row of the shard is added
+        for key, shard_unknown in shard_unknown_codes.items():
+            unknown = unknown_codes.setdefault(key, {'records': 0, 'rows': []})
+            unknown['records'] += shard_unknown['records']
+            unknown['rows'] = (unknown['rows'] + [start + row for row in shard_unknown['rows']])[:p_constants.dq_diagnostics_examples]
+        start += len(shard_group_ids)
+    return np.concatenate(group_ids), list(group_numbers), unknown_codes
+
+# Function for calculating the data quality of the records of a dataframe (see score_data_quality). With more than one worker (p_constants.workers) and at least dq_shard_min_rows records, the records are scored on a pool of worker processes (see score_data_quality_sharded). The output is the same either way
+def score_records(df, data_type=None, workers=None):
+    workers = p_constants.workers if workers is None else workers
+    scores = None
+    if (workers > 1) and (len(df) >= dq_shard_min_rows):
+        scores = score_data_quality_sharded(df, data_type, workers)
+    if scores is None:
+        scores = score_data_quality(df, data_type)
+    return scores
+
+# Function for adding the DataQuality and DataQualityIndicator fields to a dataframe of CEDEN records (see score_records). The data type selects the columns of the fields (see p_constants.dq_column_maps)
+# If a data quality cache is given (see import_dq_cache), the values of the records found in the cache are reused and only the other records are assessed
+def add_data_quality(df, data_type=None, cache=None, workers=None):
+    if cache is not None:
+        return add_cached_data_quality(df, data_type, cache, workers)
+    group_ids, group_dq, unknown_codes = score_records(df, data_type, workers)
+
+    # Count the codes that do not match a rule. They are listed at the end of the data quality step (see report_dq_diagnostics)
+    add_dq_diagnostics(df, data_type, unknown_codes)
+
+    # Add the DQ columns to the records
+    df['DataQuality'] = np.array([dq for dq, _ in group_dq], dtype=object)[group_ids]
+    df['DataQualityIndicator'] = np.array([indicator for _, indicator in group_dq], dtype=object)[group_ids]
 
     # Return the dataframe with the added DQ columns
     return df
+
+# Function for getting the values that the data quality of each record is calculated from: the columns of the rule fields, and whether the Result is positive if a rule depends on it. Object columns with both text and numbers keep the type of each value (ex. "float:-88.0"), because text and number values are matched by different rules
+def get_dq_fields(df, data_type=None):
+    result_column = p_constants.dq_column_maps.get(data_type, {}).get('Result', 'Result')
+    fields = {}
+    for step in get_dq_plan(data_type):
+        if step['column'] in df.columns:
+            series = df[step['column']]
+            if pd.api.types.infer_dtype(series, skipna=True).startswith('mixed'):
+                series = series.map(lambda x: '%s:%s' % (type(x).__name__, x))
+            fields[step['column']] = series
+        if step['positive_result']:
+            fields['PositiveResult'] = get_positive_results(df, result_column)
+    return pd.DataFrame(fields, index=df.index)
+
+# Function for importing the data quality cache of a data type (see p_constants.dq_cache_file). The cache holds the DataQuality and DataQualityIndicator values of the records from the previous run, indexed by the fingerprint of the record's data quality fields. Returns an empty cache if there is no cache file, or if it was saved by a different version of this script or with a different rules file
+def import_dq_cache(data_type):
+    path = p_constants.dq_cache_file % data_type
+    cache = {
+        'version': dq_cache_version,
+        'rules_hash': p_utils.get_file_hash(p_constants.dq_rules_file),
+        'columns': None,
+        'results': pd.DataFrame({'DataQuality': pd.Series(dtype=object), 'DataQualityIndicator': pd.Series(dtype=object)}, index=pd.Index([], dtype='uint64')),
+        'seen': []
+    }
+    if not os.path.exists(path):
+        return cache
+    try:
+        saved = pd.read_pickle(path)
+    except Exception as e:
+        print('--- Could not read %s, assessing all records: %s' % (path, e))
+        return cache
+    if saved.get('version') != dq_cache_version:
+        print('--- %s was saved by a different version of p_utils_dq.py, assessing all records' % path)
+    elif saved['rules_hash'] != cache['rules_hash']:
+        print('--- Data quality rules file has changed, clearing the data quality cache')
+    else:
+        cache['columns'] = saved['columns']
+        cache['results'] = saved['results']
+    return cache
+
+# Function for adding the DataQuality and DataQualityIndicator fields using the data quality cache (see add_data_quality). Each record is fingerprinted by a hash of its data quality fields (see get_dq_fields). The records with a fingerprint in the cache get the cached values, the other records are assessed, and their values are added to the cache. Can be called on several chunks of a dataset with the same cache
+# The codes that do not match a rule are counted for all of the records, including the records found in the cache (see get_unknown_codes), so the diagnostics and p_constants.dq_max_unknown_codes work the same as without the cache
+def add_cached_data_quality(df, data_type, cache, workers=None):
+    fields_df = get_dq_fields(df, data_type)
+    columns = list(fields_df.columns)
+    if (cache['columns'] is not None) and (cache['columns'] != columns):
+        print('--- Data quality fields have changed (%s), clearing the data quality cache' % ', '.join(columns))
+        cache['results'] = cache['results'].iloc[0:0]
+    cache['columns'] = columns
+    keys = pd.util.hash_pandas_object(fields_df, index=False).to_numpy()
+    positions = cache['results'].index.get_indexer(keys)
+    new = positions < 0
+    print('--- %s of %s records found in the data quality cache' % (len(df) - new.sum(), len(df)))
+
+    dq = np.empty(len(df), dtype=object)
+    indicator = np.empty(len(df), dtype=object)
+    dq[~new] = cache['results']['DataQuality'].to_numpy()[positions[~new]]
+    indicator[~new] = cache['results']['DataQualityIndicator'].to_numpy()[positions[~new]]
+    if new.any():
+        # Only the columns used by the rules are passed on. The codes that do not match a rule are counted below for all of the records
+        group_ids, group_dq, _ = score_records(df.loc[new, get_dq_columns(df, data_type)], data_type, workers)
+        dq[new] = np.array([value for value, _ in group_dq], dtype=object)[group_ids]
+        indicator[new] = np.array([value for _, value in group_dq], dtype=object)[group_ids]
+        new_results = pd.DataFrame({'DataQuality': dq[new], 'DataQualityIndicator': indicator[new]}, index=pd.Index(keys[new], dtype='uint64'))
+        cache['results'] = pd.concat([cache['results'], new_results[~new_results.index.duplicated()]])
+    cache['seen'].append(keys)
+    add_dq_diagnostics(df, data_type, get_unknown_codes(df, data_type))
+
+    df['DataQuality'] = dq
+    df['DataQualityIndicator'] = indicator
+    return df
+
+# Function for saving the data quality cache of a data type for the next run. Only the fingerprints of the records seen in this run are kept, so that the cache does not grow with records that were removed from the data
+def export_dq_cache(cache, data_type):
+    results = cache['results']
+    if cache['seen']:
+        results = results[results.index.isin(np.concatenate(cache['seen']))]
+    pd.to_pickle({
+        'version': cache['version'],
+        'rules_hash': cache['rules_hash'],
+        'columns': cache['columns'],
+        'results': results
+    }, p_constants.dq_cache_file % data_type)
+
+# Function for adding the codes that do not match a rule (see score_data_quality) to the data quality diagnostics of a data type. The number of records is added up for each (column, code), and up to p_constants.dq_diagnostics_examples example records are kept, identified by the values of their p_constants.dq_diagnostics_key_cols columns. Can be called on several chunks of a dataset
+def add_dq_diagnostics(df, data_type, unknown_codes):
+    diagnostics = dq_diagnostics.setdefault(data_type, {'records': 0, 'codes': {}})
+    diagnostics['records'] += len(df)
+    key_cols = [col for col in p_constants.dq_diagnostics_key_cols if col in df.columns]
+    for (column, code), unknown in unknown_codes.items():
+        diagnostic = diagnostics['codes'].setdefault((column, code), {'records': 0, 'examples': []})
+        diagnostic['records'] += unknown['records']
+        rows = unknown['rows'][:p_constants.dq_diagnostics_examples - len(diagnostic['examples'])]
+        if rows:
+            examples = df.iloc[rows][key_cols].astype(str)
+            diagnostic['examples'].extend(examples.to_dict('records'))
+
+# Function for reporting the data quality diagnostics of a data type at the end of the data quality step: prints a table of the codes that do not match a rule (column, code, number of records) and saves the full report with the example records to a JSON file (see p_constants.dq_diagnostics_file)
+# If more codes than p_constants.dq_max_unknown_codes do not match a rule (the sum of the records of each code, so a record with two of these codes is counted twice), raises an error so the run stops before the data is used by the next steps
+def report_dq_diagnostics(data_type):
+    diagnostics = dq_diagnostics.get(data_type, {'records': 0, 'codes': {}})
+    codes = sorted(diagnostics['codes'].items(), key=lambda x: (-x[1]['records'], x[0]))
+    unknown_total = sum(diagnostic['records'] for _, diagnostic in codes)
+    report = {
+        'data_type': data_type,
+        'run_id': p_constants.run_id,
+        'rules_file': os.path.basename(p_constants.dq_rules_file),
+        'assessed_records': diagnostics['records'], # Includes the records found in the data quality cache in incremental mode
+        'unknown_code_total': unknown_total,
+        'codes': [{'column': column, 'code': code, 'records': diagnostic['records'], 'examples': diagnostic['examples']} for (column, code), diagnostic in codes]
+    }
+    path = p_constants.dq_diagnostics_file % data_type
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if codes:
+        print('--- %s codes not found in the data quality rules (found %s times, see %s):' % (len(codes), unknown_total, path))
+        table = pd.DataFrame([(column, code, diagnostic['records']) for (column, code), diagnostic in codes], columns=['Column', 'Code', 'Records'])
+        print(table.to_string(index=False))
+    if (p_constants.dq_max_unknown_codes is not None) and (unknown_total > p_constants.dq_max_unknown_codes):
+        raise ValueError('Codes that are not in the data quality rules were found %s times (limit: %s). See %s' % (unknown_total, p_constants.dq_max_unknown_codes, path))
+    return report
@@ -16,7 +16,10 @@ import pandas as pd
 import sys
 
 sys.path.insert(0, '..\\utils\\') 
+import p_archive # p_archive.py
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
+import p_query # p_query.py
 import p_utils # p_utils.py
 
 
@@ -25,27 +28,33 @@ if __name__ == '__main__':
     print('Running %s' % os.path.basename(__file__))
     print('--- Downloading data from %s' % p_constants.datamart_tables['water_quality'])
 
-    # Download water quality data (SWAMP) for select analytes on the ceden_wq_analytes list. Do not include SPoT records because they will be pulled separately with no restrictions below
-    sql_wq_swamp = "SELECT * FROM " + p_constants.datamart_tables['water_quality'] + " WHERE (Program = 'Surface Water Ambient Monitoring Program' AND ParentProject != 'SWAMP Stream Pollution Trends' AND Analyte in (" + ', '.join(["'{}'".format(value) for value in p_constants.ceden_wq_analytes]) + "))"
-    wq_swamp_df = p_utils.download_data(sql_wq_swamp,  p_constants.wq_date_cols)
+    with p_metrics.stage('download') as m:
+        # Download water quality data (SWAMP) for select analytes on the ceden_wq_analytes list. Do not include SPoT records because they will be pulled separately with no restrictions below. See p_constants.download_filters and p_constants.download_pushdown_rules for the filters of the queries
+        sql_wq_swamp, params_wq_swamp = p_query.get_download_query('water_quality_swamp', 'water_quality')
+        wq_swamp_df = p_utils.download_data(sql_wq_swamp,  p_constants.wq_date_cols, params=params_wq_swamp)
 
-    # Download water quality data (SPoT), all analytes
-    sql_wq_spot = "SELECT * FROM " + p_constants.datamart_tables['water_quality'] + " WHERE (Program = 'Surface Water Ambient Monitoring Program' AND ParentProject = 'SWAMP Stream Pollution Trends')"
-    wq_spot_df = p_utils.download_data(sql_wq_spot,  p_constants.wq_date_cols)
+        # Download water quality data (SPoT), all analytes
+        sql_wq_spot, params_wq_spot = p_query.get_download_query('water_quality_spot', 'water_quality')
+        wq_spot_df = p_utils.download_data(sql_wq_spot,  p_constants.wq_date_cols, params=params_wq_spot)
 
-    # Combine the two dataframes
-    wq_df = pd.concat([wq_swamp_df, wq_spot_df], ignore_index=True)
+        # Combine the two dataframes
+        wq_df = pd.concat([wq_swamp_df, wq_spot_df], ignore_index=True)
 
-    # Strip whitespace from StationName. See example station: 205PS0365
-    wq_df['StationName'] = wq_df['StationName'].apply(lambda x: x.strip())
+        # Convert the low-cardinality text fields to categorical columns (see p_constants.schemas). This is done after combining the two dataframes because concatenating categorical columns with different categories converts them back to text
+        wq_df = p_utils.apply_schema(wq_df, 'water_quality')
+
+        # Strip whitespace from StationName. See example station: 205PS0365
+        wq_df['StationName'] = wq_df['StationName'].apply(lambda x: x.strip())
+        m['rows_out'] = len(wq_df)
 
     # Write data file in support files folder
-    outdir = '../../support_files/'
-    p_utils.write_csv(wq_df, 'ceden_swamp_wq', outdir)
+    with p_metrics.stage('write', rows_in=len(wq_df)):
+        outdir = '../../support_files/'
+        p_utils.write_csv(wq_df, 'ceden_swamp_wq', outdir)
 
-    # Write data file in dated folder in CEDEN archive folder
-    outdir_archive = '../../ceden_files/'
-    p_utils.write_csv(wq_df, 'ceden_swamp_wq' + '_' + p_constants.today, outdir_archive + '/' + p_constants.today)
+    # Save a snapshot of the data in the CEDEN archive. Only the blocks of rows that changed since a previous run are saved (see p_archive.py)
+    with p_metrics.stage('archive', rows_in=len(wq_df)):
+        p_archive.archive_snapshot(wq_df, 'ceden_swamp_wq')
 
     print('%s finished running' % os.path.basename(__file__))
 
@@ -11,38 +11,95 @@ Updated: 03/14/2024
 '''
 
 import os
-import pandas as pd
 import sys
 
 sys.path.insert(0, '../utils/') 
 import p_constants # p_constants
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 import p_utils_dq # p_utils_dq.py
 
 
+# Function for adding the data quality fields to a dataframe of water quality records: join datum, clean data, and add the DataQuality and DataQualityIndicator fields. Each record is assessed independently of the others, so this function can be run on the whole dataset or on one chunk of the dataset at a time. The data quality cache (dq_cache, incremental mode) is shared by the chunks
+def add_data_quality_fields(wq_df, station_df, dq_cache=None):
+    # 10/15/23 - Dates are not being converted to datetime in the read_csv function for some reason, so force the changes here. The date fields are converted with the rest of the schema
+    wq_df = p_utils.apply_schema(wq_df, 'water_quality')
+    wq_df = p_utils.join_datum(wq_df, station_df) # Join datum
+    wq_df = p_utils_dq.clean_data(wq_df)
+    wq_df = p_utils_dq.add_data_quality(wq_df, 'water_quality', dq_cache)
+    return wq_df
+
+
 if __name__ == '__main__':
     p_utils.print_spacer()
     print('Running %s' % os.path.basename(__file__))
 
-    print('--- Importing data')
-    # Import SWAMP WQ data
-    wq_df = pd.read_csv('../../support_files/ceden_swamp_wq.csv', parse_dates=p_constants.wq_date_cols, low_memory=False, na_values=p_constants.allowed_nans, keep_default_na=False)
+    # Import SWAMP station data
+    with p_metrics.stage('import_stations') as m:
+        station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum'])
+        m['rows_out'] = len(station_df)
 
-    # 10/15/23 - Dates are not being converted to datetime in the read_csv function for some reason, so force the changes here
-    wq_df[p_constants.wq_date_cols] = wq_df[p_constants.wq_date_cols].apply(pd.to_datetime, errors='coerce')
+    # Arguments for importing the SWAMP WQ data
+    # Low-cardinality text fields (StationCode, Analyte, QACode, etc.) are imported as categorical columns to save memory. See p_constants.schemas
+    import_file_path = '../../support_files/ceden_swamp_wq.csv'
+    read_args = {
+        'parse_dates': p_constants.wq_date_cols,
+        'dtype': p_utils.get_schema_dtypes('water_quality'),
+        'na_values': p_constants.allowed_nans,
+        'keep_default_na': False
+    }
+    outdir = '../../support_files'
+    # In incremental mode, only the records whose data quality fields are not in the cache from the previous run are assessed (see p_constants.dq_incremental)
+    dq_cache = p_utils_dq.import_dq_cache('water_quality') if p_constants.dq_incremental else None
+    # Stop here if a column used by the data quality functions is missing (see p_constants.column_manifests)
+    p_utils.check_file_columns(import_file_path, 'wq_data_quality')
 
-    # Import SWAMP station data
-    station_df = p_utils.import_csv('../../support_files/ceden_stations.csv', fields=['StationCode', 'Datum'])
-    wq_df = p_utils.join_datum(wq_df, station_df) # Join datum
+    if p_constants.memory_budget_mb:
+        # Chunked mode: import, assess, and export the data in batches of rows that fit within the memory budget
+        # The chunks are written to a temporary file, which replaces the data quality file only after the codes that are not in the data quality rules are checked (see report_dq_diagnostics below)
+        print('--- Importing, cleaning, and adding data quality fields in chunks (memory budget: %s MB)' % p_constants.memory_budget_mb)
+        temp_name = 'swamp_wq_data_quality_%s.tmp' % os.getpid()
+        index_dfs = []
+        with p_metrics.stage('data_quality_chunks') as m:
+            m['rows_out'] = 0
+            for i, chunk_df in enumerate(p_utils.import_csv_chunks(import_file_path, p_constants.memory_budget_mb, **read_args)):
+                chunk_df = add_data_quality_fields(chunk_df, station_df, dq_cache)
+                p_utils.write_csv(chunk_df, temp_name, outdir, append=(i > 0), nan_text_cols=p_constants.nan_text_cols)
+                index_dfs.append(p_utils.get_station_index(chunk_df))
+                m['rows_out'] += len(chunk_df)
+            station_index_df = p_utils.combine_station_indexes(index_dfs)
 
-    print('--- Cleaning data')
-    wq_df = p_utils_dq.clean_data(wq_df)
+        # List the codes that are not in the data quality rules (see p_constants.dq_diagnostics_file). The temporary file is deleted if there are too many of them
+        try:
+            p_utils_dq.report_dq_diagnostics('water_quality')
+        except ValueError:
+            os.remove('%s/%s.csv' % (outdir, temp_name))
+            raise
+        os.replace('%s/%s.csv' % (outdir, temp_name), outdir + '/swamp_wq_data_quality.csv')
+    else:
+        print('--- Importing data')
+        with p_metrics.stage('import') as m:
+            wq_df = p_utils.read_csv(import_file_path, low_memory=False, **read_args)
+            m['rows_out'] = len(wq_df)
 
-    print('--- Adding data quality fields')
-    wq_dq_df = p_utils_dq.add_data_quality(wq_df)
+        print('--- Cleaning data and adding data quality fields')
+        with p_metrics.stage('data_quality', rows_in=len(wq_df)) as m:
+            wq_dq_df = add_data_quality_fields(wq_df, station_df, dq_cache)
+            m['rows_out'] = len(wq_dq_df)
 
-    print('--- Exporting data')
-    outdir = '../../support_files'
-    p_utils.write_csv(wq_dq_df, 'swamp_wq_data_quality', outdir)
+        # List the codes that are not in the data quality rules (see p_constants.dq_diagnostics_file)
+        p_utils_dq.report_dq_diagnostics('water_quality')
+
+        print('--- Exporting data')
+        with p_metrics.stage('write', rows_in=len(wq_dq_df)):
+            p_utils.write_csv(wq_dq_df, 'swamp_wq_data_quality', outdir, nan_text_cols=p_constants.nan_text_cols)
+            station_index_df = p_utils.get_station_index(wq_dq_df)
+
+    if dq_cache is not None:
+        p_utils_dq.export_dq_cache(dq_cache, 'water_quality')
+
+    # Write the station index (most recent sample date and record counts for each station). Used by the sites step
+    with p_metrics.stage('write_station_index', rows_in=len(station_index_df)):
+        p_utils.write_csv(station_index_df, 'swamp_wq_station_index', outdir)
   
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
@@ -13,19 +13,12 @@ import sys
 
 sys.path.insert(0, '../utils/')
 import p_constants # p_constants.py
+import p_metrics # p_metrics.py
 import p_utils  # p_utils.py
 
 
-if __name__ == '__main__':
-    p_utils.print_spacer()
-    print('Running %s' % os.path.basename(__file__))
-
-    print('--- Importing data')
-    #####  Import data from previous script
-    wq_df = pd.read_csv('../../support_files/swamp_wq_data_quality.csv', parse_dates=p_constants.wq_date_cols, low_memory=False)
-
-
-    ##### Remove unneeded records or records with missing data elements
+# Function for removing unneeded records or records with missing data elements. Each record is checked independently of the others, so this function can be run on the whole dataset or on one chunk of the dataset at a time
+def filter_records(wq_df):
     # Drop records with StationCode = FIELDQA_SWAMP
     wq_df = wq_df.drop(wq_df[(wq_df['StationCode'] == 'FIELDQA')].index)
     wq_df = wq_df.drop(wq_df[(wq_df['StationCode'] == 'FIELDQA_SWAMP')].index)
@@ -65,24 +58,20 @@ if __name__ == '__main__':
     wq_df = wq_df.drop(wq_df[(wq_df['CollectionReplicate'] != 1)].index)
     wq_df = wq_df.drop(wq_df[(wq_df['ResultsReplicate'] != 1)].index)
 
+    return wq_df
 
-    #####  Process data
-    print('--- Processing data')
-
-    # Strip special characters
-    wq_df.replace(r'\t',' ', regex=True, inplace=True) # tab
-    wq_df.replace(r'\r',' ', regex=True, inplace=True) # carriage return
-    wq_df.replace(r'\n',' ', regex=True, inplace=True) # newline
-    wq_df.replace(r'\f',' ', regex=True, inplace=True) # formfeed
-    wq_df.replace(r'\v',' ', regex=True, inplace=True) # vertical tab
-    wq_df.replace(r'\|', ' ', regex=True, inplace=True) # pipe
-    wq_df.replace(r'\"', ' ', regex=True, inplace=True) # quotes
+# Function for processing the filtered records and adding the fields used by the web app (censored data, analyte categories, region, program, etc.). The lookup tables are imported once and passed in, so this function can also be run on one chunk of the dataset at a time
+def process_records(wq_df, analyte_cols, station_cols, ref_cols):
+    # Strip special characters (tab, carriage return, newline, formfeed, vertical tab, pipe, quotes). Works on both text and categorical columns
+    wq_df = p_utils.strip_special_characters(wq_df)
 
     # Change date format to the standard format used by the open data portal. This format is required to query date values using the portal API
     wq_df['SampleDate'] = wq_df['SampleDate'].dt.strftime('%Y-%m-%dT%H:%M:%S')
 
     # Add fields for censored data
-    wq_censored = wq_df.apply(lambda row: p_utils.get_nd_values(row), axis=1)
+    # Only the columns used by get_nd_values are passed to it, which is much faster than creating a row with every column for each record
+    # If no records are left after filtering, apply returns the input columns instead of the 3 columns of get_nd_values, so the columns are set here. The file is then written with the header only
+    wq_censored = wq_df[p_utils.get_used_columns('nd_values', wq_df.columns)].apply(lambda row: p_utils.get_nd_values(row), axis=1).reindex(columns=[0, 1, 2])
     wq_df['ResultAdjusted'] = wq_censored[0] # This field duplicates the Result field and includes any substituted values as necessary
     wq_df['DisplayText'] = wq_censored[1]
     wq_df['Censored'] = wq_censored[2]
@@ -90,12 +79,11 @@ if __name__ == '__main__':
 
     # Add AnalyteDisplay field
     # The values in the Analyte column are not "clean" and in some cases are not what we want to have shown in the dashboard, but we still want to keep them there for reference. The app uses the AnalyteDisplay field instead of the Analyte field.
-    wq_df['Analyte'] = wq_df['Analyte'].replace('\'', '', regex=True) # Strip single quote
+    wq_df['Analyte'] = p_utils.replace_pattern(wq_df['Analyte'], '\'', '') # Strip single quote
     wq_df['AnalyteDisplay'] = wq_df['Analyte']
 
     # Add analyte categories
-    analytes_df = pd.read_csv(p_constants.analyte_list_file, dtype='unicode') 
-    analyte_cols = analytes_df[['CedenAnalyteName', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3']] 
+    analyte_cols = p_utils.match_categories(analyte_cols, 'CedenAnalyteName', wq_df['Analyte'].dtype) # Match the categorical Analyte column for a faster join
     wq_df = pd.merge(wq_df, analyte_cols, how='left', left_on='Analyte', right_on='CedenAnalyteName') 
     wq_df.drop(['CedenAnalyteName'], axis=1, inplace=True) # Drop unneeded fields
 
@@ -107,13 +95,13 @@ if __name__ == '__main__':
     wq_df['MatrixDisplay'] = wq_df['MatrixDisplay'].apply(lambda x: p_utils.get_matrix_name(x)) 
 
     # Add Region field
-    stations_df = p_utils.import_csv('../../support_files/swamp_stations.csv', date_cols=['LastSampleDate']) 
-    station_cols = stations_df[['StationCode', 'Region']] 
+    station_cols = p_utils.match_categories(station_cols, 'StationCode', wq_df['StationCode'].dtype) # Keep StationCode categorical after the join
     wq_df = pd.merge(wq_df, station_cols, how='left', on='StationCode') 
     # After joining, some records will have a blank region value. Use the first character of StationCode (usually a number in reference to the region) or leave blank
-    wq_df['Region'] = wq_df.apply(
+    wq_df['Region'] = wq_df[['StationCode', 'Region']].apply(
         lambda row: row['StationCode'][0] if np.isnan(row['Region']) else row['Region'],
-        axis=1
+        axis=1,
+        result_type='reduce' # Return a column even if there are no records
     )
 
     # Convert Region column to int first (to remove decimal point) and then to string again
@@ -133,8 +121,6 @@ if __name__ == '__main__':
     wq_df.loc[wq_df['ParentProject'].isin(p_constants.spot_parent_projects), 'Spot'] = True
 
     # Add StationCategory column for reference sites
-    ref_sites_df = p_utils.import_csv(p_constants.reference_sites_file)
-    ref_cols = ref_sites_df[['cedenid', 'StationCategory']] 
     # Left join on StationCode
     wq_df = pd.merge(wq_df, ref_cols, how='left', left_on=wq_df['StationCode'].str.lower(), right_on=ref_cols['cedenid'].str.lower())
     # Drop unneeded fields
@@ -143,10 +129,75 @@ if __name__ == '__main__':
     # Rename censored result field to 'ResultDisplay'. This is the field that the app will use to show Result values
     wq_df = wq_df.rename(columns={'ResultAdjusted': 'ResultDisplay'})
 
+    return wq_df
+
+
+if __name__ == '__main__':
+    p_utils.print_spacer()
+    print('Running %s' % os.path.basename(__file__))
 
-    #####  Write data
+    # Import the lookup tables used to add fields to the data
+    with p_metrics.stage('import_lookups'):
+        # Only the columns used by the joins are imported (see p_constants.column_manifests)
+        analytes_df = p_utils.import_stage_columns(p_constants.analyte_list_file, 'analytes_lookup', engine='pandas', dtype='unicode') 
+        analyte_cols = analytes_df[['CedenAnalyteName', 'AnalyteGroup1', 'AnalyteGroup2', 'AnalyteGroup3']] 
+        stations_df = p_utils.import_stage_columns('../../support_files/swamp_stations.csv', 'stations_lookup') 
+        station_cols = stations_df[['StationCode', 'Region']] 
+        ref_sites_df = p_utils.import_stage_columns(p_constants.reference_sites_file, 'reference_sites_lookup')
+        ref_cols = ref_sites_df[['cedenid', 'StationCategory']] 
+
+    # Arguments for importing the data from the previous script
+    import_file_path = '../../support_files/swamp_wq_data_quality.csv'
+    read_args = {
+        'parse_dates': p_constants.wq_date_cols,
+        'dtype': p_utils.get_schema_dtypes('water_quality')
+    }
     wq_file_name = 'swamp_water_quality_data'
-    # Write file in dated folder in export folder
-    p_utils.write_csv(wq_df, wq_file_name + '_' + p_constants.today, '../../export' + '/' + p_constants.today) 
+    # Stop here if a column used below is missing (see p_constants.column_manifests)
+    p_utils.check_file_columns(import_file_path, 'wq_process')
+    outdir = '../../export' + '/' + p_constants.today
+
+    if p_constants.memory_budget_mb:
+        # Chunked mode: import, filter, process, and export the data in batches of rows that fit within the memory budget. Chunks with no records left after filtering are skipped
+        print('--- Importing and processing data in chunks (memory budget: %s MB)' % p_constants.memory_budget_mb)
+        chunks_written = 0
+        with p_metrics.stage('process_chunks', rows_in=0) as m:
+            m['rows_out'] = 0
+            for chunk_df in p_utils.import_csv_chunks(import_file_path, p_constants.memory_budget_mb, **read_args):
+                m['rows_in'] += len(chunk_df)
+                chunk_df = filter_records(p_utils.apply_schema(chunk_df, 'water_quality'))
+                if len(chunk_df) == 0:
+                    empty_df = chunk_df
+                    continue
+                chunk_df = process_records(chunk_df, analyte_cols, station_cols, ref_cols)
+                p_utils.write_csv(chunk_df, wq_file_name + '_' + p_constants.today, outdir, append=(chunks_written > 0))
+                m['rows_out'] += len(chunk_df)
+                chunks_written += 1
+            # If no records are left after filtering, write a file with the header only (the same file that is written without chunks). The upload script expects the file to exist
+            if chunks_written == 0:
+                p_utils.write_csv(process_records(empty_df, analyte_cols, station_cols, ref_cols), wq_file_name + '_' + p_constants.today, outdir)
+    else:
+        print('--- Importing data')
+        #####  Import data from previous script
+        with p_metrics.stage('import') as m:
+            wq_df = p_utils.read_csv(import_file_path, low_memory=False, **read_args)
+            wq_df = p_utils.apply_schema(wq_df, 'water_quality')
+            m['rows_out'] = len(wq_df)
+
+        ##### Remove unneeded records or records with missing data elements
+        with p_metrics.stage('filter', rows_in=len(wq_df)) as m:
+            wq_df = filter_records(wq_df)
+            m['rows_out'] = len(wq_df)
+
+        #####  Process data
+        print('--- Processing data')
+        with p_metrics.stage('enrich', rows_in=len(wq_df)) as m:
+            wq_df = process_records(wq_df, analyte_cols, station_cols, ref_cols)
+            m['rows_out'] = len(wq_df)
+
+        #####  Write data
+        # Write file in dated folder in export folder
+        with p_metrics.stage('write', rows_in=len(wq_df)):
+            p_utils.write_csv(wq_df, wq_file_name + '_' + p_constants.today, outdir) 
 
     print('%s finished running' % os.path.basename(__file__))
\ No newline at end of file
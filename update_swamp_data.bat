@@ -1,6 +1,7 @@
 :: This batch file runs the multiple Python scripts used to update the data on the SWAMP Data Dashboard
 :: For a full data refresh: Because there are multiple file dependencies across scripts, the scripts should be run in a specific order (as outlined below). The main dependency is the datum data. This dataset is used in the data quality assessor for the water quality and habitat data types.
 :: For a partial data refresh: Can run one series independently from the others. Run the scripts for a data type in order. Ex. Tox #1, then Tox #2, then Tox #3. Can run this without updating the datum/station data. 
+:: The batch file stops if a data quality step fails (ex. too many codes that are not in the data quality rules, see SWAMP_DQ_MAX_UNKNOWN_CODES), so the next steps do not process and upload the data
 :: For the upload scripts, I inserted 60 second delays between each data file upload to prevent overloading the open data portal's servers with uploading all files at once
 
 @ECHO OFF
@@ -8,7 +9,11 @@
 
 set startTime=%time%
 
-:: Activate conda environment (base). Must switch back and forth between conda environments because the "base" environment does not have geopandas installed. If both pandas and geopandas are installed in the same environment, then one could use a single environment and not have to switch between two. Geopandas has some dependencies that are a bit tricky to resolve, so I have it installed in its own environment
+:: Run ID of the run metrics file (support_files/metrics/swamp_metrics_<run ID>.jsonl, see data_scripts/utils/p_metrics.py). All of the scripts below write their metrics to the same file. The ID is the date and time the batch file started (ex. 20240314_0905)
+set SWAMP_RUN_ID=%date:~-4%%date:~4,2%%date:~7,2%_%time:~0,2%%time:~3,2%
+set SWAMP_RUN_ID=%SWAMP_RUN_ID: =0%
+
+:: Activate conda environment (base). The upload scripts run in the geo_env environment because the "base" environment does not have geopandas installed. The sites step no longer needs geopandas (see data_scripts/utils/p_regions.py). If both pandas and geopandas are installed in the same environment, then one could use a single environment and not have to switch between two. Geopandas has some dependencies that are a bit tricky to resolve, so I have it installed in its own environment
 :: @CALL "C:\Anaconda-3.7\Scripts\activate.bat" base
 :: @CALL "C:\Users\MTang\Miniconda3\Scripts\activate.bat" base
 
@@ -21,6 +26,7 @@ call activate base
 cd ".\data_scripts\tissue"
 python "1_tissue_download_data.py"
 python "2_tissue_data_quality.py"
+if errorlevel 1 exit /b 1
 python "3_tissue_process_data.py" 
 
 cd "..\sites"
@@ -29,25 +35,26 @@ python "0_get_datum_data.py"
 cd "..\water_quality"
 python "1_wq_download_data.py"
 python "2_wq_data_quality.py"
+if errorlevel 1 exit /b 1
 
 cd "..\habitat"
 python "1_phab_download_data.py"
 python "2_phab_data_quality.py"
+if errorlevel 1 exit /b 1
 
 cd "..\toxicity"
 python "1_tox_download_data.py"
+if errorlevel 1 exit /b 1
+
+:: Delete the blocks of the CEDEN archive that are no longer used by any snapshot (see data_scripts/utils/p_archive.py). The download scripts do not delete blocks, because another download script may be running
+cd "..\utils"
+python "p_archive.py" compact
 
 cd "..\sites"
 python "1_sites_get_data.py"
 
-:: Need to change env for geopandas
-call "C:\ProgramData\anaconda3\Scripts\activate.bat" geo_env
-
 python "2_sites_add_region.py"
 
-:: Change back to base
-call "C:\ProgramData\anaconda3\Scripts\activate.bat" base
-
 cd "..\water_quality"
 python "3_wq_process_data.py"
 
@@ -57,6 +64,10 @@ python "3_phab_process_data.py"
 cd "..\toxicity"
 python "2_tox_process_data.py"
 
+:: Summarize the exported datasets for each station, analyte, matrix, and unit (station summary tables for the dashboard)
+cd "..\summary"
+python "1_station_summary.py"
+
 :: Upload files
 
 :: Needed for chunked upload to run
@@ -83,6 +94,11 @@ timeout 60 >nul
 
 cd "..\tissue"
 python "4_tissue_upload_portal.py"
+timeout 60 >nul
+
+:: Upload the station summary tables. The tables without a portal resource ID are skipped (see data_scripts/utils/p_constants.py)
+cd "..\summary"
+python "2_station_summary_upload_portal.py"
 
 :: Switch back to base environment
 @CALL "C:\ProgramData\anaconda3\Scripts\activate.bat" base